@@ -5,7 +5,8 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    # definitions/ vorher mit `python hl7_definitions.py` erzeugen
+    datas=[('definitions', 'definitions')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
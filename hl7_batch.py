@@ -0,0 +1,151 @@
+# hl7_batch.py
+import mmap
+import os
+import re
+from array import array
+
+from hl7_parser import decode_hl7
+
+
+# A message starts with MSH at the beginning of a line or right after the
+# MLLP start block. Batch envelope segments (FHS/BHS/BTS/FTS) end the
+# previous message but are not part of any message.
+_BOUNDARY = re.compile(rb"[\r\n\x0b\x1c](?:MSH|FHS|BHS|BTS|FTS)")
+_TRAILING = b"\r\n\x0b\x1c \t"
+_LINE_SPLIT = re.compile(rb"\r\n|[\r\n]")
+_ENVELOPE_SEGMENTS = (b"FHS", b"BHS", b"BTS", b"FTS")
+
+HEADER_PEEK_BYTES = 1024
+PROGRESS_EVERY = 10000
+
+
+# Memory-mapped HL7 batch file (FHS/BHS batches, MLLP captures or plain
+# concatenated messages). Only the message boundaries are kept in memory.
+class BatchFile:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = b""
+        self.starts = array("Q")
+        self.ends = array("Q")
+
+    def __len__(self):
+        return len(self.starts)
+
+    def size(self):
+        return len(self._map)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    # Liefert (starts, ends) oder None, wenn abgebrochen wurde
+    def scan(self, progress=None, is_cancelled=lambda: False):
+        data = self._map
+        starts = array("Q")
+        ends = array("Q")
+        current = 0 if data[:3] == b"MSH" else None
+
+        for count, match in enumerate(_BOUNDARY.finditer(data)):
+            pos = match.start() + 1
+            if current is not None:
+                starts.append(current)
+                ends.append(self._trim_end(current, pos))
+                current = None
+            if data[pos:pos + 3] == b"MSH":
+                current = pos
+
+            if count % PROGRESS_EVERY == 0:
+                if is_cancelled():
+                    return None
+                if progress is not None:
+                    progress(len(starts))
+
+        if current is not None:
+            starts.append(current)
+            ends.append(self._trim_end(current, len(data)))
+        return starts, ends
+
+    def set_index(self, index):
+        self.starts, self.ends = index
+
+    def _trim_end(self, start, end):
+        data = self._map
+        while end > start and data[end - 1] in _TRAILING:
+            end -= 1
+        return end
+
+    def message_bytes(self, index):
+        return self._map[self.starts[index]:self.ends[index]]
+
+    def message_text(self, index):
+        return decode_message(self.message_bytes(index))
+
+    # MSH-9, MSH-10 und MSH-7 für die Nachrichtenliste, ohne die ganze Nachricht zu lesen
+    def summary(self, index):
+        start = self.starts[index]
+        head = self._map[start:min(self.ends[index], start + HEADER_PEEK_BYTES)]
+        return message_summary(decode_message(re.split(rb"[\r\n]", head, maxsplit=1)[0]))
+
+
+# MSH-9, MSH-10 und MSH-7 aus der ersten Zeile einer Nachricht
+def message_summary(text):
+    line = re.split(r"[\r\n]", text, maxsplit=1)[0]
+    if len(line) < 4:
+        return line
+    parts = line.split(line[3]) + [""] * 10
+    return f"{parts[8]}  {parts[9]}  {parts[6]}"
+
+
+# Alle Nachrichten einer Datei als Text, z.B. zum erneuten Senden
+def read_batch_messages(path):
+    batch = BatchFile(path)
+    try:
+        batch.set_index(batch.scan())
+        return [batch.message_text(i) for i in range(len(batch))]
+    finally:
+        batch.close()
+
+
+# Zeichensatz aus MSH-18, sonst UTF-8 bzw. Latin-1
+def decode_message(data):
+    return decode_hl7(data)
+
+
+# Zerlegt einen Datenstrom (z.B. stdin) in Nachrichten, ohne ihn ganz einzulesen.
+# Segmente der gelieferten Nachrichten sind mit \r getrennt.
+def iter_stream_messages(stream, chunk_size=1 << 16):
+    pending = b""
+    message = []
+
+    while pending is not None:
+        chunk = stream.read(chunk_size)
+        if chunk:
+            lines = _LINE_SPLIT.split(pending + chunk)
+            pending = lines.pop()
+        else:
+            lines = [pending]
+            pending = None
+
+        for line in lines:
+            line = line.lstrip(b"\x0b").rstrip(b"\x1c")
+            if not line.strip():
+                continue
+            head = line[:3]
+            if head == b"MSH" or head in _ENVELOPE_SEGMENTS:
+                if message:
+                    yield decode_message(b"\r".join(message))
+                    message = []
+                if head != b"MSH":
+                    continue
+            elif not message:
+                # Daten vor der ersten MSH gehören zu keiner Nachricht
+                continue
+            message.append(line)
+
+    if message:
+        yield decode_message(b"\r".join(message))
@@ -0,0 +1,196 @@
+# hl7_benchmark.py
+#
+# Benchmarks für Parser, Darstellung und Legende mit JSON-Baseline:
+#
+#   python hl7_benchmark.py --save          # Baseline auf diesem Rechner anlegen
+#   python hl7_benchmark.py                 # mit Baseline vergleichen, Exit-Code 1 bei Regression
+#   python hl7_benchmark.py --filter legend --repeat 10
+#
+# Die Qt-Teile laufen mit der offscreen-Plattform, es öffnet sich kein Fenster.
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from hl7_synthetic import MESSAGE_TYPES, generate_message
+
+
+BENCHMARK_SIZES = (10, 500, 5000)
+DEFAULT_BASELINE = Path(__file__).parent / "benchmarks" / "baseline.json"
+# Erlaubte Verlangsamung gegenüber der Baseline, bevor ein Lauf fehlschlägt
+DEFAULT_TOLERANCE = 0.30
+DEFAULT_REPEAT = 5
+# hl7apy ist für große Nachrichten sehr langsam und wird nur bis zu dieser Größe gemessen
+HL7APY_MAX_SEGMENTS = 500
+
+
+def measure(function, repeat=DEFAULT_REPEAT):
+    function()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000, min(timings) * 1000
+
+
+def benchmark_messages():
+    for message_type in MESSAGE_TYPES:
+        for size in BENCHMARK_SIZES:
+            yield f"{message_type}-{size}", generate_message(message_type, size, repetitions=3, seed=size)
+
+
+def parser_benchmarks(messages):
+    from hl7_parser import parse_hl7
+    for label, text in messages:
+        yield f"parse_hl7/{label}", lambda text=text: parse_hl7(text)
+
+
+def hl7apy_benchmarks(messages):
+    try:
+        from hl7apy.parser import parse_message
+    except ImportError:
+        print("hl7apy is not installed, skipping hl7apy benchmarks", file=sys.stderr)
+        return
+    for label, text in messages:
+        if text.count("\r") + 1 <= HL7APY_MAX_SEGMENTS:
+            yield f"hl7apy/{label}", lambda text=text: parse_message(text, find_groups=False)
+
+
+# Die Schritte von HL7Tab.update_view einzeln: Parsen im Worker, Dokument schreiben,
+# Legende aufbauen, sowie alles zusammen ohne Segment-Cache. Dazu das komplette
+# Einfärben des Eingabefelds (beim Öffnen; beim Tippen nur die geänderte Zeile).
+def view_benchmarks(messages):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtGui import QTextDocument
+    from PySide6.QtWidgets import QApplication
+    import main
+    from hl7_legend import segment_node
+
+    app = QApplication.instance() or QApplication([])
+    tab = main.HL7Tab()
+    tab.resize(1500, 650)
+    tab.show()
+    writer = main.SegmentDocumentWriter()
+
+    def apply(result):
+        tab._segment_cache = {}
+        tab._cache_context = None
+        tab._apply_parse_result(result)
+        app.processEvents()
+
+    def build_legend(result):
+        rendered = result["segments"]
+        nodes = [segment_node(rendered[key][1], rendered[key][2]) for key in result["keys"]]
+        tab.legend_model.set_segments(nodes)
+        tab._expand_legend()
+
+    for label, text in messages:
+        text = text.replace("\r", "\n")
+        result = main.parse_segments(text, None, frozenset())
+        input_document = QTextDocument(text, tab)
+        highlighter = main.HL7Highlighter(input_document)
+        lines = [(result["segments"][key][1], result["segments"][key][0]) for key in result["keys"]]
+
+        yield f"view/parse_segments/{label}", lambda text=text: main.parse_segments(text, None, frozenset())
+        yield f"view/document/{label}", lambda lines=lines: writer.write(tab.hl7_view.document(), lines)
+        yield f"view/legend/{label}", lambda result=result: build_legend(result)
+        yield f"view/highlight/{label}", highlighter.rehighlight
+        yield f"view/apply/{label}", lambda result=result: apply(result)
+
+
+def run_benchmarks(name_filter="", repeat=DEFAULT_REPEAT, include_view=True):
+    messages = list(benchmark_messages())
+    groups = [parser_benchmarks, hl7apy_benchmarks]
+    if include_view:
+        groups.append(view_benchmarks)
+
+    results = {}
+    for group in groups:
+        for name, function in group(messages):
+            if name_filter not in name:
+                continue
+            median, fastest = measure(function, repeat)
+            results[name] = {"median_ms": round(median, 3), "min_ms": round(fastest, 3)}
+            print(f"{name:<40} {median:>10.2f} ms", file=sys.stderr)
+    return results
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["results"]
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.node(),
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+# Liefert die Namen aller Benchmarks, die langsamer als Baseline * (1 + tolerance) sind
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    print(f"\n{'benchmark':<40} {'median':>10} {'baseline':>10} {'ratio':>7}")
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            print(f"{name:<40} {result['median_ms']:>10.2f} {'-':>10} {'new':>7}")
+            continue
+        ratio = result["median_ms"] / reference["median_ms"] if reference["median_ms"] else 1.0
+        marker = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        print(f"{name:<40} {result['median_ms']:>10.2f} {reference['median_ms']:>10.2f} {ratio:>6.2f}x{marker}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="hl7_benchmark", description="HL7 Lookup benchmarks")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="Write the results as new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown before failing (default: 0.30 = 30%%)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per benchmark")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this text")
+    parser.add_argument("--no-gui", action="store_true", help="Skip the Qt benchmarks")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.filter, args.repeat, not args.no_gui)
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, run with --save first", file=sys.stderr)
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) slower than baseline by more than "
+              f"{args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
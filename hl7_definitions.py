@@ -1,33 +1,672 @@
 # hl7_definitions.py
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from collections import namedtuple
+from pathlib import Path
 
+
+# Anzeige-Labels für Felder ("SEG_n") und Komponenten ("SEG_n.m")
 FRIENDLY_FIELD_NAMES = {
-    'MSH': {
-        9: 'Message Type',
-        10: 'Message Control ID',
-        11: 'Processing ID',
-        12: 'Version ID',
-    },
-    'PID': {
-        3: 'Patient ID',
-        5: 'Patient Name',
-        7: 'Date of Birth',
-        8: 'Gender',
-    },
-    # Weitere Segmente hier...
+    # MSH – Message Header (aus HL7‑Soup & Smile CDR)
+    "MSH_1": "MSH‑1  –  Field Separator",
+    "MSH_2": "MSH‑2  –  Encoding Characters",
+    "MSH_2.1": "    MSH‑2.1  –  Component-Separator",
+    "MSH_2.2": "    MSH‑2.2  –  Repetition Separator",
+    "MSH_2.3": "    MSH‑2.3  –  Escape Character '\\'",
+    "MSH_2.4": "    MSH‑2.4  –  Subcomponent Separator '&'",
+    "MSH_3": "MSH‑3  –  Sending Application",
+    "MSH_3.2": "    MSH‑3.2  –  Sending Application (Universal ID)",
+    "MSH_3.3": "    MSH‑3.3  –  Sending Application (Universal ID Type)",
+    "MSH_4": "MSH‑4  –  Sending Facility",
+    "MSH_4.2": "    MSH‑4.2  –  Sending Facility (Universal ID)",
+    "MSH_4.3": "    MSH‑4.3  –  Sending Facility (Universal ID Type)",
+    "MSH_5": "MSH‑5  –  Receiving Application",
+    "MSH_5.2": "    MSH‑5.2  –  Receiving Application (Universal ID)",
+    "MSH_5.3": "    MSH‑5.3  –  Receiving Application (Universal ID Type)",
+    "MSH_6": "MSH‑6  –  Receiving Facility",
+    "MSH_6.2": "    MSH‑6.2  –  Receiving Facility (Universal ID)",
+    "MSH_6.3": "    MSH‑6.3  –  Receiving Facility (Universal ID Type)",
+    "MSH_7": "MSH‑7  –  Date/Time Of Message",
+    "MSH_8": "MSH‑8  –  Security",
+    "MSH_9": "MSH‑9  –  Message Type",
+    "MSH_9.1": "    MSH‑9.1  –  Message Type",
+    "MSH_9.2": "    MSH‑9.2  –  Trigger Event",
+    "MSH_9.3": "    MSH‑9.3  –  Message Structure",
+    "MSH_10": "MSH‑10  –  Message Control ID",
+    "MSH_11": "MSH‑11  –  Processing ID",
+    "MSH_12": "MSH‑12  –  Version ID",
+    "MSH_13": "MSH‑13  –  Sequence Number",
+    "MSH_14": "MSH‑14  –  Continuation Pointer",
+    "MSH_15": "MSH‑15  –  Accept Acknowledgment Type",
+    "MSH_16": "MSH‑16  –  Application Acknowledgment Type",
+    "MSH_17": "MSH‑17  –  Country Code",
+    "MSH_18": "MSH‑18  –  Character Set",
+    "MSH_19": "MSH‑19  –  Principal Language",
+
+    # PV1 – Patient Visit (aus Rhapsody: alle Felder bis 52)
+    "PV1_1": "PV1‑1 – Set ID – PV1",
+    "PV1_2": "PV1‑2 – Patient Class",
+    "PV1_3": "PV1‑3 – Assigned Patient Location",
+    "PV1_3.1": "    PV1‑3.1 – Point Of Care",
+    "PV1_3.2": "    PV1‑3.2 – Room",
+    "PV1_3.3": "    PV1‑3.3 – Bed",
+    "PV1_3.4": "    PV1‑3.4 – Facility",
+    "PV1_4": "PV1‑4 – Admission Type",
+    "PV1_5": "PV1‑5 – Preadmit Number",
+    "PV1_6": "PV1‑6 – Prior Patient Location",
+    "PV1_7": "PV1‑7 – Attending Doctor",
+    "PV1_7.1": "    PV1‑7.1 – Attending Physician Code",
+    "PV1_7.2": "    PV1‑7.2 – Attending Last Name",
+    "PV1_7.3": "    PV1‑7.3 – Attending First Name",
+    "PV1_7.4": "    PV1‑7.4 – Attending Doctor",
+    "PV1_7.5": "    PV1‑7.5 – Attending Suffix",
+    "PV1_7.6": "    PV1‑7.6 – Attending Doctor",
+    "PV1_7.7": "    PV1‑7.7 – Attending Credentials",
+    "PV1_8": "PV1‑8 – Referring Doctor",
+    "PV1_9": "PV1‑9 – Consulting Doctor",
+    "PV1_10": "PV1‑10 – Hospital Service",
+    "PV1_11": "PV1‑11 – Temporary Location",
+    "PV1_12": "PV1‑12 – Preadmit Test Indicator",
+    "PV1_13": "PV1‑13 – Re‑admission Indicator",
+    "PV1_14": "PV1‑14 – Admit Source",
+    "PV1_15": "PV1‑15 – Ambulatory Status",
+    "PV1_16": "PV1‑16 – VIP Indicator",
+    "PV1_17": "PV1‑17 – Admitting Doctor",
+    "PV1_18": "PV1‑18 – Patient Type",
+    "PV1_19": "PV1‑19 – Visit Number",
+    "PV1_20": "PV1‑20 – Financial Class",
+    "PV1_21": "PV1‑21 – Charge Price Indicator",
+    "PV1_22": "PV1‑22 – Courtesy Code",
+    "PV1_23": "PV1‑23 – Credit Rating",
+    "PV1_24": "PV1‑24 – Contract Code",
+    "PV1_25": "PV1‑25 – Contract Effective Date",
+    "PV1_26": "PV1‑26 – Contract Amount",
+    "PV1_27": "PV1‑27 – Contract Period",
+    "PV1_28": "PV1‑28 – Interest Code",
+    "PV1_29": "PV1‑29 – Transfer to Bad Debt Code",
+    "PV1_30": "PV1‑30 – Transfer to Bad Debt Date",
+    "PV1_31": "PV1‑31 – Bad Debt Agency Code",
+    "PV1_32": "PV1‑32 – Bad Debt Transfer Amount",
+    "PV1_33": "PV1‑33 – Bad Debt Recovery Amount",
+    "PV1_34": "PV1‑34 – Delete Account Indicator",
+    "PV1_35": "PV1‑35 – Delete Account Date",
+    "PV1_36": "PV1‑36 – Discharge Disposition",
+    "PV1_37": "PV1‑37 – Discharged to Location",
+    "PV1_38": "PV1‑38 – Diet Type",
+    "PV1_39": "PV1‑39 – Servicing Facility",
+    "PV1_40": "PV1‑40 – Bed Status",
+    "PV1_41": "PV1‑41 – Account Status",
+    "PV1_42": "PV1‑42 – Pending Location",
+    "PV1_43": "PV1‑43 – Prior Temporary Location",
+    "PV1_44": "PV1‑44 – Admit Date/Time",
+    "PV1_45": "PV1‑45 – Discharge Date/Time",
+    "PV1_46": "PV1‑46 – Current Patient Balance",
+    "PV1_47": "PV1‑47 – Total Charges",
+    "PV1_48": "PV1‑48 – Total Adjustments",
+    "PV1_49": "PV1‑49 – Total Payments",
+    "PV1_50": "PV1‑50 – Alternate Visit ID",
+    "PV1_51": "PV1‑51 – Visit Indicator",
+    "PV1_52": "PV1‑52 – Other Healthcare Provider",
+
+    # PV2 – Patient Visit - Additional Information
+    "PV2_1": "PV2‑1  –  Prior Pending Location",
+    "PV2_1.1": "    PV2‑1.1  –  Point of Care",
+    "PV2_1.2": "    PV2‑1.2  –  Room",
+    "PV2_1.3": "    PV2‑1.3  –  Bed",
+    "PV2_1.4": "    PV2‑1.4  –  Facility",
+    "PV2_1.5": "    PV2‑1.5  –  Location Status",
+    "PV2_1.6": "    PV2‑1.6  –  Person Location Type",
+    "PV2_1.7": "    PV2‑1.7  –  Building",
+    "PV2_1.8": "    PV2‑1.8  –  Floor",
+    "PV2_1.9": "    PV2‑1.9  –  Location Description",
+    "PV2_2": "PV2‑2  –  Accommodation Code",
+    "PV2_2.1": "    PV2‑2.1  –  Identifier",
+    "PV2_2.2": "    PV2‑2.2  –  Text",
+    "PV2_2.3": "    PV2‑2.3  –  Name of Coding System",
+    "PV2_2.4": "    PV2‑2.4  –  Alternate Identifier",
+    "PV2_2.5": "    PV2‑2.5  –  Alternate Text",
+    "PV2_2.6": "    PV2‑2.6  –  Name of Alternate Coding System",
+    "PV2_3": "PV2‑3  –  Admit Reason",
+    "PV2_4": "PV2‑4  –  Transfer Reason",
+    "PV2_5": "PV2‑5  –  Patient Valuables",
+    "PV2_6": "PV2‑6  –  Patient Valuables Location",
+    "PV2_7": "PV2‑7  –  Visit User Code",
+    "PV2_8": "PV2‑8  –  Expected Admit Date/Time",
+    "PV2_9": "PV2‑9  –  Expected Discharge Date/Time",
+    "PV2_10": "PV2‑10  –  Estimated Length of Inpatient Stay",
+    "PV2_11": "PV2‑11  –  Actual Length of Inpatient Stay",
+    "PV2_12": "PV2‑12  –  Visit Description",
+    "PV2_13": "PV2‑13  –  Referral Source Code",
+    "PV2_14": "PV2‑14  –  Previous Service Date",
+    "PV2_15": "PV2‑15  –  Employment Illness Related Indicator",
+    "PV2_16": "PV2‑16  –  Purge Status Code",
+    "PV2_17": "PV2‑17  –  Purge Status Date",
+    "PV2_18": "PV2‑18  –  Special Program Code",
+    "PV2_19": "PV2‑19  –  Retention Indicator",
+    "PV2_20": "PV2‑20  –  Expected Number of Insurance Plans",
+    "PV2_21": "PV2‑21  –  Visit Publicity Code",
+    "PV2_22": "PV2‑22  –  Visit Protection Indicator",
+    "PV2_23": "PV2‑23  –  Clinic Organization Name",
+    "PV2_24": "PV2‑24  –  Patient Status Code",
+    "PV2_25": "PV2‑25  –  Visit Priority Code",
+    "PV2_26": "PV2‑26  –  Previous Treatment Date",
+    "PV2_27": "PV2‑27  –  Expected Discharge Disposition",
+    "PV2_28": "PV2‑28  –  Signature on File Date",
+    "PV2_29": "PV2‑29  –  First Similar Illness Date",
+    "PV2_30": "PV2‑30  –  Patient Charge Adjustment Code",
+    "PV2_31": "PV2‑31  –  Recurring Service Code",
+    "PV2_32": "PV2‑32  –  Billing Patient Location",
+    "PV2_33": "PV2‑33  –  Visit Care Code",
+    "PV2_34": "PV2‑34  –  Visit Code",
+    "PV2_35": "PV2‑35  –  Visit Description - Long",
+    "PV2_36": "PV2‑36  –  Account Status",
+    "PV2_37": "PV2‑37  –  Pending Location",
+    "PV2_37.1": "    PV2‑37.1  –  Point of Care",
+    "PV2_37.2": "    PV2‑37.2  –  Room",
+    "PV2_37.3": "    PV2‑37.3  –  Bed",
+    "PV2_37.4": "    PV2‑37.4  –  Facility",
+    "PV2_37.5": "    PV2‑37.5  –  Location Status",
+    "PV2_37.6": "    PV2‑37.6  –  Person Location Type",
+    "PV2_37.7": "    PV2‑37.7  –  Building",
+    "PV2_37.8": "    PV2‑37.8  –  Floor",
+    "PV2_37.9": "    PV2‑37.9  –  Location Description",
+    "PV2_38": "PV2‑38  –  Prior Patient Location",
+    "PV2_38.1": "    PV2‑38.1  –  Point of Care",
+    "PV2_38.2": "    PV2‑38.2  –  Room",
+    "PV2_38.3": "    PV2‑38.3  –  Bed",
+    "PV2_38.4": "    PV2‑38.4  –  Facility",
+    "PV2_38.5": "    PV2‑38.5  –  Location Status",
+    "PV2_38.6": "    PV2‑38.6  –  Person Location Type",
+    "PV2_38.7": "    PV2‑38.7  –  Building",
+    "PV2_38.8": "    PV2‑38.8  –  Floor",
+    "PV2_38.9": "    PV2‑38.9  –  Location Description",
+    "PV2_39": "PV2‑39  –  Admit Source Code",
+    "PV2_40": "PV2‑40  –  Ambulatory Status",
+    "PV2_41": "PV2‑41  –  VIP Indicator",
+    "PV2_42": "PV2‑42  –  Admission Type Code",
+    "PV2_43": "PV2‑43  –  Visit Indicator",
+    "PV2_44": "PV2‑44  –  Other Healthcare Provider",
+
+
+
+    #PID - Patient Identification
+    "PID_1": "PID 1 - Set ID - PID",
+    "PID_2": "PID 2 - Patient ID (External ID)",
+    "PID_3": "PID 3 - Patient Identifier List",
+    "PID_3.1": "    PID‑3.1 – ID",
+    "PID_3.2": "    PID‑3.2 – Check Digit",
+    "PID_3.3": "    PID‑3.3 – Check Digit Scheme",
+    "PID_3.4": "    PID‑3.4 – Assigning Authority",
+    "PID_3.5": "    PID‑3.5 – Identifier Type Code",
+    "PID_3.6": "    PID‑3.6 – Assigning Facility",
+    "PID_3.7": "    PID‑3.7 – Effective Date",
+    "PID_3.8": "    PID‑3.8 – Expiration Date",
+    "PID_4": "PID 4 - Alternate Patient ID",
+    "PID_5": "PID 5 - Patient Name",
+    "PID_5.1": "    PID‑5.1 – Patient Last Name",
+    "PID_5.2": "    PID‑5.2 – Patient First Name",
+    "PID_5.3": "    PID‑5.3 – Patient Middle Name",
+    "PID_5.4": "    PID‑5.4 – Patient Suffix",
+    "PID_6": "PID 6 - Mother's Maiden Name",
+    "PID_7": "PID 7 - Date/Time of Birth",
+    "PID_8": "PID 8 - Administrative Sex",
+    "PID_9": "PID 9 - Patient Alias",
+    "PID_10": "PID 10 - Race",
+    "PID_11": "PID 11 - Patient Address",
+    "PID_11.1": "    PID 11.1 - Street 1",
+    "PID_11.2": "    PID 11.2 - Street 2",
+    "PID_11.3": "    PID 11.3 - City",
+    "PID_11.4": "    PID 11.4 - State",
+    "PID_11.5": "    PID 11.5 - Postal Code",
+    "PID_11.6": "    PID 11.6 - Country",
+    "PID_12": "PID 12 - County Code",
+    "PID_13": "PID 13 - Phone Number - Home",
+    "PID_14": "PID 14 - Phone Number - Business",
+    "PID_15": "PID 15 - Primary Language",
+    "PID_16": "PID 16 - Marital Status",
+    "PID_17": "PID 17 - Religion",
+    "PID_18": "PID 18 - Patient Account Number",
+    "PID_19": "PID 19 - SSN Number - Patient",
+    "PID_20": "PID 20 - Driver's License Number - Patient",
+    "PID_21": "PID 21 - Mother's Identifier",
+    "PID_22": "PID 22 - Ethnic Group",
+    "PID_23": "PID 23 - Birth Place",
+    "PID_24": "PID 24 - Multiple Birth Indicator",
+    "PID_25": "PID 25 - Birth Order",
+    "PID_26": "PID 26 - Citizenship",
+    "PID_27": "PID 27 - Veterans Military Status",
+    "PID_28": "PID 28 - Nationality",
+    "PID_29": "PID 29 - Patient Death Date and Time",
+    "PID_30": "PID 30 - Patient Death Indicator",
+
+    # EVN – Event Type (Standardfelder)
+    "EVN_1": "EVN‑1 – Event Type Code",
+    "EVN_2": "EVN‑2 – Recorded Date/Time",
+    "EVN_3": "EVN‑3 – Date/Time Planned Event",
+    "EVN_4": "EVN‑4 – Event Reason Code",
+    "EVN_5": "EVN‑5 – Operator ID",
+    "EVN_6": "EVN‑6 – Event Occurred (Date/Time)?",
+    "EVN_7": "EVN‑7 – Event Facility",
+
+    # NK1 – Next of Kin / Associated Party (typische Felder)
+    "NK1_1": "NK1‑1 – Set ID – NK1",
+    "NK1_2": "NK1‑2 – Name",
+    "NK1_3": "NK1‑3 – Relationship",
+    "NK1_4": "NK1‑4 – Address",
+    "NK1_5": "NK1‑5 – Phone Number",
+    "NK1_6": "NK1‑6 – Business Phone Number",
+    "NK1_7": "NK1‑7 – Contact Role",
+    "NK1_8": "NK1‑8 – Start Date",
+    "NK1_9": "NK1‑9 – End Date",
+    "NK1_10": "NK1‑10 – Next of Kin / Associated Parties Job Title",
+
+    # AL1 – Allergy Information
+    "AL1_1": "AL1‑1 – Set ID – AL1",
+    "AL1_2": "AL1‑2 – Allergen Type Code",
+    "AL1_3": "AL1‑3 – Allergen Code/Mnemonic/Description",
+    "AL1_4": "AL1‑4 – Allergy Severity Code",
+    "AL1_5": "AL1‑5 – Allergy Reaction",
+    "AL1_6": "AL1‑6 – Identification Date",
+
+    # DG1 – Diagnosis
+    "DG1_1": "DG1‑1 – Set ID – DG1",
+    "DG1_2": "DG1‑2 – Diagnosis Coding Method",
+    "DG1_3": "DG1‑3 – Diagnosis Code",
+    "DG1_4": "DG1‑4 – Diagnosis Description",
+    "DG1_5": "DG1‑5 – Diagnosis Date/Time",
+    "DG1_6": "DG1‑6 – Diagnosis Type",
+    "DG1_7": "DG1‑7 – Major Diagnostic Category",
+    "DG1_8": "DG1‑8 – Diagnostic Related Group",
+
+    # IN1 – Insurance
+    "IN1_1": "IN1‑1 – Set ID – IN1",
+    "IN1_2": "IN1‑2 – Insurance Plan ID",
+    "IN1_3": "IN1‑3 – Insurance Company ID",
+    "IN1_4": "IN1‑4 – Insurance Company Name",
+    "IN1_5": "IN1‑5 – Insurance Company Address",
+    "IN1_6": "IN1‑6 – Insurance Co Contact Person",
+    "IN1_7": "IN1‑7 – Insurance Co Phone Number",
+    "IN1_8": "IN1‑8 – Group Number",
+    "IN1_9": "IN1‑9 – Group Name",
+    "IN1_10": "IN1‑10 – Insured's Group Emp ID",
+    "IN1_11": "IN1‑11 – Insured's Group Emp Name",
+    "IN1_12": "IN1‑12 – Plan Effective Date",
+    "IN1_13": "IN1‑13 – Plan Expiration Date",
+    "IN1_14": "IN1‑14 – Authorization Information",
+    "IN1_15": "IN1‑15 – Plan Type",
 }
 
 FIELD_DESCRIPTIONS = {
-    'MSH': {
-        9: 'Identifies the message type (e.g., ADT^A01)',
-        10: 'Unique ID for the message',
-        11: 'Processing type (e.g., P for Production)',
-        12: 'HL7 version (e.g., 2.5)',
-    },
-    'PID': {
-        3: 'Unique patient identifier',
-        5: 'Full patient name (last^first^middle)',
-        7: 'Patient’s date of birth',
-        8: 'Gender of the patient',
-    },
+    "MSH_9": "Identifies the message type (e.g., ADT^A01)",
+    "MSH_10": "Unique ID for the message",
+    "MSH_11": "Processing type (e.g., P for Production)",
+    "MSH_12": "HL7 version (e.g., 2.5)",
+    "PID_3": "Unique patient identifier",
+    "PID_5": "Full patient name (last^first^middle)",
+    "PID_7": "Patient’s date of birth",
+    "PID_8": "Gender of the patient",
     # Weitere Beschreibungen hier...
 }
+
+
+FieldDefinition = namedtuple("FieldDefinition", ["label", "name", "description", "components", "datatype"],
+                             defaults=("",))
+
+# "PID‑3.1 – ID" -> "ID"
+_LABEL_PREFIX = re.compile(r"^\s*[A-Z0-9]{3}[\s‑-]*\d+(?:\.\d+)?\s*[–-]\s*")
+
+
+# Felddefinitionen eines Segments, als Tupel nach Feldnummer indiziert
+class SegmentDefinition:
+    __slots__ = ("name", "fields", "_missing", "_component_names")
+
+    def __init__(self, name, fields=()):
+        self.name = name
+        self.fields = fields
+        self._missing = {}
+        self._component_names = {}
+
+    def field(self, index):
+        if index < len(self.fields) and self.fields[index] is not None:
+            return self.fields[index]
+        # Unbekannte Felder werden einmal erzeugt und dann wiederverwendet
+        definition = self._missing.get(index)
+        if definition is None:
+            definition = FieldDefinition(f"{self.name}_{index}", f"Field {index}", "", ())
+            self._missing[index] = definition
+        return definition
+
+    def component_label(self, index, component):
+        components = self.field(index).components
+        if component < len(components) and components[component] is not None:
+            return components[component]
+        key = (index, component)
+        label = self._missing.get(key)
+        if label is None:
+            label = f"{self.name}_{index}.{component}"
+            self._missing[key] = label
+        return label
+
+    # Komponentenname ohne "SEG‑n.m –" Präfix, z.B. "Family Name"
+    def component_name(self, index, component):
+        key = (index, component)
+        name = self._component_names.get(key)
+        if name is None:
+            name = self._component_names[key] = _short_name(self.component_label(index, component))
+        return name
+
+
+def _short_name(label):
+    return _LABEL_PREFIX.sub("", label).strip()
+
+
+def _build_registry():
+    fields = {}
+    components = {}
+
+    for key, label in FRIENDLY_FIELD_NAMES.items():
+        seg_name, _, position = key.partition("_")
+        field_number, _, component_number = position.partition(".")
+        if component_number:
+            components.setdefault((seg_name, int(field_number)), {})[int(component_number)] = label
+        else:
+            fields.setdefault(seg_name, {})[int(field_number)] = label
+
+    registry = {}
+    for seg_name, labels in fields.items():
+        seg_name = sys.intern(seg_name)
+        table = [None] * (max(labels) + 1)
+        for number, label in labels.items():
+            sub_labels = components.get((seg_name, number), {})
+            sub_table = [None] * (max(sub_labels, default=0) + 1)
+            for sub_number, sub_label in sub_labels.items():
+                sub_table[sub_number] = sub_label
+            description = FIELD_DESCRIPTIONS.get(f"{seg_name}_{number}", "")
+            table[number] = FieldDefinition(label, _short_name(label), description, tuple(sub_table))
+        registry[seg_name] = SegmentDefinition(seg_name, tuple(table))
+    return registry
+
+
+SEGMENT_DEFINITIONS = _build_registry()
+
+
+def get_segment_definition(seg_name, version=None):
+    if version is not None:
+        dictionary = _get_dictionary(version)
+        if dictionary is not None:
+            return dictionary.segment(seg_name)
+
+    definition = SEGMENT_DEFINITIONS.get(seg_name)
+    if definition is None:
+        definition = SEGMENT_DEFINITIONS[sys.intern(seg_name)] = SegmentDefinition(seg_name)
+    return definition
+
+
+# ===== HL7 v2.x Data Dictionary =====
+#
+# The curated labels above only cover a few segments. For every MSH-12
+# version the complete segment/field/datatype tables are taken from a
+# definition file (bundled next to the application or in the user cache)
+# or, if none exists yet, generated once from hl7apy's structures. The cache
+# folder is user-writable (and can be redirected), so the file is JSON only;
+# segments are decoded one at a time on first use.
+
+SUPPORTED_VERSIONS = ("2.3", "2.3.1", "2.4", "2.5", "2.5.1", "2.6", "2.7", "2.8", "2.8.1", "2.8.2")
+
+DICTIONARY_FORMAT = 2
+
+_ACRONYMS = {"ID", "SSN", "VIP", "DRG", "CE", "MSH", "PID", "NK1", "PV1", "PV2", "OBX", "OBR", "ORC", "AL1", "DG1",
+             "GT1", "IN1", "IN2", "IN3", "PR1", "NTE", "EVN", "MRG", "ZIP", "URL", "NPI", "UUID", "SPM"}
+
+_HEADER = struct.Struct("<Q")
+
+
+def normalize_version(version):
+    if not version:
+        return None
+    version = version.strip()
+    if version in SUPPORTED_VERSIONS:
+        return version
+    # "2.5.1.3" -> "2.5.1", "2.4.0" -> "2.4"
+    parts = version.split(".")
+    while len(parts) > 2:
+        parts.pop()
+        if ".".join(parts) in SUPPORTED_VERSIONS:
+            return ".".join(parts)
+    return None
+
+
+def _title(long_name, seg_name=""):
+    words = long_name.replace("_S_", "'S_").split("_")
+    return " ".join(w if w in _ACRONYMS or w == seg_name else w.capitalize() for w in words if w)
+
+
+def dictionary_cache_dir():
+    override = os.environ.get("HL7_LOOKUP_CACHE_DIR")
+    if override:
+        return Path(override)
+    if sys.platform == "win32":
+        return Path(os.environ.get("LOCALAPPDATA", Path.home())) / "hl7-lookup"
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "hl7-lookup"
+
+
+def _dictionary_filename(version):
+    return f"definitions-{version}-v{DICTIONARY_FORMAT}.bin"
+
+
+def _bundled_dictionary_path(version):
+    base_path = getattr(sys, '_MEIPASS', Path(__file__).parent)
+    return Path(base_path) / "definitions" / _dictionary_filename(version)
+
+
+# Rohdaten eines Segments: ((Nummer, LONG_NAME, Datentyp, ((LONG_NAME, Datentyp), ...)), ...)
+def _segments_from_hl7apy(version):
+    try:
+        import hl7apy
+    except ImportError:
+        return None
+
+    library = hl7apy.load_library(version)
+    segments = {}
+    for seg_name, structure in library.SEGMENTS.items():
+        fields = []
+        # Withdrawn segments (e.g. QRD in v2.7) have no fields
+        for field_id, field_structure, _, _ in (structure[1] if len(structure) > 1 else ()):
+            if field_structure is None:
+                continue
+            kind, children, datatype, long_name = field_structure[:4]
+            components = ()
+            if kind == "sequence" and children:
+                components = tuple((child[1][3], child[1][2]) if child[1] else ("", "") for child in children)
+            fields.append((int(field_id.rsplit("_", 1)[1]), long_name, datatype, components))
+        segments[seg_name] = tuple(fields)
+    return segments
+
+
+# Dateiformat: Länge des Index (8 Byte), Index {Segment: [Offset, Länge]} als JSON,
+# dann je Segment die Felder als JSON
+def write_dictionary_file(path, segments):
+    blobs = []
+    index = {}
+    offset = 0
+    for seg_name, fields in sorted(segments.items()):
+        blob = json.dumps(fields, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        index[seg_name] = (offset, len(blob))
+        blobs.append(blob)
+        offset += len(blob)
+
+    header = json.dumps(index, separators=(",", ":")).encode("utf-8")
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def _is_optional_str(value):
+    return value is None or isinstance(value, str)
+
+
+def _is_component(value):
+    return isinstance(value, list) and len(value) == 2 and all(map(_is_optional_str, value))
+
+
+# Felder eines Segments aus der Datei; alles, was nicht passt, ergibt einen ValueError
+def _read_fields(data):
+    fields = []
+    for entry in json.loads(data.decode("utf-8")):
+        number, long_name, datatype, components = entry
+        if (not isinstance(number, int) or isinstance(number, bool) or not 0 <= number < 1000
+                or not isinstance(long_name, str) or not _is_optional_str(datatype)
+                or not isinstance(components, list) or not all(map(_is_component, components))):
+            raise ValueError("invalid field entry")
+        fields.append((number, long_name, datatype, components))
+    return fields
+
+
+class DataDictionary:
+    def __init__(self, version, path):
+        self.version = version
+        self._file = open(path, "rb")
+        self._map = None
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            header_length = _HEADER.unpack_from(self._map, 0)[0]
+            self._data_start = _HEADER.size + header_length
+            self._index = self._read_index(self._map[_HEADER.size:self._data_start], len(self._map) - self._data_start)
+        except (ValueError, TypeError, struct.error):
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+            raise ValueError(f"{path} is not a valid definition file") from None
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_index(data, data_length):
+        index = json.loads(data.decode("utf-8"))
+        if not isinstance(index, dict):
+            raise ValueError("invalid index")
+        for seg_name, entry in index.items():
+            if (not isinstance(entry, list) or len(entry) != 2
+                    or not all(isinstance(v, int) and not isinstance(v, bool) and v >= 0 for v in entry)
+                    or entry[0] + entry[1] > data_length):
+                raise ValueError(f"invalid index entry for {seg_name}")
+        return index
+
+    def __contains__(self, seg_name):
+        return seg_name in self._index
+
+    def segment(self, seg_name):
+        definition = self._segments.get(seg_name)
+        if definition is not None:
+            return definition
+        with self._lock:
+            definition = self._segments.get(seg_name)
+            if definition is None:
+                definition = self._segments[sys.intern(seg_name)] = self._load_segment(seg_name)
+        return definition
+
+    def _load_segment(self, seg_name):
+        curated = SEGMENT_DEFINITIONS.get(seg_name)
+        entry = self._index.get(seg_name)
+        if entry is None:
+            return SegmentDefinition(seg_name, curated.fields if curated else ())
+
+        offset, length = entry
+        start = self._data_start + offset
+        try:
+            raw_fields = _read_fields(self._map[start:start + length])
+        except (ValueError, TypeError):
+            # Beschädigter Eintrag: nur die handgepflegten Labels
+            return SegmentDefinition(seg_name, curated.fields if curated else ())
+
+        size = max((number for number, *_ in raw_fields), default=0) + 1
+        if curated:
+            size = max(size, len(curated.fields))
+        table = [None] * size
+
+        for number, long_name, datatype, raw_components in raw_fields:
+            name = _title(long_name, seg_name)
+            components = [None]
+            for j, (component_name, _) in enumerate(raw_components, 1):
+                components.append(f"    {seg_name}‑{number}.{j} – {_title(component_name, seg_name)}"
+                                  if component_name else None)
+            table[number] = FieldDefinition(f"{seg_name}‑{number} – {name}", name,
+                                            FIELD_DESCRIPTIONS.get(f"{seg_name}_{number}", ""),
+                                            tuple(components), datatype)
+
+        # Handgepflegte Labels haben Vorrang, fehlende Komponenten kommen aus dem Dictionary
+        for number, curated_field in enumerate(curated.fields if curated else ()):
+            if curated_field is None:
+                continue
+            generated = table[number]
+            components = list(curated_field.components)
+            if generated is not None:
+                for j, label in enumerate(generated.components):
+                    if j >= len(components):
+                        components.append(label)
+                    elif components[j] is None:
+                        components[j] = label
+            table[number] = curated_field._replace(components=tuple(components),
+                                                   datatype=generated.datatype if generated else "")
+
+        return SegmentDefinition(seg_name, tuple(table))
+
+
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+
+def _open_dictionary(version):
+    for path in (_bundled_dictionary_path(version), dictionary_cache_dir() / _dictionary_filename(version)):
+        if path.exists():
+            try:
+                return DataDictionary(version, path)
+            except (OSError, ValueError):
+                continue
+
+    segments = _segments_from_hl7apy(version)
+    if segments is None:
+        return None
+    path = dictionary_cache_dir() / _dictionary_filename(version)
+    try:
+        write_dictionary_file(path, segments)
+        return DataDictionary(version, path)
+    except OSError:
+        return None
+
+
+# Liefert das Dictionary zur MSH-12 Version oder None, wenn keines verfügbar ist
+def _get_dictionary(version):
+    version = normalize_version(version)
+    if version is None:
+        return None
+    try:
+        return _dictionaries[version]
+    except KeyError:
+        pass
+    with _dictionaries_lock:
+        if version not in _dictionaries:
+            _dictionaries[version] = _open_dictionary(version)
+    return _dictionaries[version]
+
+
+# Erzeugt die Definitionsdateien zum Mitliefern: python hl7_definitions.py [Zielordner]
+if __name__ == "__main__":
+    target = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parent / "definitions"
+    for version in SUPPORTED_VERSIONS:
+        segments = _segments_from_hl7apy(version)
+        if segments is None:
+            sys.exit("hl7apy is required to build the definition files")
+        write_dictionary_file(target / _dictionary_filename(version), segments)
+        print(f"{version}: {len(segments)} segments")
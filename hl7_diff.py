@@ -0,0 +1,202 @@
+# hl7_diff.py
+#
+# Struktureller Vergleich zweier Nachrichten (z.B. vor und nach einer Interface-Engine):
+#
+#   for difference in diff_messages(inbound, outbound):
+#       print(difference.kind, difference.path, difference.left, difference.right)
+#
+# Segmente werden zuerst über ihren Text abgeglichen (LCS über die Segmentfolge, gleiche
+# Segmente kosten nur einen Hash-Vergleich). Nur die Segmente in abweichenden Blöcken
+# werden tokenisiert, nach Typ und Reihenfolge gepaart und Feld, Wiederholung und
+# Komponente verglichen. Nichts hier importiert Qt.
+import re
+from collections import namedtuple
+from difflib import SequenceMatcher
+
+from hl7_parser import DEFAULT_DELIMITERS, read_delimiters, segment_name, tokenize_hl7
+
+
+# kind: "added", "removed" oder "changed"; left/right sind (Start, Ende) im jeweiligen
+# Text oder None, wenn es die Stelle auf der Seite nicht gibt
+Difference = namedtuple("Difference", ["kind", "path", "left", "right"])
+
+
+# Größere abweichende Blöcke werden nur nach Typ und Vorkommen gepaart, die
+# LCS über die wenigen verschiedenen Segmentnamen wäre dort quadratisch
+NAME_ALIGN_LIMIT = 500
+
+_LINE = re.compile(r"[^\r\n]*[^\s][^\r\n]*")
+
+
+# Nicht leere Zeilen als (Start, Ende), ohne sie zu tokenisieren
+def _lines(text):
+    return [match.span() for match in _LINE.finditer(text)]
+
+
+def _delimiters(text):
+    try:
+        return read_delimiters(text)
+    except ValueError:
+        return DEFAULT_DELIMITERS
+
+
+# Tokenisiert die Zeilen start..end eines abweichenden Blocks einzeln (Positionen relativ
+# zum Zeilenanfang) und trägt Segment und Namen ein
+def _tokenize_lines(lines, start, end, delimiters, segments, names):
+    for k in range(start, end):
+        tokens = tokenize_hl7(lines[k], delimiters)
+        if tokens:
+            segments[k] = tokens[0]
+            names[k] = segment_name(lines[k], tokens[0])
+
+
+def diff_messages(left_text, right_text):
+    left_spans, right_spans = _lines(left_text), _lines(right_text)
+    left_lines = [left_text[start:end] for start, end in left_spans]
+    right_lines = [right_text[start:end] for start, end in right_spans]
+    # Namen und Token gibt es nur für Zeilen in abweichenden Blöcken
+    left_segments, right_segments = [None] * len(left_lines), [None] * len(right_lines)
+    left_names, right_names = [""] * len(left_lines), [""] * len(right_lines)
+    left_delimiters = right_delimiters = None
+
+    differences = []
+    matcher = SequenceMatcher(None, left_lines, right_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if left_delimiters is None:
+            left_delimiters, right_delimiters = _delimiters(left_text), _delimiters(right_text)
+        _tokenize_lines(left_lines, i1, i2, left_delimiters, left_segments, left_names)
+        _tokenize_lines(right_lines, j1, j2, right_delimiters, right_segments, right_names)
+        # Innerhalb des Blocks nach Segmenttyp abgleichen, z.B. geändertes PID gegen PID
+        for i, j in _align_names(left_names, right_names, i1, i2, j1, j2):
+            if j is None:
+                differences.append(Difference("removed", left_names[i], left_spans[i], None))
+                continue
+            if i is None:
+                differences.append(Difference("added", right_names[j], None, right_spans[j]))
+                continue
+            left, right = left_segments[i], right_segments[j]
+            if left is None or right is None:
+                differences.append(Difference("changed", left_names[i], left_spans[i], right_spans[j]))
+                continue
+            _diff_segment(left_lines[i], right_lines[j], left, right, left_names[i],
+                          left_spans[i][0], right_spans[j][0], differences)
+    return differences
+
+
+# Paare (i, j) für einen abweichenden Block; i bzw. j ist None für entfernte bzw.
+# hinzugekommene Segmente
+def _align_names(left_names, right_names, i1, i2, j1, j2):
+    pairs = []
+    # Ein gemeinsamer Anfang der Namensfolge wird direkt gepaart
+    while i1 < i2 and j1 < j2 and left_names[i1] == right_names[j1]:
+        pairs.append((i1, j1))
+        i1 += 1
+        j1 += 1
+
+    if max(i2 - i1, j2 - j1) <= NAME_ALIGN_LIMIT:
+        matcher = SequenceMatcher(None, left_names[i1:i2], right_names[j1:j2], autojunk=False)
+        for tag, a1, a2, b1, b2 in matcher.get_opcodes():
+            if tag == "equal":
+                pairs.extend(zip(range(i1 + a1, i1 + a2), range(j1 + b1, j1 + b2)))
+            else:
+                pairs.extend((i, None) for i in range(i1 + a1, i1 + a2))
+                pairs.extend((None, j) for j in range(j1 + b1, j1 + b2))
+    else:
+        # n-tes OBX links gegen n-tes OBX rechts
+        occurrences = {}
+        for j in range(j1, j2):
+            occurrences.setdefault(right_names[j], []).append(j)
+        positions = {name: 0 for name in occurrences}
+        paired = set()
+        for i in range(i1, i2):
+            name = left_names[i]
+            candidates = occurrences.get(name, ())
+            if positions.get(name, 0) < len(candidates):
+                j = candidates[positions[name]]
+                positions[name] += 1
+                paired.add(j)
+                pairs.append((i, j))
+            else:
+                pairs.append((i, None))
+        pairs.extend((None, j) for j in range(j1, j2) if j not in paired)
+    return pairs
+
+
+def _diff_segment(left_text, right_text, left, right, seg_name, left_base, right_base, differences):
+    # Die Segmente sind einzeln tokenisiert, ihre Positionen werden erst für das
+    # Ergebnis auf den ganzen Text verschoben
+    found = []
+    left_fields, right_fields = left.fields, right.fields
+    for i in range(max(len(left_fields), len(right_fields))):
+        left_field = left_fields[i] if i < len(left_fields) else None
+        right_field = right_fields[i] if i < len(right_fields) else None
+        if _text(left_text, left_field) == _text(right_text, right_field):
+            continue
+        field_path = f"{seg_name}.{i + 1}"
+        if left_field is None or right_field is None:
+            found.append(_added_or_removed(field_path, left_field, right_field))
+            continue
+        _diff_repetitions(left_text, right_text, field_path, left_field, right_field, found)
+    for kind, path, left_span, right_span in found:
+        differences.append(Difference(kind, path, _shift(left_span, left_base), _shift(right_span, right_base)))
+
+
+def _span(item):
+    return None if item is None else (item[0], item[1])
+
+
+def _shift(span, base):
+    return None if span is None else (span[0] + base, span[1] + base)
+
+
+def _text(text, item):
+    return "" if item is None else text[item[0]:item[1]]
+
+
+def _added_or_removed(path, left, right):
+    if left is None:
+        return Difference("added", path, None, _span(right))
+    return Difference("removed", path, _span(left), None)
+
+
+def _diff_repetitions(left_text, right_text, field_path, left_field, right_field, differences):
+    left_reps, right_reps = left_field.repetitions, right_field.repetitions
+    if len(left_reps) == len(right_reps) == 1 and len(left_reps[0].components) == len(right_reps[0].components) == 1:
+        differences.append(Difference("changed", field_path, _span(left_field), _span(right_field)))
+        return
+
+    # Die Wiederholungsnummer nur angeben, wenn es tatsächlich Wiederholungen gibt
+    repeated = max(len(left_reps), len(right_reps)) > 1
+    for r in range(max(len(left_reps), len(right_reps))):
+        left_rep = left_reps[r] if r < len(left_reps) else None
+        right_rep = right_reps[r] if r < len(right_reps) else None
+        if _text(left_text, left_rep) == _text(right_text, right_rep):
+            continue
+        rep_path = f"{field_path}[{r + 1}]" if repeated else field_path
+        if left_rep is None or right_rep is None:
+            differences.append(_added_or_removed(rep_path, left_rep, right_rep))
+            continue
+        left_comps, right_comps = left_rep.components, right_rep.components
+        if len(left_comps) == len(right_comps) == 1:
+            differences.append(Difference("changed", rep_path, _span(left_rep), _span(right_rep)))
+            continue
+        for c in range(max(len(left_comps), len(right_comps))):
+            left_comp = left_comps[c] if c < len(left_comps) else None
+            right_comp = right_comps[c] if c < len(right_comps) else None
+            if _text(left_text, left_comp) == _text(right_text, right_comp):
+                continue
+            comp_path = f"{rep_path}.{c + 1}"
+            if left_comp is None or right_comp is None:
+                differences.append(_added_or_removed(comp_path, left_comp, right_comp))
+            else:
+                differences.append(Difference("changed", comp_path, _span(left_comp), _span(right_comp)))
+
+
+# Anzahl der Unterschiede je Art, z.B. {"changed": 3, "added": 1}
+def summarize(differences):
+    counts = {}
+    for difference in differences:
+        counts[difference.kind] = counts.get(difference.kind, 0) + 1
+    return counts
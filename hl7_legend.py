@@ -0,0 +1,113 @@
+# hl7_legend.py
+from PySide6.QtCore import Qt, QAbstractItemModel, QModelIndex
+from PySide6.QtGui import QColor
+
+
+LEGEND_HEADERS = ("Seg.", "Feld", "Wert")
+VALUE_COLOR = QColor("#888888")
+
+
+# Ein Knoten der Legende. Kinder werden erst erzeugt, wenn die View sie anfragt
+# (sichtbar oder aufgeklappt); bis dahin liegen nur die Zeilendaten des Workers vor.
+class LegendNode:
+    __slots__ = ("parent", "row", "columns", "_rows", "_children")
+
+    def __init__(self, parent, row, columns, rows=None):
+        self.parent = parent
+        self.row = row
+        self.columns = columns
+        self._rows = rows
+        self._children = None
+
+    def child_count(self):
+        return len(self._rows) if self._rows else 0
+
+    def children(self):
+        if self._children is None:
+            self._children = [
+                LegendNode(self, i, ("", row[0], row[1]), row[2] if len(row) > 2 else None)
+                for i, row in enumerate(self._rows or ())
+            ]
+        return self._children
+
+
+# Zeilen samt aller Unterzeilen (Wiederholungen, Komponenten, Subkomponenten)
+def _row_count(rows):
+    total = 0
+    for row in rows or ():
+        total += 1
+        if len(row) > 2 and row[2]:
+            total += _row_count(row[2])
+    return total
+
+
+def segment_node(seg_name, rows):
+    return LegendNode(None, 0, (seg_name, "", ""), rows)
+
+
+class LegendModel(QAbstractItemModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._segments = []
+
+    def set_segments(self, nodes):
+        self.beginResetModel()
+        for row, node in enumerate(nodes):
+            node.row = row
+        self._segments = nodes
+        self.endResetModel()
+
+    def segment_count(self):
+        return len(self._segments)
+
+    # Anzahl aller Zeilen, ohne Knoten zu erzeugen
+    def row_estimate(self):
+        return sum(1 + _row_count(node._rows) for node in self._segments)
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid():
+            children = parent.internalPointer().children()
+        else:
+            children = self._segments
+        if 0 <= row < len(children) and 0 <= column < len(LEGEND_HEADERS):
+            return self.createIndex(row, column, children[row])
+        return QModelIndex()
+
+    def parent(self, index=QModelIndex()):
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(self._segments)
+        if parent.column() != 0:
+            return 0
+        return parent.internalPointer().child_count()
+
+    def hasChildren(self, parent=QModelIndex()):
+        return self.rowCount(parent) > 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(LEGEND_HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        column = index.column()
+        if role == Qt.DisplayRole:
+            return node.columns[column]
+        if role == Qt.ToolTipRole and column == 1:
+            return node.columns[1].strip() or None
+        if role == Qt.ForegroundRole and column == 2 and node.parent is not None:
+            return VALUE_COLOR
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return LEGEND_HEADERS[section]
+        return None
@@ -0,0 +1,401 @@
+# hl7_load.py
+#
+# Last- und Dauertest gegen einen MLLP-Empfänger (z.B. eine Interface-Engine):
+#
+#   templates = [MessageTemplate(text) for text in read_batch_messages("adt.hl7")]
+#   test = LoadTest(templates, rate=200, connections=8, window=4, duration=600)
+#   stats = asyncio.run(test.run("engine.local", 2575))
+#   print(stats.summary())
+#   stats.write_report("soak.json")
+#
+# Jede Nachricht bekommt eine eigene Control ID (MSH-10), den aktuellen Zeitstempel
+# (MSH-7, EVN-2) und eine eigene Patienten-ID (PID-3.1). Die Vorlagen werden dafür
+# einmal tokenisiert, danach ist jede Nachricht nur noch ein join.
+# ACK-Latenzen landen in einem logarithmischen Histogramm, damit auch stundenlange
+# Läufe konstant Speicher brauchen. Nichts hier importiert Qt.
+import asyncio
+import csv
+import json
+import math
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from hl7_mllp import ACCEPT_CODES, DEFAULT_TIMEOUT, MLLPConnection, ack_code, frame_message
+from hl7_parser import read_delimiters, segment_name, tokenize_hl7
+
+
+# (Segment, Feld) -> Art der Ersetzung; ersetzt wird jeweils die erste Komponente
+# der ersten Wiederholung
+SUBSTITUTIONS = {
+    ("MSH", 7): "timestamp",
+    ("MSH", 10): "control_id",
+    ("EVN", 2): "timestamp",
+    ("PID", 3): "patient_id",
+}
+
+# Histogrammklassen: ab 10 µs jeweils 2 % breiter, die letzte reicht bis über 100 s
+HISTOGRAM_BASE = 1e-5
+HISTOGRAM_RATIO = 1.02
+HISTOGRAM_BUCKETS = 1000
+_LOG_RATIO = math.log(HISTOGRAM_RATIO)
+
+DEFAULT_INTERVAL = 1.0
+# Wartezeit, bevor eine abgebrochene Verbindung neu aufgebaut wird
+RECONNECT_DELAY = 1.0
+
+# Stand eines Laufs bzw. eines Intervalls; Latenzen in Sekunden (None ohne ACKs)
+LoadSnapshot = namedtuple("LoadSnapshot", ["elapsed", "sent", "acknowledged", "naks", "errors",
+                                           "throughput", "p50", "p95", "p99", "max"])
+
+
+class MessageTemplate:
+    def __init__(self, text):
+        text = text.strip().replace("\r\n", "\r").replace("\n", "\r")
+        # Vorlagen ohne MSH sind ein Fehler des Aufrufers (ValueError)
+        delimiters = read_delimiters(text)
+        spans = []
+        for segment in tokenize_hl7(text, delimiters):
+            name = segment_name(text, segment)
+            for (seg_name, number), kind in SUBSTITUTIONS.items():
+                if seg_name == name and number <= len(segment.fields):
+                    spans.append((segment.fields[number - 1].repetitions[0].components[0], kind))
+        spans.sort()
+
+        # Fester Text und dazwischen die Arten der Ersetzungen
+        self.parts = []
+        self.kinds = []
+        position = 0
+        for (start, end), kind in spans:
+            self.parts.append(text[position:start])
+            self.kinds.append(kind)
+            position = end
+        self.parts.append(text[position:])
+
+    def render(self, values):
+        result = [self.parts[0]]
+        for kind, part in zip(self.kinds, self.parts[1:]):
+            result.append(values[kind])
+            result.append(part)
+        return "".join(result)
+
+
+# Erzeugt die Nachrichten reihum aus den Vorlagen. `patients` begrenzt die Zahl
+# verschiedener Patienten-IDs (None: jede Nachricht einen eigenen Patienten).
+class MessageFactory:
+    def __init__(self, templates, run_id=None, patients=None):
+        if not templates:
+            raise ValueError("At least one message template is needed")
+        self.templates = templates
+        self.run_id = run_id or time.strftime("%H%M%S")
+        self.patients = patients
+        self.count = 0
+        self._second = None
+        self._timestamp = ""
+
+    def next_message(self):
+        number = self.count
+        self.count += 1
+        now = int(time.time())
+        if now != self._second:
+            self._second = now
+            self._timestamp = time.strftime("%Y%m%d%H%M%S", time.localtime(now))
+        patient = number % self.patients if self.patients else number
+        template = self.templates[number % len(self.templates)]
+        return template.render({
+            "control_id": f"LT{self.run_id}-{number}",
+            "timestamp": self._timestamp,
+            "patient_id": f"LT{self.run_id}-P{patient}",
+        })
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "max")
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * HISTOGRAM_BUCKETS))
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, latency):
+        if latency <= HISTOGRAM_BASE:
+            index = 0
+        else:
+            index = min(int(math.log(latency / HISTOGRAM_BASE) / _LOG_RATIO) + 1, HISTOGRAM_BUCKETS - 1)
+        self.counts[index] += 1
+        self.count += 1
+        if latency > self.max:
+            self.max = latency
+
+    # Obere Grenze der Klasse, in die das p-te Perzentil fällt (höchstens das Maximum)
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(HISTOGRAM_BASE * HISTOGRAM_RATIO ** index, self.max)
+        return self.max
+
+
+# Zähler eines Laufs. Wird im asyncio-Thread befüllt und von GUI oder CLI gelesen.
+class LoadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = None
+        self.finished = None
+        self.sent = 0
+        self.acknowledged = 0
+        self.naks = 0
+        self.errors = 0
+        self.connection_errors = 0
+        self.first_error = None
+        self.histogram = LatencyHistogram()
+        self.timeline = []
+        self._interval = LatencyHistogram()
+        self._interval_start = None
+        self._interval_counts = (0, 0, 0, 0)
+
+    def start(self):
+        self.started = self._interval_start = time.perf_counter()
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def message_sent(self):
+        with self._lock:
+            self.sent += 1
+
+    def ack_received(self, latency, code):
+        with self._lock:
+            self.acknowledged += 1
+            if code not in ACCEPT_CODES:
+                self.naks += 1
+            self.histogram.add(latency)
+            self._interval.add(latency)
+
+    # `count` gesendete Nachrichten ohne ACK, z.B. nach einem Timeout
+    def failed(self, error, count=1):
+        with self._lock:
+            self.errors += count
+            if self.first_error is None:
+                self.first_error = error
+
+    def connection_failed(self, error):
+        with self._lock:
+            self.connection_errors += 1
+            if self.first_error is None:
+                self.first_error = error
+
+    def _snapshot(self, elapsed, counts, histogram):
+        sent, acknowledged, naks, errors = counts
+        return LoadSnapshot(elapsed, sent, acknowledged, naks, errors,
+                            acknowledged / elapsed if elapsed > 0 else 0.0,
+                            histogram.percentile(50), histogram.percentile(95), histogram.percentile(99),
+                            histogram.max if histogram.count else None)
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot(self.elapsed(), (self.sent, self.acknowledged, self.naks, self.errors),
+                                  self.histogram)
+
+    # Schließt das laufende Intervall ab, hängt es an die Zeitreihe und liefert es
+    def tick(self):
+        with self._lock:
+            now = time.perf_counter()
+            counts = (self.sent, self.acknowledged, self.naks, self.errors)
+            delta = tuple(new - old for new, old in zip(counts, self._interval_counts))
+            row = self._snapshot(now - self._interval_start, delta, self._interval)
+            # Zeitreihe mit der Zeit seit Start statt der Intervalldauer
+            row = row._replace(elapsed=now - self.started)
+            self.timeline.append(row)
+            self._interval = LatencyHistogram()
+            self._interval_start = now
+            self._interval_counts = counts
+            return row
+
+    def summary(self):
+        snapshot = self.snapshot()
+        lines = [
+            f"Messages:   {snapshot.sent} sent ({snapshot.acknowledged} acknowledged, {snapshot.naks} NAK, "
+            f"{snapshot.errors} errors, {self.connection_errors} failed connects)",
+            f"Duration:   {snapshot.elapsed:.3f} s",
+            f"Throughput: {snapshot.throughput:.1f} msg/s",
+        ]
+        if snapshot.p50 is not None:
+            lines.append(f"Latency:    p50 {snapshot.p50 * 1000:.1f} ms, p95 {snapshot.p95 * 1000:.1f} ms, "
+                         f"p99 {snapshot.p99 * 1000:.1f} ms, max {snapshot.max * 1000:.1f} ms")
+        if self.first_error is not None:
+            lines.append(f"First error: {self.first_error!r}")
+        return "\n".join(lines)
+
+    def to_dict(self, config=None):
+        def row(snapshot):
+            values = snapshot._asdict()
+            for key in ("p50", "p95", "p99", "max"):
+                if values[key] is not None:
+                    values[key] = round(values[key] * 1000, 3)
+            values["elapsed"] = round(values["elapsed"], 3)
+            values["throughput"] = round(values["throughput"], 1)
+            return values
+
+        with self._lock:
+            timeline = list(self.timeline)
+        return {
+            "config": config or {},
+            "total": row(self.snapshot()),
+            "connection_errors": self.connection_errors,
+            "first_error": repr(self.first_error) if self.first_error is not None else None,
+            # Latenzen in ms, Durchsatz in Nachrichten/s je Intervall
+            "timeline": [row(snapshot) for snapshot in timeline],
+        }
+
+    # .csv: Zeitreihe als Tabelle, sonst alles als JSON
+    def write_report(self, path, config=None):
+        report = self.to_dict(config)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            if str(path).lower().endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(LoadSnapshot._fields)
+                for row in report["timeline"] + [report["total"]]:
+                    writer.writerow(row[field] for field in LoadSnapshot._fields)
+            else:
+                json.dump(report, f, indent=2)
+
+
+# Treibt einen Lauf: `connections` Verbindungen mit je bis zu `window` offenen
+# Nachrichten, optional auf `rate` Nachrichten/s (über alle Verbindungen) begrenzt.
+# Endet nach `duration` Sekunden, `count` Nachrichten oder stop(); ohne beides läuft
+# er bis stop(). Abgebrochene Verbindungen werden neu aufgebaut.
+class LoadTest:
+    def __init__(self, templates, rate=None, connections=1, window=1, duration=None, count=None,
+                 patients=None, timeout=DEFAULT_TIMEOUT, interval=DEFAULT_INTERVAL, on_interval=None):
+        self.factory = MessageFactory(templates, patients=patients)
+        self.rate = rate or None
+        self.connections = max(1, connections)
+        self.window = max(1, window)
+        self.duration = duration or None
+        self.count = count or None
+        self.timeout = timeout
+        self.interval = interval
+        self.on_interval = on_interval
+        self.stats = LoadStats()
+        self._stopped = False
+        self._deadline = None
+        self._scheduled = 0
+
+    def config(self):
+        return {"templates": len(self.factory.templates), "rate": self.rate, "connections": self.connections,
+                "window": self.window, "duration": self.duration, "count": self.count,
+                "patients": self.factory.patients, "timeout": self.timeout}
+
+    # Darf aus einem anderen Thread aufgerufen werden; offene ACKs werden noch abgewartet
+    def stop(self):
+        self._stopped = True
+
+    def _should_stop(self):
+        if self._stopped:
+            return True
+        if self._deadline is not None and time.perf_counter() >= self._deadline:
+            return True
+        return self.count is not None and self.factory.count >= self.count
+
+    # Wartet bis zum nächsten Sendezeitpunkt des gemeinsamen Takts
+    async def _pace(self):
+        if self.rate is None:
+            return
+        slot = self.stats.started + self._scheduled / self.rate
+        self._scheduled += 1
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def run(self, host, port):
+        self.stats.start()
+        if self.duration is not None:
+            self._deadline = self.stats.started + self.duration
+        ticker = asyncio.create_task(self._tick())
+        try:
+            await asyncio.gather(*(self._connection_worker(host, port) for _ in range(self.connections)))
+        finally:
+            ticker.cancel()
+            self.stats.finished = time.perf_counter()
+            row = self.stats.tick()
+            if self.on_interval is not None:
+                self.on_interval(row)
+        return self.stats
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            row = self.stats.tick()
+            if self.on_interval is not None:
+                self.on_interval(row)
+
+    async def _connection_worker(self, host, port):
+        while not self._should_stop():
+            try:
+                connection = await MLLPConnection.open(host, port, self.timeout, None)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.stats.connection_failed(e)
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            try:
+                await self._drive(connection)
+            finally:
+                await connection.close()
+            if connection.broken and not self._should_stop():
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _drive(self, connection):
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.window)
+        sent_at = asyncio.Queue()
+        pending = 0
+
+        async def read_acks():
+            nonlocal pending
+            try:
+                while True:
+                    started = await sent_at.get()
+                    if started is None:
+                        return
+                    ack = await connection.read_ack(self.timeout)
+                    pending -= 1
+                    self.stats.ack_received(loop.time() - started, ack_code(ack))
+                    slots.release()
+            except BaseException:
+                # Den Sender nicht im vollen Fenster hängen lassen
+                for _ in range(self.window):
+                    slots.release()
+                raise
+
+        reader = asyncio.create_task(read_acks())
+        try:
+            while True:
+                await slots.acquire()
+                if reader.done():
+                    break
+                await self._pace()
+                if self._should_stop():
+                    break
+                message = self.factory.next_message()
+                sent_at.put_nowait(loop.time())
+                pending += 1
+                connection.writer.write(frame_message(message, connection.encoding))
+                self.stats.message_sent()
+                await connection.writer.drain()
+            sent_at.put_nowait(None)
+            await reader
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            connection.broken = True
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+            # Alle nicht bestätigten Nachrichten dieser Verbindung gelten als fehlgeschlagen
+            if pending:
+                self.stats.failed(e, pending)
@@ -0,0 +1,416 @@
+# hl7_mllp.py
+import asyncio
+import threading
+import time
+from collections import deque, namedtuple
+
+import hl7_trace
+from hl7_parser import decode_hl7, message_codec, read_delimiters
+
+
+START_BLOCK = b"\x0b"
+END_BLOCK = b"\x1c\x0d"
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_CONNECTIONS = 4
+DEFAULT_BUFFER_SIZE = 5000
+# Größte Nachricht, die der Listener annimmt
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+# MSA-1 Codes, die als Erfolg zählen
+ACCEPT_CODES = ("AA", "CA")
+
+
+# encoding None: Zeichensatz aus MSH-18 der Nachricht, sonst UTF-8
+def frame_message(message, encoding=None):
+    message = message.replace("\r\n", "\r").replace("\n", "\r")
+    encoding = encoding or message_codec(message) or "utf-8"
+    return START_BLOCK + message.encode(encoding, errors="replace") + END_BLOCK
+
+
+def unframe_message(data, encoding=None):
+    if data.endswith(END_BLOCK):
+        data = data[:-len(END_BLOCK)]
+    start = data.find(START_BLOCK)
+    if start != -1:
+        data = data[start + 1:]
+    if encoding is None:
+        return decode_hl7(data)
+    return data.decode(encoding, errors="replace")
+
+
+# MSA-1 (Acknowledgment Code) einer Antwort, z.B. "AA", oder "" wenn keine MSA vorhanden ist
+def ack_code(ack):
+    for segment in ack.replace("\n", "\r").split("\r"):
+        if segment.startswith("MSA") and len(segment) > 4:
+            return segment[4:].split(segment[3], 1)[0]
+    return ""
+
+
+# ACK auf eine empfangene Nachricht: Sender/Empfänger vertauscht, MSA-2 = MSH-10.
+# Nachrichten ohne lesbares MSH werden mit AE beantwortet.
+def build_ack(message, code="AA", text=""):
+    message = message.replace("\r\n", "\r").replace("\n", "\r")
+    try:
+        delimiters = read_delimiters(message)
+    except ValueError as e:
+        delimiters = None
+        code = "AE"
+        text = text or str(e)
+
+    if delimiters is None:
+        sep, encoding = "|", "^~\\&"
+        msh = [""] * 18
+    else:
+        sep = delimiters.field
+        encoding = "".join(delimiters[1:])
+        msh = message.lstrip().split("\r", 1)[0].split(sep) + [""] * 18
+
+    component = encoding[0]
+    trigger = msh[8].split(component)[1] if component in msh[8] else ""
+    header = ["MSH", encoding, msh[4], msh[5], msh[2], msh[3], time.strftime("%Y%m%d%H%M%S"), "",
+              f"ACK{component}{trigger}" if trigger else "ACK", msh[9], msh[10] or "P", msh[11]]
+    # Die Antwort wird im Zeichensatz der Nachricht geschickt und gibt ihn daher auch an
+    if msh[17]:
+        header += ["", "", "", "", "", msh[17]]
+    ack = [sep.join(header), sep.join(["MSA", code, msh[9]])]
+    if text:
+        ack[-1] += sep + text.replace(sep, " ").replace("\r", " ")
+    return "\r".join(ack)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class MLLPConnection:
+    def __init__(self, host, port, reader, writer, encoding=None):
+        self.host = host
+        self.port = port
+        self.reader = reader
+        self.writer = writer
+        self.encoding = encoding
+        self.broken = False
+
+    @classmethod
+    async def open(cls, host, port, timeout=DEFAULT_TIMEOUT, encoding=None):
+        with hl7_trace.span("mllp.connect"):
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        return cls(host, port, reader, writer, encoding)
+
+    def is_closed(self):
+        return self.broken or self.writer.is_closing() or self.reader.at_eof()
+
+    # Liest bis zum MLLP-Endblock (0x1C 0x0D), auch wenn die Antwort in mehreren Paketen kommt
+    async def read_ack(self, timeout=DEFAULT_TIMEOUT):
+        try:
+            data = await asyncio.wait_for(self.reader.readuntil(END_BLOCK), timeout)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, OSError):
+            self.broken = True
+            raise
+        return unframe_message(data, self.encoding)
+
+    async def send(self, message, timeout=DEFAULT_TIMEOUT):
+        with hl7_trace.span("mllp.send"):
+            try:
+                self.writer.write(frame_message(message, self.encoding))
+                await self.writer.drain()
+            except OSError:
+                self.broken = True
+                raise
+            ack = await self.read_ack(timeout)
+        hl7_trace.counter("mllp.messages")
+        return ack
+
+    # Schickt bis zu `window` Nachrichten, bevor auf die ACKs gewartet wird.
+    # Liefert pro Nachricht (Latenz in Sekunden, ACK-Text oder Exception).
+    async def send_many(self, messages, window=1, timeout=DEFAULT_TIMEOUT, on_result=None):
+        loop = asyncio.get_running_loop()
+        results = []
+        sent_at = deque()
+        slots = asyncio.Semaphore(max(1, window))
+
+        async def read_acks():
+            try:
+                for _ in range(len(messages)):
+                    ack = await self.read_ack(timeout)
+                    result = (loop.time() - sent_at.popleft(), ack)
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(result)
+                    slots.release()
+            except BaseException:
+                # Den Sender nicht im vollen Fenster hängen lassen
+                for _ in range(max(1, window)):
+                    slots.release()
+                raise
+
+        with hl7_trace.span("mllp.send_many", messages=len(messages), window=window):
+            reader_task = asyncio.create_task(read_acks())
+            try:
+                for message in messages:
+                    await slots.acquire()
+                    if reader_task.done():
+                        break
+                    sent_at.append(loop.time())
+                    self.writer.write(frame_message(message, self.encoding))
+                    await self.writer.drain()
+                await reader_task
+            except Exception as e:
+                self.broken = True
+                reader_task.cancel()
+                # Alle nicht bestätigten Nachrichten gelten als fehlgeschlagen
+                for _ in range(len(messages) - len(results)):
+                    result = (0.0, e)
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(result)
+        hl7_trace.counter("mllp.messages", len(messages))
+        return results
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+# Hält Verbindungen pro Host/Port offen und verwendet sie für weitere Nachrichten
+class MLLPConnectionPool:
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=DEFAULT_TIMEOUT, encoding=None):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.encoding = encoding
+        self._idle = {}
+        self._limits = {}
+
+    def _limit(self, key):
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = asyncio.Semaphore(self.max_connections)
+        return limit
+
+    async def acquire(self, host, port):
+        key = (host, port)
+        await self._limit(key).acquire()
+        idle = self._idle.setdefault(key, [])
+        while idle:
+            connection = idle.pop()
+            if not connection.is_closed():
+                return connection
+            await connection.close()
+        try:
+            return await MLLPConnection.open(host, port, self.timeout, self.encoding)
+        except BaseException:
+            self._limit(key).release()
+            raise
+
+    async def release(self, connection):
+        key = (connection.host, connection.port)
+        if connection.is_closed():
+            await connection.close()
+        else:
+            self._idle.setdefault(key, []).append(connection)
+        self._limit(key).release()
+
+    async def send(self, host, port, message):
+        connection = await self.acquire(host, port)
+        try:
+            return await connection.send(message, self.timeout)
+        finally:
+            await self.release(connection)
+
+    async def send_many(self, host, port, messages, window=1, on_result=None):
+        connection = await self.acquire(host, port)
+        try:
+            return await connection.send_many(messages, window, self.timeout, on_result)
+        finally:
+            await self.release(connection)
+
+    async def close(self):
+        for idle in self._idle.values():
+            while idle:
+                await idle.pop().close()
+
+
+class SendReport:
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+        self.latencies = sorted(latency for latency, ack in results if not isinstance(ack, Exception))
+        self.errors = [ack for _, ack in results if isinstance(ack, Exception)]
+        self.naks = sum(1 for _, ack in results if not isinstance(ack, Exception) and ack_code(ack) not in ACCEPT_CODES)
+
+    def throughput(self):
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        lines = [
+            f"Messages:   {len(self.results)} ({len(self.latencies)} acknowledged, {self.naks} NAK, {len(self.errors)} errors)",
+            f"Duration:   {self.elapsed:.3f} s",
+            f"Throughput: {self.throughput():.1f} msg/s",
+        ]
+        if self.latencies:
+            p50, p95 = (percentile(self.latencies, p) * 1000 for p in (50, 95))
+            lines.append(f"Latency:    min {self.latencies[0] * 1000:.1f} ms, p50 {p50:.1f} ms, "
+                         f"p95 {p95:.1f} ms, max {self.latencies[-1] * 1000:.1f} ms")
+        if self.errors:
+            lines.append(f"First error: {self.errors[0]!r}")
+        return "\n".join(lines)
+
+
+# Verteilt die Nachrichten reihum auf `connections` Verbindungen mit je `window` offenen Nachrichten
+async def send_bulk(pool, host, port, messages, connections=1, window=1, on_result=None):
+    messages = list(messages)
+    connections = max(1, min(connections, len(messages) or 1))
+    batches = [messages[i::connections] for i in range(connections)]
+
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *(pool.send_many(host, port, batch, window, on_result) for batch in batches if batch),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+
+    results = []
+    for batch, outcome in zip((b for b in batches if b), outcomes):
+        if isinstance(outcome, Exception):
+            # Verbindung kam nicht zustande
+            results.extend((0.0, outcome) for _ in batch)
+        else:
+            results.extend(outcome)
+    return SendReport(results, elapsed)
+
+
+# Sendet alle Nachrichten einer Datei (Einzelnachricht, Batch oder MLLP-Mitschnitt) erneut
+async def replay_file(pool, host, port, path, connections=1, window=1, repeat=1, on_result=None):
+    from hl7_batch import read_batch_messages
+    messages = await asyncio.to_thread(read_batch_messages, path)
+    return await send_bulk(pool, host, port, messages * repeat, connections, window, on_result)
+
+
+ReceivedMessage = namedtuple("ReceivedMessage", ["seq", "received_at", "peer", "text", "ack_code"])
+
+
+# Die letzten `size` empfangenen Nachrichten. Wird vom Listener-Thread befüllt und
+# von der GUI in Intervallen abgefragt (since), statt pro Nachricht ein Signal zu senden.
+class MessageRingBuffer:
+    def __init__(self, size=DEFAULT_BUFFER_SIZE):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.total = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._entries.maxlen
+
+    def append(self, peer, text, ack_code):
+        with self._lock:
+            self.total += 1
+            entry = ReceivedMessage(self.total, time.time(), peer, text, ack_code)
+            self._entries.append(entry)
+        return entry
+
+    # Alle noch vorhandenen Einträge mit seq > `seq`
+    def since(self, seq):
+        with self._lock:
+            missing = self.total - seq
+            if missing <= 0:
+                return []
+            return list(self._entries)[-missing:]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class MLLPServer:
+    def __init__(self, buffer, encoding=None):
+        self.buffer = buffer
+        self.encoding = encoding
+        self.connections = 0
+        self._server = None
+        self._writers = set()
+
+    def is_running(self):
+        return self._server is not None
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_MESSAGE_BYTES)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        peer = f"{peer[0]}:{peer[1]}" if peer else "?"
+        self._writers.add(writer)
+        self.connections += 1
+        try:
+            while True:
+                data = await reader.readuntil(END_BLOCK)
+                message = unframe_message(data, self.encoding)
+                ack = build_ack(message)
+                self.buffer.append(peer, message, ack_code(ack))
+                hl7_trace.counter("mllp.received")
+                writer.write(frame_message(ack, self.encoding))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+            pass
+        finally:
+            self.connections -= 1
+            self._writers.discard(writer)
+            writer.close()
+
+
+# asyncio-Loop in einem eigenen Thread, damit die GUI nie auf das Netzwerk wartet
+class EventLoopThread:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="mllp-loop", daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+_background_loop = None
+_background_pool = None
+_background_lock = threading.Lock()
+
+
+def background_loop():
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            _background_loop = EventLoopThread()
+    return _background_loop
+
+
+# Gemeinsamer Verbindungspool der GUI, lebt im Hintergrund-Loop
+def background_pool():
+    global _background_pool
+    with _background_lock:
+        if _background_pool is None:
+            _background_pool = MLLPConnectionPool()
+    return _background_pool
@@ -1,29 +1,515 @@
 # hl7_parser.py
-from hl7_definitions import FRIENDLY_FIELD_NAMES, FIELD_DESCRIPTIONS
+import re
+from array import array
+from collections import namedtuple
+from collections.abc import Mapping
+from functools import lru_cache
+
+from hl7_definitions import get_segment_definition
+
+
+# Encoding characters in MSH-1 / MSH-2 order
+Delimiters = namedtuple("Delimiters", ["field", "component", "repetition", "escape", "subcomponent"])
+DEFAULT_DELIMITERS = Delimiters("|", "^", "~", "\\", "&")
+
+# All spans are (start, end) offsets into the tokenized text. The text can be a
+# str or a bytes-like buffer (bytes, bytearray, memoryview); for buffers the
+# offsets are byte offsets and values are only decoded when they are needed
+# (decode_span), using the character set from MSH-18. This works for all
+# encodings in which the delimiters are single ASCII bytes (ASCII, 8859/x, UTF-8).
+# Components are plain (start, end) tuples. Subcomponents are only recorded for
+# components that contain the subcomponent separator: Repetition.subcomponents is
+# None or maps the component index (0-based) to its list of (start, end) spans.
+Segment = namedtuple("Segment", ["start", "end", "name_end", "fields"])
+Field = namedtuple("Field", ["start", "end", "repetitions"])
+Repetition = namedtuple("Repetition", ["start", "end", "components", "subcomponents"], defaults=(None,))
+
+SEGMENT_TERMINATORS = "\r\n"
+
+# MSH-18 (Character Set) -> Python codec. Without MSH-18 UTF-8 is assumed,
+# with Latin-1 as fallback for invalid UTF-8.
+HL7_CHARSETS = {
+    "ASCII": "ascii",
+    "8859/1": "latin-1",
+    "8859/2": "iso8859-2",
+    "8859/3": "iso8859-3",
+    "8859/4": "iso8859-4",
+    "8859/5": "iso8859-5",
+    "8859/6": "iso8859-6",
+    "8859/7": "iso8859-7",
+    "8859/8": "iso8859-8",
+    "8859/9": "iso8859-9",
+    "8859/15": "iso8859-15",
+    "ISO IR6": "ascii",
+    "ISO IR14": "iso2022_jp",
+    "ISO IR87": "iso2022_jp",
+    "ISO IR100": "latin-1",
+    "ISO IR101": "iso8859-2",
+    "ISO IR109": "iso8859-3",
+    "ISO IR110": "iso8859-4",
+    "ISO IR126": "iso8859-7",
+    "ISO IR127": "iso8859-6",
+    "ISO IR138": "iso8859-8",
+    "ISO IR144": "iso8859-5",
+    "ISO IR148": "iso8859-9",
+    "ISO IR192": "utf-8",
+    "UNICODE UTF-8": "utf-8",
+    "GB 18030-2000": "gb18030",
+    "KS X 1001": "euc_kr",
+    "CNS 11643-1992": "big5",
+    "BIG-5": "big5",
+}
+# So viele Bytes am Anfang eines Puffers reichen für MSH-1 bis MSH-18
+HEADER_PEEK_BYTES = 1024
+
+_BYTES_TERMINATORS = SEGMENT_TERMINATORS.encode("ascii")
+# Als Mengen: "in" auf bytes sucht einen Teilstring und ist deutlich langsamer
+_TERMINATOR_SET = frozenset(SEGMENT_TERMINATORS)
+_BYTES_TERMINATOR_SET = frozenset(bytes([char]) for char in _BYTES_TERMINATORS)
+_BLANK = re.compile(r"\s*")
+_BYTES_BLANK = re.compile(rb"\s*")
+_NON_BLANK = re.compile(r"\S")
+_BYTES_NON_BLANK = re.compile(rb"\S")
+
+
+def _header_text(data):
+    head = bytes(data[:HEADER_PEEK_BYTES])
+    start = len(head) - len(head.lstrip())
+    end = min((i for i in (head.find(b"\r", start), head.find(b"\n", start)) if i != -1), default=len(head))
+    return head[:end].decode("latin-1")
+
+
+# Delimiters are always returned as str, also for bytes-like input
+def read_delimiters(text):
+    if not isinstance(text, str):
+        text = _header_text(text)
+    start = len(text) - len(text.lstrip())
+    if not text.startswith("MSH", start) or len(text) < start + 4:
+        raise ValueError("HL7 message must start with an MSH segment")
+
+    field_sep = text[start + 3]
+    if field_sep in SEGMENT_TERMINATORS:
+        raise ValueError("MSH segment has no field separator")
+
+    end = _msh2_end(text, start + 4, field_sep)
+    encoding_chars = text[start + 4:end]
+    # Missing encoding characters fall back to the HL7 defaults
+    chars = [encoding_chars[i] if i < len(encoding_chars) else DEFAULT_DELIMITERS[i + 1] for i in range(4)]
+    return Delimiters(field_sep, *chars)
+
+
+# The escape character is not a delimiter for the tokenizer: escape sequences never
+# contain raw delimiters, so they stay inside their value and are only decoded by
+# unescape(). A stray escape character (e.g. C:\temp) must not swallow delimiters.
+@lru_cache(maxsize=16)
+def _delimiter_pattern(delimiters):
+    separators = set(delimiters) - {delimiters.escape}
+    return re.compile("[%s]" % re.escape("".join(sorted(separators | set(SEGMENT_TERMINATORS)))))
+
+
+@lru_cache(maxsize=16)
+def _bytes_delimiter_pattern(delimiters):
+    return re.compile(_delimiter_pattern(delimiters).pattern.encode("latin-1"))
+
+
+@lru_cache(maxsize=16)
+def _msh2_stop_pattern(field_sep):
+    if isinstance(field_sep, str):
+        return re.compile("[%s]" % re.escape(field_sep + SEGMENT_TERMINATORS))
+    return re.compile(b"[%s]" % re.escape(field_sep + _BYTES_TERMINATORS))
+
+
+def _msh2_end(text, pos, field_sep):
+    # MSH-2 holds the encoding characters and is never split itself
+    found = _msh2_stop_pattern(field_sep).search(text, pos)
+    return found.start() if found else len(text)
+
+
+# Single pass over all delimiters of the message. Returns a list of Segment
+# spans; segment, field, repetition and component boundaries are offsets
+# into `text`, nothing is copied.
+def tokenize_hl7(text, delimiters=None):
+    if delimiters is None:
+        delimiters = read_delimiters(text)
+    if isinstance(text, str):
+        pattern = _delimiter_pattern(delimiters)
+        terminators, msh, blank, non_blank = _TERMINATOR_SET, "MSH", _BLANK, _NON_BLANK
+    else:
+        # Auf Puffern wird byteweise mit denselben (ASCII-)Trennzeichen gearbeitet
+        pattern = _bytes_delimiter_pattern(delimiters)
+        delimiters = Delimiters(*(char.encode("latin-1") for char in delimiters))
+        terminators, msh, blank, non_blank = _BYTES_TERMINATOR_SET, b"MSH", _BYTES_BLANK, _BYTES_NON_BLANK
+    field_sep, component_sep, repetition_sep, _, subcomponent_sep = delimiters
+
+    segments = []
+    line_start = 0
+    skip_until = 0
+    # fields is None while the segment name is still being read
+    name_end = fields = None
+    field_start = rep_start = comp_start = sub_start = None
+    reps = comps = None
+    # Subcomponents of the current component / repetition, only once a separator was seen
+    subs = rep_subs = None
+
+    def close_line(end):
+        if fields is None:
+            if non_blank.search(text, line_start, end):
+                segments.append(Segment(line_start, end, end, []))
+            return
+        if field_start is not None:
+            if subs is not None:
+                subs.append((sub_start, end))
+                rep_subs[len(comps)] = subs
+            comps.append((comp_start, end))
+            reps.append(Repetition(rep_start, end, comps, rep_subs))
+            fields.append(Field(field_start, end, reps))
+        segments.append(Segment(line_start, end, name_end, fields))
+
+    for match in pattern.finditer(text):
+        i = match.start()
+        if i < skip_until:
+            continue
+        char = match.group()
+
+        if char in terminators:
+            close_line(i)
+            line_start = i + 1
+            name_end = fields = field_start = None
+            subs = rep_subs = None
+            continue
+
+        if fields is None:
+            if char != field_sep:
+                continue
+            # Leading whitespace is not part of the segment
+            line_start = blank.match(text, line_start, i).end()
+            name_end = i
+            fields = []
+            reps = []
+            comps = []
+
+            if text[line_start:i] == msh:
+                fields.append(Field(i, i + 1, [Repetition(i, i + 1, [(i, i + 1)], None)]))
+                end = _msh2_end(text, i + 1, field_sep)
+                fields.append(Field(i + 1, end, [Repetition(i + 1, end, [(i + 1, end)], None)]))
+                if text[end:end + 1] == field_sep:
+                    field_start = rep_start = comp_start = end + 1
+                    skip_until = end + 1
+                else:
+                    skip_until = end
+            else:
+                field_start = rep_start = comp_start = i + 1
+            continue
+
+        if field_start is None:
+            continue
+
+        if char == subcomponent_sep:
+            if subs is None:
+                subs = [(comp_start, i)]
+                if rep_subs is None:
+                    rep_subs = {}
+            else:
+                subs.append((sub_start, i))
+            sub_start = i + 1
+            continue
+
+        # Every other delimiter closes the current component
+        if subs is not None:
+            subs.append((sub_start, i))
+            rep_subs[len(comps)] = subs
+            subs = None
+        comps.append((comp_start, i))
+        if char == component_sep:
+            comp_start = i + 1
+        elif char == repetition_sep:
+            reps.append(Repetition(rep_start, i, comps, rep_subs))
+            comps = []
+            rep_subs = None
+            rep_start = comp_start = i + 1
+        elif char == field_sep:
+            reps.append(Repetition(rep_start, i, comps, rep_subs))
+            fields.append(Field(field_start, i, reps))
+            reps = []
+            comps = []
+            rep_subs = None
+            field_start = rep_start = comp_start = i + 1
+
+    close_line(len(text))
+    return segments
+
+
+def segment_name(text, segment):
+    name = text[segment.start:segment.name_end]
+    return name if isinstance(name, str) else bytes(name).decode("latin-1")
+
+
+# Python codec for an MSH-18 value, or None if it is empty or unknown
+def hl7_codec(charset):
+    return HL7_CHARSETS.get((charset or "").strip().upper())
+
+
+# MSH-18.1 (first repetition) without tokenizing the whole message
+def message_charset(text):
+    text = text[:HEADER_PEEK_BYTES] if isinstance(text, str) else _header_text(text)
+    try:
+        delimiters = read_delimiters(text)
+    except ValueError:
+        return None
+    line = re.split(r"[\r\n]", text.lstrip(), maxsplit=1)[0]
+    fields = line.split(delimiters.field)
+    # fields[0] is "MSH", so MSH-n is fields[n - 1]
+    if len(fields) < 18:
+        return None
+    charset = fields[17].split(delimiters.repetition)[0].split(delimiters.component)[0].strip()
+    return charset or None
+
+
+# Codec for a whole message: MSH-18, else UTF-8 (None if the caller should fall back)
+def message_codec(text):
+    return hl7_codec(message_charset(text))
+
+
+# Decodes a raw message; without usable MSH-18 UTF-8, or Latin-1 if it is not valid UTF-8
+def decode_hl7(data, codec=None):
+    data = bytes(data)
+    codec = codec or message_codec(data)
+    if codec:
+        return data.decode(codec, errors="replace")
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("latin-1")
+
+
+# Codec for the spans of a whole buffer, chosen like decode_hl7 (None for str input)
+def buffer_codec(data):
+    if isinstance(data, str):
+        return None
+    codec = message_codec(data)
+    if codec:
+        return codec
+    try:
+        str(data, "utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+
+# Text of a span (e.g. a component) of a tokenized buffer; str input is just sliced
+def decode_span(text, span, codec="utf-8"):
+    value = text[span[0]:span[1]]
+    if isinstance(value, str):
+        return value
+    return bytes(value).decode(codec or "utf-8", errors="replace")
+
+
+# Subcomponent spans of component `index` (0-based); a component without
+# subcomponent separator is its own single subcomponent
+def subcomponents(repetition, index):
+    if repetition.subcomponents and index in repetition.subcomponents:
+        return repetition.subcomponents[index]
+    return [repetition.components[index]]
+
+
+# MSH-12.1 (Version ID) of the tokenized message, or None
+def message_version(text, segments):
+    if not segments or segment_name(text, segments[0]) != "MSH" or len(segments[0].fields) < 12:
+        return None
+    return decode_span(text, segments[0].fields[11].repetitions[0].components[0], "latin-1").strip() or None
+
+
+# Decodes HL7 escape sequences (\F\, \S\, \T\, \R\, \E\, \Xhh\) of a single value
+def unescape(value, delimiters=DEFAULT_DELIMITERS):
+    escape_char = delimiters.escape
+    if escape_char not in value:
+        return value
+
+    replacements = {
+        "F": delimiters.field,
+        "S": delimiters.component,
+        "T": delimiters.subcomponent,
+        "R": delimiters.repetition,
+        "E": escape_char,
+        ".br": "\n",
+    }
+    parts = value.split(escape_char)
+    result = [parts[0]]
+    i = 1
+    while i < len(parts):
+        # An unterminated escape sequence stays literal
+        if i + 1 >= len(parts):
+            result.append(escape_char + parts[i])
+            break
+        sequence = parts[i]
+        if sequence in replacements:
+            result.append(replacements[sequence])
+        elif sequence.startswith("X") and len(sequence) % 2 == 1:
+            try:
+                result.append(bytes.fromhex(sequence[1:]).decode("latin-1"))
+            except ValueError:
+                result.append(escape_char + sequence + escape_char)
+        else:
+            result.append(escape_char + sequence + escape_char)
+        result.append(parts[i + 1])
+        i += 2
+    return "".join(result)
+
+
+# Result of parse_hl7: the message text plus flat arrays of segment and field offsets.
+# Segments and fields are small views created on access; names and descriptions are
+# looked up in the shared definitions instead of being stored per field. The views
+# are read-only mappings with the keys of the old dict output, as_dicts() returns
+# that output as plain lists and dicts.
+class ParsedMessage:
+    __slots__ = ("text", "version", "delimiters", "codec", "segment_starts", "name_ends", "first_fields",
+                 "field_starts", "field_ends")
+
+    def __init__(self, text, segments, version, delimiters, codec=None):
+        self.text = text
+        self.version = version
+        self.delimiters = delimiters
+        # Codec for field values of a bytes-like text (MSH-18), None for str
+        self.codec = codec
+        self.segment_starts = array("I", [segment.start for segment in segments])
+        self.name_ends = array("I", [segment.name_end for segment in segments])
+        # Fields of segment i are first_fields[i]:first_fields[i + 1]
+        self.first_fields = array("I", [0])
+        self.field_starts = array("I")
+        self.field_ends = array("I")
+        for segment in segments:
+            self.field_starts.extend([field.start for field in segment.fields])
+            self.field_ends.extend([field.end for field in segment.fields])
+            self.first_fields.append(len(self.field_starts))
+
+    def __len__(self):
+        return len(self.segment_starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ParsedSegment(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("segment index out of range")
+        return ParsedSegment(self, index)
+
+    def __iter__(self):
+        return (ParsedSegment(self, i) for i in range(len(self)))
+
+    def as_dicts(self):
+        return [segment.as_dict() for segment in self]
+
+
+class ParsedSegment(Mapping):
+    __slots__ = ("message", "index")
+    KEYS = ("segment_type", "fields")
+
+    def __init__(self, message, index):
+        self.message = message
+        self.index = index
+
+    @property
+    def segment_type(self):
+        message = self.message
+        name = message.text[message.segment_starts[self.index]:message.name_ends[self.index]]
+        return name if isinstance(name, str) else bytes(name).decode("latin-1")
+
+    @property
+    def definition(self):
+        return get_segment_definition(self.segment_type, self.message.version)
+
+    @property
+    def fields(self):
+        message = self.message
+        first = message.first_fields[self.index]
+        count = message.first_fields[self.index + 1] - first
+        return [ParsedField(self, number, first + number - 1) for number in range(1, count + 1)]
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f"<ParsedSegment {self.segment_type} {self.index}>"
+
+    def as_dict(self):
+        return {"segment_type": self.segment_type, "fields": [field.as_dict() for field in self.fields]}
+
+
+class ParsedField(Mapping):
+    __slots__ = ("segment_view", "number", "_position")
+    KEYS = ("segment", "index", "friendly_name", "description", "value")
+
+    def __init__(self, segment_view, number, position):
+        self.segment_view = segment_view
+        self.number = number
+        self._position = position
+
+    @property
+    def segment(self):
+        return self.segment_view.segment_type
+
+    @property
+    def index(self):
+        return self.number
+
+    @property
+    def friendly_name(self):
+        return self.segment_view.definition.field(self.number).name
+
+    @property
+    def description(self):
+        return self.segment_view.definition.field(self.number).description
+
+    @property
+    def span(self):
+        message = self.segment_view.message
+        return message.field_starts[self._position], message.field_ends[self._position]
+
+    @property
+    def value(self):
+        message = self.segment_view.message
+        return decode_span(message.text, self.span, message.codec)
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f"<ParsedField {self.segment}-{self.number} {self.value!r}>"
+
+    def as_dict(self):
+        definition = self.segment_view.definition.field(self.number)
+        return {
+            "segment": self.segment,
+            "index": self.number,
+            "friendly_name": definition.name,
+            "description": definition.description,
+            "value": self.value,
+        }
+
 
 def parse_hl7(hl7_text):
-    segments = hl7_text.strip().split('\n')
-    parsed_segments = []
-
-    for segment in segments:
-        fields = segment.strip().split('|')
-        segment_type = fields[0]
-        parsed_fields = []
-
-        for index, value in enumerate(fields[1:], start=1):
-            friendly_name = FRIENDLY_FIELD_NAMES.get(segment_type, {}).get(index, f'Field {index}')
-            description = FIELD_DESCRIPTIONS.get(segment_type, {}).get(index, '')
-            parsed_fields.append({
-                'segment': segment_type,
-                'index': index,
-                'friendly_name': friendly_name,
-                'description': description,
-                'value': value,
-            })
-
-        parsed_segments.append({
-            'segment_type': segment_type,
-            'fields': parsed_fields
-        })
-
-    return parsed_segments
+    try:
+        delimiters = read_delimiters(hl7_text)
+    except ValueError:
+        delimiters = DEFAULT_DELIMITERS
+
+    segments = tokenize_hl7(hl7_text, delimiters)
+    return ParsedMessage(hl7_text, segments, message_version(hl7_text, segments), delimiters,
+                         buffer_codec(hl7_text))
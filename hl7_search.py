@@ -0,0 +1,169 @@
+# hl7_search.py
+#
+# Invertierter Index über alle geparsten Nachrichten (Tabs):
+#
+#   PID.3=123456      Feld bzw. Komponente hat genau diesen Wert
+#   OBX.5~gluc        Feld bzw. Komponente enthält den Text
+#   PID.3             Feld bzw. Komponente ist nicht leer
+#   müller            Text kommt in irgendeinem Feld vor
+#
+# Groß-/Kleinschreibung spielt keine Rolle. Nichts hier importiert Qt.
+import re
+from collections import namedtuple
+
+from hl7_parser import segment_name
+
+
+# Ein Treffer: Dokument (z.B. Tab), Feldpfad, Wert und Position im Nachrichtentext
+Match = namedtuple("Match", ["doc_id", "path", "value", "start", "end"])
+
+_PATH_QUERY = re.compile(r"^\s*([A-Z][A-Z0-9]{2})\.(\d+)(?:\.(\d+))?\s*(?:([=~])(.*))?$", re.IGNORECASE)
+_TOKEN_SPLIT = re.compile(r"\W+")
+
+MAX_RESULTS = 500
+
+
+# (Pfad, Wert, Start, Ende) für jedes nicht leere Feld (PID.3) und jede Komponente (PID.3.1).
+# Wiederholungen teilen sich den Pfad.
+def index_entries(text, segments, delimiters):
+    entries = []
+    for segment in segments:
+        seg_name = segment_name(text, segment)
+        for i, field in enumerate(segment.fields, 1):
+            if field.end <= field.start:
+                continue
+            field_path = f"{seg_name}.{i}"
+            entries.append((field_path, text[field.start:field.end], field.start, field.end))
+            if seg_name == "MSH" and i <= 2:
+                continue
+            for repetition in field.repetitions:
+                if len(repetition.components) < 2:
+                    continue
+                for j, (start, end) in enumerate(repetition.components, 1):
+                    if end > start:
+                        entries.append((f"{field_path}.{j}", text[start:end], start, end))
+    return entries
+
+
+def _tokens(value):
+    return {token for token in _TOKEN_SPLIT.split(value.lower()) if token}
+
+
+class SearchIndex:
+    def __init__(self):
+        # doc_id -> Liste von (Pfad, Wert, Start, Ende)
+        self._entries = {}
+        # Pfad -> {doc_id: [Eintragsnummern]}
+        self._paths = {}
+        # Token -> {doc_id: [Eintragsnummern]}
+        self._tokens = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._entries
+
+    def documents(self):
+        return list(self._entries)
+
+    # Ersetzt die Einträge eines Dokuments; nur dessen Postings werden angefasst
+    def update(self, doc_id, entries):
+        self.remove(doc_id)
+        entries = list(entries)
+        self._entries[doc_id] = entries
+        for number, (path, value, _, _) in enumerate(entries):
+            self._paths.setdefault(path, {}).setdefault(doc_id, []).append(number)
+            for token in _tokens(value):
+                self._tokens.setdefault(token, {}).setdefault(doc_id, []).append(number)
+
+    def remove(self, doc_id):
+        entries = self._entries.pop(doc_id, None)
+        if not entries:
+            return
+        for path in {entry[0] for entry in entries}:
+            self._discard(self._paths, path, doc_id)
+        for token in set().union(*(_tokens(entry[1]) for entry in entries)):
+            self._discard(self._tokens, token, doc_id)
+
+    @staticmethod
+    def _discard(index, key, doc_id):
+        postings = index.get(key)
+        if postings is not None:
+            postings.pop(doc_id, None)
+            if not postings:
+                del index[key]
+
+    def search(self, query, limit=MAX_RESULTS):
+        query = query.strip()
+        if not query:
+            return []
+        path_query = _PATH_QUERY.match(query)
+        if path_query:
+            seg, field, component, operator, value = path_query.groups()
+            path = f"{seg.upper()}.{field}" + (f".{component}" if component else "")
+            return self._search_path(path, operator, (value or "").strip().lower(), limit)
+        return self._search_text(query.lower(), limit)
+
+    def _search_path(self, path, operator, value, limit):
+        matches = []
+        for doc_id, numbers in self._paths.get(path, {}).items():
+            entries = self._entries[doc_id]
+            for number in numbers:
+                match = self._match_entry(entries, number, operator, value)
+                if match is not None:
+                    matches.append(Match(doc_id, *match))
+                    if len(matches) >= limit:
+                        return matches
+        return matches
+
+    # Ein Feld ohne Treffer kann noch über eine seiner Komponenten treffen,
+    # z.B. PID.3=123456 bei 123456^^^HOSP^MR. Die Komponenten folgen direkt auf das Feld.
+    @staticmethod
+    def _match_entry(entries, number, operator, value):
+        prefix = entries[number][0] + "."
+        last = number + 1
+        if prefix.count(".") == 2:
+            while last < len(entries) and entries[last][0].startswith(prefix):
+                last += 1
+        for entry in entries[number:last]:
+            text = entry[1].lower()
+            if not operator or (operator == "=" and text == value) or (operator == "~" and value in text):
+                return entry
+        return None
+
+    # Kandidaten über die Token-Liste (deutlich kleiner als alle Werte), danach
+    # Teilstring-Prüfung auf den Feldwerten der Kandidaten
+    def _search_text(self, text, limit):
+        query_tokens = _tokens(text)
+        if not query_tokens:
+            return []
+        longest = max(query_tokens, key=len)
+        candidates = {}
+        for token, postings in self._tokens.items():
+            if longest in token:
+                for doc_id, numbers in postings.items():
+                    candidates.setdefault(doc_id, set()).update(numbers)
+
+        matches = []
+        for doc_id, numbers in candidates.items():
+            entries = self._entries[doc_id]
+            # Ein Feldtreffer zählt nur, wenn keine seiner Komponenten selbst trifft
+            pending = None
+            for number in sorted(numbers):
+                path, value, start, end = entries[number]
+                if pending is not None and not path.startswith(pending.path + "."):
+                    matches.append(pending)
+                    pending = None
+                if text not in value.lower():
+                    continue
+                if path.count(".") == 1:
+                    pending = Match(doc_id, path, value, start, end)
+                else:
+                    pending = None
+                    matches.append(Match(doc_id, path, value, start, end))
+                if len(matches) >= limit:
+                    return matches
+            if pending is not None:
+                matches.append(pending)
+        return matches[:limit]
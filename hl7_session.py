@@ -0,0 +1,189 @@
+# hl7_session.py
+#
+# Arbeitsbereich (Tabs mit Namen und Nachrichten) als eine Datei:
+#
+#   MAGIC | Datensatz | Datensatz | ... | Offset-Tabelle (JSON) | Trailer
+#
+# Jeder Datensatz ist zlib-komprimiert (Nachrichtentext bzw. optional die
+# Suchindex-Einträge eines Tabs als JSON). Die Offset-Tabelle steht am Ende, der
+# Trailer verweist auf sie. Beim Öffnen werden nur Trailer und Tabelle gelesen; load() holt die komprimierten
+# Datensätze in den Speicher, entpackt werden sie erst, wenn ein Tab sie braucht.
+# Sitzungsdateien kommen von außen, daher nur JSON und keine pickle-Daten; alles,
+# was nicht zum Format passt, ergibt einen ValueError.
+import json
+import os
+import struct
+import zlib
+from collections import namedtuple
+from pathlib import Path
+
+from hl7_definitions import dictionary_cache_dir
+
+
+MAGIC = b"HL7WS\x01"
+SESSION_FORMAT = 2
+SESSION_SUFFIX = ".hl7ws"
+# Offset und Länge der Tabelle, dann nochmal MAGIC zur Erkennung abgeschnittener Dateien
+_TRAILER = struct.Struct("<QQ6s")
+COMPRESSION_LEVEL = 6
+
+# Ein Tab: kind "message" (Text im Datensatz) oder "batch" (nur Pfad der Datei)
+SessionTab = namedtuple("SessionTab", ["kind", "name", "text", "entries", "path"], defaults=(None, None))
+# Eintrag der Offset-Tabelle; (Offset, Länge) bzw. None für fehlende Datensätze
+_TableEntry = namedtuple("_TableEntry", ["kind", "name", "text", "entries", "path"])
+TAB_KINDS = ("message", "batch")
+
+
+def default_session_path():
+    return dictionary_cache_dir() / f"last-session{SESSION_SUFFIX}"
+
+
+def _write_record(f, data, offset):
+    blob = zlib.compress(data, COMPRESSION_LEVEL)
+    f.write(blob)
+    return (offset, len(blob)), offset + len(blob)
+
+
+def _write_tabs(f, offset, tabs, include_entries):
+    table = []
+    for tab in tabs:
+        text = entries = None
+        if tab.kind == "message":
+            text, offset = _write_record(f, (tab.text or "").encode("utf-8"), offset)
+            if include_entries and tab.entries is not None:
+                data = json.dumps(tab.entries, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                entries, offset = _write_record(f, data, offset)
+        table.append((tab.kind, tab.name, text, entries, tab.path))
+    return table, offset
+
+
+def _write_table(f, offset, table, current):
+    header = json.dumps({"format": SESSION_FORMAT, "current": current, "tabs": table},
+                        ensure_ascii=False).encode("utf-8")
+    f.write(header)
+    f.write(_TRAILER.pack(offset, len(header), MAGIC))
+
+
+def write_session(path, tabs, current=0, include_entries=True):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        table, offset = _write_tabs(f, len(MAGIC), tabs, include_entries)
+        _write_table(f, offset, table, current)
+    os.replace(tmp_path, path)
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# (Offset, Länge) eines Datensatzes vor der Tabelle, oder None
+def _record_span(value, table_offset):
+    if value is None:
+        return None
+    if (not isinstance(value, list) or len(value) != 2 or not all(_is_int(v) for v in value)
+            or value[0] < len(MAGIC) or value[1] < 0 or value[0] + value[1] > table_offset):
+        raise ValueError("invalid record offset")
+    return tuple(value)
+
+
+def _read_header(data, table_offset):
+    header = json.loads(data.decode("utf-8"))
+    if not isinstance(header, dict) or header.get("format") != SESSION_FORMAT:
+        raise ValueError("unsupported session format")
+    table = []
+    for entry in header["tabs"]:
+        kind, name, text, entries, path = entry
+        if kind not in TAB_KINDS or not isinstance(name, str) or not (path is None or isinstance(path, str)):
+            raise ValueError("invalid tab entry")
+        table.append(_TableEntry(kind, name, _record_span(text, table_offset),
+                                 _record_span(entries, table_offset), path))
+    current = header["current"]
+    if not _is_int(current):
+        raise ValueError("invalid current tab")
+    return table, current
+
+
+def _read_entries(data):
+    entries = []
+    for path, value, start, end in json.loads(data.decode("utf-8")):
+        if not (isinstance(path, str) and isinstance(value, str) and _is_int(start) and _is_int(end)):
+            raise ValueError("invalid search entry")
+        entries.append((path, value, start, end))
+    return entries
+
+
+class SessionFile:
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not an HL7 Lookup session")
+            f.seek(-_TRAILER.size, os.SEEK_END)
+            table_offset, table_length, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} is truncated")
+            f.seek(table_offset)
+            data = f.read(table_length)
+        try:
+            self._table, self.current = _read_header(data, table_offset)
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"{self.path} is damaged or has an unsupported session format ({e})") from None
+        # span -> komprimierter Datensatz, nach load()
+        self._records = None
+
+    def __len__(self):
+        return len(self._table)
+
+    def kind(self, index):
+        return self._table[index].kind
+
+    def name(self, index):
+        return self._table[index].name
+
+    def batch_path(self, index):
+        return self._table[index].path
+
+    # Liest alle Datensätze (komprimiert) in einem Durchgang. Danach wird die Datei
+    # nicht mehr gebraucht und darf ersetzt werden, z.B. vom Speichern beim Beenden.
+    def load(self):
+        records = {}
+        with open(self.path, "rb") as f:
+            for entry in self._table:
+                for span in (entry.text, entry.entries):
+                    if span is not None and span not in records:
+                        f.seek(span[0])
+                        records[span] = f.read(span[1])
+        self._records = records
+
+    def _read_record(self, span):
+        if self._records is not None:
+            blob = self._records[span]
+        else:
+            with open(self.path, "rb") as f:
+                f.seek(span[0])
+                blob = f.read(span[1])
+        try:
+            return zlib.decompress(blob)
+        except zlib.error as e:
+            raise ValueError(f"{self.path} is damaged ({e})") from None
+
+    def text(self, index):
+        span = self._table[index].text
+        if not span:
+            return ""
+        try:
+            return self._read_record(span).decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise ValueError(f"{self.path} is damaged ({e})") from None
+
+    def entries(self, index):
+        span = self._table[index].entries
+        if not span:
+            return None
+        try:
+            return _read_entries(self._read_record(span))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"{self.path} has invalid search entries ({e})") from None
@@ -0,0 +1,403 @@
+# hl7_store.py
+#
+# Spaltenspeicher für viele Nachrichten (z.B. den Verkehr eines Tages) und Abfragen darüber:
+#
+#   store = MessageStore()
+#   store.ingest_file("2024-05-01.hl7")
+#   print(format_result(store.query("top PV1.3.1 10 where MSH.9.1=ADT")))
+#   store.save("2024-05-01.hl7store")
+#
+# Pro Feldpfad (PID.3, PID.3.1, und der Segmentname selbst für jedes Segment) gibt es
+# eigene Spalten als array: Nachricht, Segment, Wert-ID, Start und Länge im
+# Nachrichtentext. Werte sind als IDs in ein Wörterbuch kodiert. Abfragen laufen über
+# ganze Spalten (Counter, itertools.compress, Mengen), nicht Zeile für Zeile.
+#
+# Datei: MAGIC | Länge des Kopfs | Kopf (JSON: Pfade, Wörterbuch, Quellen und Name,
+# Typecode und Länge jeder Spalte) | Spalten roh hintereinander (array.tofile).
+# Store-Dateien kommen von außen, daher kein pickle; beim Laden muss alles genau
+# zum erwarteten Aufbau passen, sonst ValueError. Nichts hier importiert Qt.
+import json
+import os
+import re
+import struct
+import sys
+from array import array
+from collections import Counter, deque, namedtuple
+from itertools import compress, islice
+from pathlib import Path
+
+from hl7_batch import BatchFile
+from hl7_parser import DEFAULT_DELIMITERS, read_delimiters, segment_name, tokenize_hl7
+
+
+MAGIC = b"HL7ST\x01"
+STORE_FORMAT = 2
+_HEADER_LENGTH = struct.Struct("<Q")
+STORE_SUFFIX = ".hl7store"
+# Nachrichten pro Auftrag an den Prozess-Pool beim Einlesen
+CHUNK_SIZE = 200
+DEFAULT_TOP = 20
+
+# Ergebnis einer Abfrage: Spaltennamen und Zeilen (Tupel)
+QueryResult = namedtuple("QueryResult", ["columns", "rows"])
+
+_PATH = r"[A-Z][A-Z0-9]{2}(?:\.\d+){0,3}"
+_QUERY = re.compile(rf"^\s*(count|top|nulls|messages)\b\s*({_PATH})?\s*(\d+)?\s*(?:where\s+(.+))?$", re.IGNORECASE)
+_CONDITION = re.compile(rf"^\s*({_PATH})\s*(!=|=|~)\s*(.*?)\s*$", re.IGNORECASE)
+
+
+class QueryError(ValueError):
+    pass
+
+
+# Spalten eines Feldpfads
+class PathColumns:
+    __slots__ = ("message", "segment", "value", "start", "length")
+    TYPECODE = "I"
+
+    def __init__(self):
+        self.message = array("I")
+        self.segment = array("I")
+        self.value = array("I")
+        self.start = array("I")
+        self.length = array("I")
+
+    def __len__(self):
+        return len(self.message)
+
+
+# (Pfad, Segmentnummer, Wert, Start, Länge) für jedes Segment (Pfad = Segmentname, Wert
+# leer), jedes nicht leere Feld, jede Komponente und Subkomponente. Wiederholungen teilen
+# sich den Pfad. Ein Feld ohne Komponententrenner ist auch seine Komponente .1, sonst
+# fänden top/nulls/where auf PID.3.1 bei PID|1||123456 nichts.
+def message_entries(text):
+    try:
+        delimiters = read_delimiters(text)
+    except ValueError:
+        delimiters = DEFAULT_DELIMITERS
+    entries = []
+    for s, segment in enumerate(tokenize_hl7(text, delimiters)):
+        seg_name = segment_name(text, segment)
+        entries.append((seg_name, s, "", segment.start, 0))
+        for i, field in enumerate(segment.fields, 1):
+            if field.end <= field.start:
+                continue
+            field_path = f"{seg_name}.{i}"
+            entries.append((field_path, s, text[field.start:field.end], field.start, field.end - field.start))
+            if seg_name == "MSH" and i <= 2:
+                continue
+            for repetition in field.repetitions:
+                subs = repetition.subcomponents or {}
+                for j, (start, end) in enumerate(repetition.components, 1):
+                    if end <= start:
+                        continue
+                    entries.append((f"{field_path}.{j}", s, text[start:end], start, end - start))
+                    for k, (sub_start, sub_end) in enumerate(subs.get(j - 1, ()), 1):
+                        if sub_end > sub_start:
+                            entries.append((f"{field_path}.{j}.{k}", s, text[sub_start:sub_end],
+                                            sub_start, sub_end - sub_start))
+    return entries
+
+
+def _entries_for_chunk(chunk):
+    return [message_entries(text) for text in chunk]
+
+
+class MessageStore:
+    def __init__(self):
+        self.paths = []
+        self._path_ids = {}
+        self.values = [""]
+        self._value_ids = {"": 0}
+        self._lower_values = None
+        self.columns = {}
+        # Herkunft jeder Nachricht: Index in sources (oder -1) und Byte-Offset in der Datei
+        self.sources = []
+        self.message_source = array("i")
+        self.message_offset = array("Q")
+
+    def __len__(self):
+        return len(self.message_source)
+
+    def row_count(self):
+        return sum(len(columns) for columns in self.columns.values())
+
+    # Gebundene append-Methoden der Spalten je Pfad, spart beim Einlesen die Attributzugriffe
+    def _appenders(self, path):
+        path_id = self._path_ids.get(path)
+        if path_id is None:
+            path_id = self._path_ids[path] = len(self.paths)
+            self.paths.append(path)
+            self.columns[path_id] = PathColumns()
+        columns = self.columns[path_id]
+        return (columns.message.append, columns.segment.append, columns.value.append,
+                columns.start.append, columns.length.append)
+
+    def _add_entries(self, message_id, entries, appenders):
+        value_ids = self._value_ids
+        values = self.values
+        for path, segment, value, start, length in entries:
+            append = appenders.get(path)
+            if append is None:
+                append = appenders[path] = self._appenders(path)
+            value_id = value_ids.get(value)
+            if value_id is None:
+                value_id = value_ids[value] = len(values)
+                values.append(value)
+            append[0](message_id)
+            append[1](segment)
+            append[2](value_id)
+            append[3](start)
+            append[4](length)
+
+    # Liest Nachrichten ein; `offsets` sind die Byte-Offsets in der Quelle (falls bekannt).
+    # Mit jobs > 1 wird in mehreren Prozessen tokenisiert, eingefügt wird hier.
+    # is_cancelled() bricht nach dem laufenden Block ab, Eingelesenes bleibt erhalten.
+    def ingest(self, messages, source=None, offsets=None, jobs=1, progress=None, is_cancelled=lambda: False):
+        source_id = -1
+        if source is not None:
+            source_id = len(self.sources)
+            self.sources.append(str(source))
+        self._lower_values = None
+        offsets = iter(offsets) if offsets is not None else None
+        appenders = {}
+
+        def add(chunk_entries):
+            for entries in chunk_entries:
+                message_id = len(self.message_source)
+                self.message_source.append(source_id)
+                self.message_offset.append(next(offsets) if offsets is not None else 0)
+                self._add_entries(message_id, entries, appenders)
+            if progress is not None:
+                progress(len(self.message_source))
+
+        messages = iter(messages)
+        chunks = iter(lambda: list(islice(messages, CHUNK_SIZE)), [])
+        if jobs <= 1:
+            for chunk in chunks:
+                if is_cancelled():
+                    break
+                add(_entries_for_chunk(chunk))
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # Nur begrenzt viele Aufträge gleichzeitig, damit die Eingabe gestreamt bleibt
+            pending = deque()
+            for chunk in chunks:
+                if is_cancelled():
+                    break
+                pending.append(executor.submit(_entries_for_chunk, chunk))
+                if len(pending) >= jobs * 2:
+                    add(pending.popleft().result())
+            while pending:
+                if is_cancelled():
+                    for future in pending:
+                        future.cancel()
+                    break
+                add(pending.popleft().result())
+
+    def ingest_file(self, path, jobs=1, progress=None, is_cancelled=lambda: False):
+        batch = BatchFile(path)
+        try:
+            batch.set_index(batch.scan())
+            messages = (batch.message_text(i) for i in range(len(batch)))
+            self.ingest(messages, path, batch.starts, jobs, progress, is_cancelled)
+        finally:
+            batch.close()
+
+    # (Name, array) aller Spalten in Dateireihenfolge
+    def _named_arrays(self):
+        arrays = [("message_source", self.message_source), ("message_offset", self.message_offset)]
+        for path_id, path in enumerate(self.paths):
+            columns = self.columns[path_id]
+            arrays.extend((f"{path}:{name}", getattr(columns, name)) for name in PathColumns.__slots__)
+        return arrays
+
+    # Erwarteter Aufbau zu den Pfaden aus dem Kopf: (Name, Typecode)
+    @staticmethod
+    def _expected_arrays(paths):
+        expected = [("message_source", "i"), ("message_offset", "Q")]
+        for path in paths:
+            expected.extend((f"{path}:{name}", PathColumns.TYPECODE) for name in PathColumns.__slots__)
+        return expected
+
+    def save(self, path):
+        path = Path(path)
+        arrays = self._named_arrays()
+        header = json.dumps({
+            "format": STORE_FORMAT,
+            "byteorder": sys.byteorder,
+            "paths": self.paths,
+            "values": self.values,
+            "sources": self.sources,
+            "arrays": [[name, a.typecode, a.itemsize, len(a)] for name, a in arrays],
+        }, ensure_ascii=False).encode("utf-8")
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            for _, a in arrays:
+                a.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            return cls._load(path)
+        except (ValueError, KeyError, TypeError, EOFError, struct.error) as e:
+            raise ValueError(f"{path} is damaged or has an unsupported store format ({e})") from None
+
+    @classmethod
+    def _load(cls, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("not an HL7 Lookup store")
+            size = os.fstat(f.fileno()).st_size
+            (header_length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+            if header_length > size:
+                raise ValueError("invalid header length")
+            header = json.loads(f.read(header_length).decode("utf-8"))
+            if not isinstance(header, dict) or header.get("format") != STORE_FORMAT:
+                raise ValueError("unsupported store format")
+            if header["byteorder"] not in ("little", "big"):
+                raise ValueError("invalid byte order")
+            paths, values, sources = header["paths"], header["values"], header["sources"]
+            for strings in (paths, values, sources):
+                if not isinstance(strings, list) or not all(isinstance(item, str) for item in strings):
+                    raise ValueError("invalid header")
+            if len(set(paths)) != len(paths) or len(set(values)) != len(values) or values[:1] != [""]:
+                raise ValueError("invalid header")
+
+            described = header["arrays"]
+            expected = cls._expected_arrays(paths)
+            if not isinstance(described, list) or len(described) != len(expected):
+                raise ValueError("unexpected columns")
+            arrays = []
+            for entry, (name, typecode) in zip(described, expected):
+                entry_name, entry_typecode, itemsize, length = entry
+                if (entry_name, entry_typecode) != (name, typecode) or itemsize != array(typecode).itemsize:
+                    raise ValueError(f"unexpected column {entry_name!r}")
+                if not isinstance(length, int) or length < 0 or length * itemsize > size:
+                    raise ValueError(f"invalid length of column {name!r}")
+                a = array(typecode)
+                a.fromfile(f, length)
+                if header["byteorder"] != sys.byteorder:
+                    a.byteswap()
+                arrays.append(a)
+            if f.read(1):
+                raise ValueError("unexpected data after the columns")
+
+        store = cls()
+        store.paths = paths
+        store._path_ids = {name: i for i, name in enumerate(paths)}
+        store.values = values
+        store._value_ids = {value: i for i, value in enumerate(values)}
+        store.sources = sources
+        store.message_source, store.message_offset = arrays[:2]
+        messages = len(store.message_source)
+        if len(store.message_offset) != messages or (
+                messages and (min(store.message_source) < -1 or max(store.message_source) >= len(sources))):
+            raise ValueError("invalid message table")
+        width = len(PathColumns.__slots__)
+        for path_id in range(len(paths)):
+            columns = store.columns[path_id] = PathColumns()
+            path_arrays = arrays[2 + path_id * width:2 + (path_id + 1) * width]
+            for name, a in zip(PathColumns.__slots__, path_arrays):
+                setattr(columns, name, a)
+            if len({len(a) for a in path_arrays}) != 1:
+                raise ValueError(f"columns of {paths[path_id]} differ in length")
+            if len(columns) and (max(columns.message) >= messages or max(columns.value) >= len(values)):
+                raise ValueError(f"invalid ids in {paths[path_id]}")
+        return store
+
+    # Wert-IDs, deren Text (ohne Groß-/Kleinschreibung) gleich bzw. enthalten ist.
+    # Durchsucht nur das Wörterbuch der verschiedenen Werte, nicht alle Zeilen.
+    def _value_ids_matching(self, operator, text):
+        if self._lower_values is None:
+            self._lower_values = [value.lower() for value in self.values]
+        text = text.lower()
+        if operator == "~":
+            return {i for i, value in enumerate(self._lower_values) if text in value}
+        return {i for i, value in enumerate(self._lower_values) if value == text}
+
+    def _columns(self, path):
+        path_id = self._path_ids.get(path.upper())
+        return self.columns.get(path_id) if path_id is not None else None
+
+    # Nachrichten, die alle Bedingungen erfüllen (None = keine Einschränkung)
+    def _filter_messages(self, conditions):
+        selected = None
+        for path, operator, text in conditions:
+            columns = self._columns(path)
+            if columns is None:
+                matching = set()
+            else:
+                wanted = self._value_ids_matching("=" if operator == "!=" else operator, text)
+                matching = set(compress(columns.message, map(wanted.__contains__, columns.value)))
+            if operator == "!=":
+                matching = set(range(len(self))) - matching
+            selected = matching if selected is None else selected & matching
+        return selected
+
+    @staticmethod
+    def _select(column, messages, selected):
+        if selected is None:
+            return column
+        return compress(column, map(selected.__contains__, messages))
+
+    def query(self, text):
+        match = _QUERY.match(text)
+        if not match:
+            raise QueryError("Expected: count|top|nulls PATH [N] [where PATH=value and PATH~text ...] "
+                             "or messages [where ...]")
+        command, path, number, where = match.groups()
+        command = command.lower()
+        conditions = []
+        for part in re.split(r"\s+and\s+", where or "", flags=re.IGNORECASE):
+            if not part.strip():
+                continue
+            condition = _CONDITION.match(part)
+            if not condition:
+                raise QueryError(f"Invalid condition: {part.strip()}")
+            conditions.append((condition.group(1).upper(), condition.group(2), condition.group(3)))
+        if command != "messages" and not path:
+            raise QueryError(f"{command} needs a field path, e.g. {command} MSH.9")
+
+        selected = self._filter_messages(conditions)
+        if command == "messages":
+            count = len(self) if selected is None else len(selected)
+            return QueryResult(("messages", "of"), [(count, len(self))])
+
+        path = path.upper()
+        columns = self._columns(path) or PathColumns()
+        if command == "top":
+            counts = Counter(self._select(columns.value, columns.message, selected))
+            total = sum(counts.values())
+            rows = [(self.values[value_id], count, f"{count / total:.1%}")
+                    for value_id, count in counts.most_common(int(number or DEFAULT_TOP))]
+            return QueryResult(("value", "count", "share"), rows)
+        if command == "count":
+            messages = set(self._select(columns.message, columns.message, selected))
+            values = set(self._select(columns.value, columns.message, selected))
+            occurrences = len(columns) if selected is None else sum(map(selected.__contains__, columns.message))
+            return QueryResult(("path", "occurrences", "messages", "distinct values"),
+                               [(path, occurrences, len(messages), len(values))])
+
+        # nulls: Vorkommen des Segments, in denen der Pfad leer ist oder fehlt
+        segments = self._columns(path.split(".")[0]) or PathColumns()
+        present = set(zip(self._select(segments.message, segments.message, selected),
+                          self._select(segments.segment, segments.message, selected)))
+        filled = set(zip(columns.message, columns.segment)) & present
+        empty = len(present) - len(filled)
+        share = f"{empty / len(present):.1%}" if present else "-"
+        return QueryResult(("path", "segments", "empty", "share"), [(path, len(present), empty, share)])
+
+
+def format_result(result):
+    rows = [tuple(str(value) for value in row) for row in result.rows]
+    widths = [max([len(column)] + [len(row[i]) for row in rows]) for i, column in enumerate(result.columns)]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(result.columns, widths))]
+    for row in rows:
+        lines.append("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+    return "\n".join(line.rstrip() for line in lines)
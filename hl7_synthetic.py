@@ -0,0 +1,117 @@
+# hl7_synthetic.py
+#
+# Synthetische HL7-Nachrichten für Benchmarks und Lasttests:
+#
+#   generate_message("ORU", segments=5000, repetitions=3, seed=1)
+import random
+import time
+
+
+MESSAGE_TYPES = ("ADT", "ORU", "MDM")
+
+FAMILY_NAMES = ("Muster", "Schmidt", "Meyer", "Doe", "Rossi", "Novak", "Jansen", "Weber")
+GIVEN_NAMES = ("Max", "Anna", "John", "Lena", "Paul", "Maria", "Jonas", "Eva")
+OBSERVATIONS = (
+    ("718-7", "Hemoglobin", "g/dL", "13.5-17.5"),
+    ("2345-7", "Glucose", "mg/dL", "70-99"),
+    ("2951-2", "Sodium", "mmol/L", "136-145"),
+    ("2823-3", "Potassium", "mmol/L", "3.5-5.1"),
+    ("8867-4", "Heart rate", "/min", "60-100"),
+)
+DIAGNOSES = (("I10", "Essential hypertension"), ("E11.9", "Type 2 diabetes"), ("J18.9", "Pneumonia"))
+
+
+class _Builder:
+    def __init__(self, rng, repetitions):
+        self.rng = rng
+        self.repetitions = max(1, repetitions)
+
+    def timestamp(self):
+        return time.strftime("%Y%m%d%H%M%S", time.gmtime(self.rng.randrange(1_500_000_000, 1_800_000_000)))
+
+    def name(self):
+        return f"{self.rng.choice(FAMILY_NAMES)}^{self.rng.choice(GIVEN_NAMES)}^^^Dr.^^L"
+
+    # Wiederholungen mit Komponenten und Subkomponenten, z.B. 123^^^HOSP&1.2.3&ISO^MR~...
+    def identifiers(self):
+        return "~".join(
+            f"{self.rng.randrange(10**6, 10**7)}^^^HOSP{i}&1.2.276.0.{i}&ISO^MR^FAC&{i}&L"
+            for i in range(self.repetitions)
+        )
+
+    def addresses(self):
+        return "~".join(
+            f"Hauptstr. {self.rng.randrange(1, 200)}&Hauptstr.&{i}^^Berlin^BE^{self.rng.randrange(10000, 99999)}^DE^H"
+            for i in range(self.repetitions)
+        )
+
+    def msh(self, message_type, trigger, structure, control_id):
+        return (f"MSH|^~\\&|SendingApp|SendingFac|ReceivingApp|ReceivingFac|{self.timestamp()}||"
+                f"{message_type}^{trigger}^{structure}|{control_id}|P|2.5|||AL|NE||UNICODE UTF-8")
+
+    def evn(self, trigger):
+        return f"EVN|{trigger}|{self.timestamp()}|||{self.rng.randrange(1000)}^{self.name()}"
+
+    def pid(self):
+        return (f"PID|1||{self.identifiers()}||{self.name()}||{self.timestamp()[:8]}|{self.rng.choice('MFU')}|||"
+                f"{self.addresses()}||^PRN^PH^^49^30^{self.rng.randrange(10**6, 10**7)}")
+
+    def pv1(self):
+        return (f"PV1|1|{self.rng.choice('IOE')}|STAT^{self.rng.randrange(1, 50)}^{self.rng.randrange(1, 4)}^HOSP||||"
+                f"{self.rng.randrange(1000)}^{self.name()}|||MED||||||||V{self.rng.randrange(10**6)}")
+
+    def nk1(self, index):
+        return f"NK1|{index}|{self.name()}|SPO^Spouse^HL70063|{self.addresses()}|^PRN^PH^^49^30^{self.rng.randrange(10**6)}"
+
+    def dg1(self, index):
+        code, text = self.rng.choice(DIAGNOSES)
+        return f"DG1|{index}||{code}^{text}^I10|{text}|{self.timestamp()}|A"
+
+    def obr(self, index):
+        return (f"OBR|{index}|ORD{self.rng.randrange(10**6)}|FIL{self.rng.randrange(10**6)}|"
+                f"24323-8^Comprehensive metabolic panel^LN|||{self.timestamp()}")
+
+    def obx(self, index):
+        code, text, unit, reference = self.rng.choice(OBSERVATIONS)
+        value = round(self.rng.uniform(1, 200), 1)
+        return f"OBX|{index}|NM|{code}^{text}^LN||{value}|{unit}^{unit}^UCUM|{reference}|N|||F|||{self.timestamp()}"
+
+    def obx_text(self, index):
+        words = " ".join(self.rng.choice(FAMILY_NAMES + GIVEN_NAMES).lower() for _ in range(12))
+        return f"OBX|{index}|TX|11506-3^Progress note^LN||{words}~{words}||||||F"
+
+    def nte(self, index):
+        return f"NTE|{index}|L|Kommentar \\T\\ Hinweis {self.rng.randrange(1000)}"
+
+    def txa(self):
+        return (f"TXA|1|CN^Consultation^HL70270|TX|{self.timestamp()}|{self.name()}||||||"
+                f"DOC{self.rng.randrange(10**6)}^HOSP||||||AU")
+
+
+# Erzeugt eine Nachricht vom Typ ADT, ORU oder MDM mit genau `segments` Segmenten
+# (mindestens dem Nachrichtenkopf). `repetitions` bestimmt, wie oft wiederholbare
+# Felder (PID-3, PID-11, NK1-4) wiederholt werden.
+def generate_message(message_type="ADT", segments=10, repetitions=2, seed=0, separator="\r"):
+    if message_type not in MESSAGE_TYPES:
+        raise ValueError(f"Unknown message type {message_type!r}, expected one of {', '.join(MESSAGE_TYPES)}")
+
+    rng = random.Random(seed)
+    build = _Builder(rng, repetitions)
+    control_id = f"MSG{rng.randrange(10**8):08d}"
+
+    if message_type == "ADT":
+        lines = [build.msh("ADT", "A01", "ADT_A01", control_id), build.evn("A01"), build.pid(), build.pv1()]
+        fillers = (build.nk1, build.dg1, build.obx)
+    elif message_type == "ORU":
+        lines = [build.msh("ORU", "R01", "ORU_R01", control_id), build.pid(), build.pv1(), build.obr(1)]
+        fillers = (build.obx, build.obx, build.obx, build.nte)
+    else:
+        lines = [build.msh("MDM", "T02", "MDM_T02", control_id), build.evn("T02"), build.pid(), build.pv1(), build.txa()]
+        fillers = (build.obx_text,)
+
+    index = 1
+    while len(lines) < segments:
+        lines.append(fillers[index % len(fillers)](index))
+        index += 1
+
+    return separator.join(lines[:max(1, segments)])
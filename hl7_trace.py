@@ -0,0 +1,135 @@
+# hl7_trace.py
+#
+# Leichte Zeitmessung für die heißen Pfade (Parsen, Darstellung, MLLP-Versand):
+#
+#   with hl7_trace.span("view.legend", scope=tab_id):
+#       ...
+#   hl7_trace.counter("mllp.messages", len(messages))
+#
+# Ist das Tracing aus (Standard), liefert span() ein gemeinsames No-op-Objekt und
+# counter() kehrt sofort zurück. Einschalten mit enable() oder HL7_LOOKUP_TRACE=1.
+import os
+import threading
+import time
+from collections import deque
+
+
+MAX_EVENTS = 100_000
+
+_enabled = os.environ.get("HL7_LOOKUP_TRACE", "") not in ("", "0")
+_events = deque(maxlen=MAX_EVENTS)
+_stats = {}
+_last = {}
+_counters = {}
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def clear():
+    with _lock:
+        _events.clear()
+        _stats.clear()
+        _last.clear()
+        _counters.clear()
+
+
+def _now_us():
+    return (time.perf_counter() - _origin) * 1_000_000
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "scope", "args", "start")
+
+    def __init__(self, name, scope, args):
+        self.name = name
+        self.scope = scope
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.scope, self.start, _now_us() - self.start, self.args)
+        return False
+
+
+def span(name, scope=None, **args):
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, scope, args)
+
+
+def counter(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        total = _counters[name] = _counters.get(name, 0) + value
+        _events.append(("C", name, _now_us(), 0, threading.get_ident(), {"value": total}))
+
+
+def _record(name, scope, start, duration, args):
+    with _lock:
+        _events.append(("X", name, start, duration, threading.get_ident(), args))
+        count, total = _stats.get(name, (0, 0.0))
+        _stats[name] = (count + 1, total + duration)
+        _last[(scope, name)] = duration
+
+
+# Letzte Dauer in ms pro Span-Name für einen Scope (z.B. einen Tab)
+def last_durations(scope=None):
+    with _lock:
+        return {name: duration / 1000 for (span_scope, name), duration in _last.items() if span_scope == scope}
+
+
+def summary():
+    with _lock:
+        spans = {
+            name: {"count": count, "total_ms": round(total / 1000, 3), "mean_ms": round(total / count / 1000, 3)}
+            for name, (count, total) in _stats.items()
+        }
+        return {"spans": spans, "counters": dict(_counters)}
+
+
+def export_json(path):
+    import json
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary(), f, indent=2, sort_keys=True)
+
+
+# Format von chrome://tracing bzw. https://ui.perfetto.dev
+def export_chrome_trace(path):
+    import json
+    pid = os.getpid()
+    with _lock:
+        events = list(_events)
+    trace_events = []
+    for phase, name, start, duration, tid, args in events:
+        event = {"name": name, "ph": phase, "ts": round(start, 1), "pid": pid, "tid": tid, "args": args}
+        if phase == "X":
+            event["dur"] = round(duration, 1)
+        trace_events.append(event)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,221 @@
+# hl7_validation.py
+#
+# Validierung vieler Nachrichten mit hl7apy (STRICT) über einen Prozess-Pool:
+#
+#   report = validate_messages(texts, jobs=8)
+#   print(report.summary())
+#
+# Jeder Worker lädt hl7apy und die Referenzstrukturen der Versionen einmal beim Start
+# und behält sie für alle folgenden Nachrichten. Pro Nachricht werden alle Fehler und
+# Warnungen gesammelt (nicht nur der erste) und nach Fehlerart zusammengefasst.
+# hl7apy läuft nur in den Worker-Prozessen, auch für einzelne Nachrichten
+# (submit_validation); der aufrufende Prozess lädt es nie. Nichts hier importiert Qt.
+import atexit
+import functools
+import os
+import re
+import shutil
+import tempfile
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+
+
+# Nachrichten pro Auftrag an den Prozess-Pool
+CHUNK_SIZE = 100
+# Beispiel-Nachrichten, die pro Fehlerart im Bericht gemerkt werden
+EXAMPLES_PER_TYPE = 20
+
+# severity "error" oder "warning", kind ist die Fehlerart ohne konkrete Werte
+Problem = namedtuple("Problem", ["severity", "kind", "text"])
+ValidationResult = namedtuple("ValidationResult", ["message_id", "problems"])
+
+_REPORT_LINE = re.compile(r"^(Error|Warning): (.*)$")
+# Konkrete Werte aus den hl7apy-Meldungen entfernen, damit gleiche Fehler zusammenfallen
+_KIND_PATTERNS = (
+    (re.compile(r"^Value .* (not in table \S+ in element \S+)$", re.DOTALL), r"Value \1"),
+    (re.compile(r"^Cannot add <(\w+) .*?>: (max limit \(\d+\) reached for) <(\w+) (\w+).*$", re.DOTALL),
+     r"Cannot add \1: \2 \3 \4"),
+    (re.compile(r"(Unknown element found: ).*", re.DOTALL), r"\1<element>"),
+)
+
+_report_path = None
+# Prozess-Pool mit einem Worker für einzelne Nachrichten, bleibt bis zum Beenden bestehen
+_single_pool = None
+
+
+def error_kind(text):
+    for pattern, replacement in _KIND_PATTERNS:
+        kind, count = pattern.subn(replacement, text)
+        if count:
+            return kind
+    return text
+
+
+# hl7apy holt die Versions-Bibliothek für jedes Element erneut über importlib
+# (zehntausende Aufrufe pro Nachricht); einmal pro Version und Prozess reicht.
+# Ersetzt load_library in hl7apy, daher nur in Worker-Prozessen (warm_up).
+def _cache_library_lookups():
+    import hl7apy
+    import hl7apy.core
+    import hl7apy.factories
+    if hasattr(hl7apy.load_library, "cache_info"):
+        return
+    cached = functools.lru_cache(maxsize=None)(hl7apy.load_library)
+    for module in (hl7apy, hl7apy.core, hl7apy.factories):
+        module.load_library = cached
+
+
+# Initialisierung eines Worker-Prozesses: hl7apy importieren und die Bibliotheken
+# der erwarteten Versionen laden, bevor die erste Nachricht kommt. hl7apy schreibt
+# alle Fehler nur in eine Berichtsdatei, daher bekommt jeder Prozess eine eigene
+# in `report_dir` (das der aufrufende Prozess anlegt und wieder löscht).
+def warm_up(versions, report_dir):
+    global _report_path
+    _cache_library_lookups()
+    from hl7apy import load_library
+    from hl7apy.parser import parse_message  # noqa: F401
+    for version in versions:
+        try:
+            load_library(version)
+        except Exception:
+            pass
+    _report_path = os.path.join(report_dir, f"{os.getpid()}.txt")
+
+
+# Läuft im Worker-Prozess (nach warm_up)
+def validate_text(text):
+    from hl7apy.parser import parse_message
+    from hl7apy.consts import VALIDATION_LEVEL
+
+    if _report_path is None:
+        raise RuntimeError("validate_text runs in validation worker processes only")
+    message = text.strip().replace("\r\n", "\r").replace("\n", "\r")
+    # Reste eines früheren Laufs dürfen nicht als Ergebnis dieser Nachricht gelten
+    open(_report_path, "w").close()
+    try:
+        parse_message(message, validation_level=VALIDATION_LEVEL.STRICT, force_validation=True,
+                      report_file=_report_path)
+        return []
+    except Exception as e:
+        first = Problem("error", error_kind(str(e)), str(e))
+    with open(_report_path, encoding="utf-8", errors="replace") as f:
+        problems = []
+        for line in f:
+            match = _REPORT_LINE.match(line.rstrip("\n"))
+            if match:
+                problems.append(Problem(match.group(1).lower(), error_kind(match.group(2)), match.group(2)))
+    # Fehler beim Parsen selbst (vor der Validierung) stehen nicht im Bericht
+    return problems or [first]
+
+
+def _validate_chunk(chunk):
+    return [ValidationResult(message_id, validate_text(text)) for message_id, text in chunk]
+
+
+class ValidationReport:
+    def __init__(self):
+        self.messages = 0
+        self.invalid = 0
+        # (severity, kind) -> [Anzahl, Nachrichten-IDs der ersten Beispiele]
+        self.kinds = {}
+
+    def add(self, result):
+        self.messages += 1
+        if any(problem.severity == "error" for problem in result.problems):
+            self.invalid += 1
+        for problem in result.problems:
+            entry = self.kinds.setdefault((problem.severity, problem.kind), [0, []])
+            entry[0] += 1
+            if len(entry[1]) < EXAMPLES_PER_TYPE and result.message_id not in entry[1]:
+                entry[1].append(result.message_id)
+
+    # Fehlerarten, häufigste zuerst: (severity, kind, Anzahl, Beispiel-IDs)
+    def rows(self):
+        rows = [(severity, kind, count, examples) for (severity, kind), (count, examples) in self.kinds.items()]
+        rows.sort(key=lambda row: (row[0] != "error", -row[2], row[1]))
+        return rows
+
+    def summary(self):
+        lines = [f"Messages:   {self.messages} ({self.messages - self.invalid} valid, {self.invalid} invalid)"]
+        for severity, kind, count, examples in self.rows():
+            shown = ", ".join(str(message_id) for message_id in examples[:5])
+            lines.append(f"{count:>8}  {severity:<8} {kind}  (e.g. message {shown})")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            "messages": self.messages,
+            "invalid": self.invalid,
+            "kinds": [{"severity": severity, "kind": kind, "count": count, "examples": examples}
+                      for severity, kind, count, examples in self.rows()],
+        }
+
+
+# Validiert `messages` (Texte) in `jobs` Prozessen (mindestens einer). progress(Anzahl)
+# wird nach jedem Auftrag aufgerufen, is_cancelled() bricht nach dem laufenden Auftrag ab.
+def validate_messages(messages, jobs=None, versions=(), progress=None, is_cancelled=lambda: False,
+                      start_method=None):
+    jobs = max(jobs or os.cpu_count() or 1, 1)
+    numbered = enumerate(messages, 1)
+    chunks = iter(lambda: list(islice(numbered, CHUNK_SIZE)), [])
+    report = ValidationReport()
+
+    def collect(results):
+        for result in results:
+            report.add(result)
+        if progress is not None:
+            progress(report.messages)
+
+    import multiprocessing
+    context = multiprocessing.get_context(start_method) if start_method else None
+    # Worker-Prozesse räumen beim Beenden nicht auf, ihre Berichtsdateien liegen daher hier
+    with tempfile.TemporaryDirectory(prefix="hl7-validation-") as report_dir, \
+            ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=warm_up,
+                                initargs=(tuple(versions), report_dir)) as executor:
+        # Nur begrenzt viele Aufträge gleichzeitig, damit die Eingabe gestreamt bleibt
+        pending = deque()
+        for chunk in chunks:
+            if is_cancelled():
+                break
+            pending.append(executor.submit(_validate_chunk, chunk))
+            if len(pending) >= jobs * 2:
+                collect(pending.popleft().result())
+        while pending:
+            if is_cancelled():
+                for future in pending:
+                    future.cancel()
+                break
+            collect(pending.popleft().result())
+    return report
+
+
+# Validiert eine einzelne Nachricht im gemeinsamen Worker-Prozess und gibt ein
+# concurrent.futures.Future mit der Liste der Problems zurück. Der erste Aufruf
+# startet den Prozess; er lädt hl7apy einmal und bleibt für weitere Nachrichten.
+def submit_validation(text, start_method=None):
+    global _single_pool
+    if _single_pool is None:
+        _single_pool = _start_single_pool(start_method)
+    try:
+        return _single_pool.submit(validate_text, text)
+    except BrokenProcessPool:
+        # Der Worker ist abgestürzt, für diese und weitere Nachrichten einen neuen starten
+        _single_pool = _start_single_pool(start_method)
+        return _single_pool.submit(validate_text, text)
+
+
+def _start_single_pool(start_method):
+    import multiprocessing
+    context = multiprocessing.get_context(start_method) if start_method else None
+    report_dir = tempfile.mkdtemp(prefix="hl7-validation-")
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=warm_up,
+                                   initargs=((), report_dir))
+    atexit.register(_close_single_pool, executor, report_dir)
+    return executor
+
+
+def _close_single_pool(executor, report_dir):
+    executor.shutdown(wait=True, cancel_futures=True)
+    shutil.rmtree(report_dir, ignore_errors=True)
@@ -0,0 +1,396 @@
+# hl7lookup.py
+#
+# Headless entry point, usable without Qt:
+#
+#   python -m hl7lookup parse messages.hl7 > fields.jsonl
+#   cat capture.mllp | python -m hl7lookup parse --format csv --jobs 4
+#   python -m hl7lookup send localhost 2575 batch.hl7 --connections 4 --window 16
+#   python -m hl7lookup load localhost 2575 adt.hl7 --rate 200 --connections 8 --duration 600
+#   python -m hl7lookup serve 2575
+#   python -m hl7lookup validate samples/*.hl7 --jobs 8 --report report.json
+#   python -m hl7lookup query day.hl7 -e "top MSH.9 10" --save day.hl7store
+#
+# Nothing in here (or in the modules it imports) may import PySide6.
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+from hl7_batch import BatchFile, iter_stream_messages
+from hl7_definitions import get_segment_definition
+from hl7_mllp import MLLPConnectionPool, send_bulk
+from hl7_parser import read_delimiters, tokenize_hl7, segment_name, message_version, unescape
+
+
+ROW_COLUMNS = ("message", "segment_index", "segment", "field", "repetition", "component", "name", "value")
+
+# Nachrichten pro Auftrag an den Prozess-Pool
+CHUNK_SIZE = 200
+
+
+# Eine Zeile pro Feld bzw. Komponente einer Nachricht, siehe ROW_COLUMNS
+def message_rows(text, message_id, include_empty=False, raw=False):
+    delimiters = read_delimiters(text)
+    segments = tokenize_hl7(text, delimiters)
+    version = message_version(text, segments)
+
+    for segment_index, segment in enumerate(segments, 1):
+        seg_name = segment_name(text, segment)
+        seg_def = get_segment_definition(seg_name, version)
+
+        for i, field in enumerate(segment.fields, 1):
+            # MSH-1 und MSH-2 sind die Trennzeichen selbst
+            is_encoding = seg_name == "MSH" and i <= 2
+            for r, repetition in enumerate(field.repetitions, 1):
+                components = repetition.components
+                if len(components) == 1 or is_encoding:
+                    value = text[repetition.start:repetition.end]
+                    if value or include_empty:
+                        if not raw and not is_encoding:
+                            value = unescape(value, delimiters)
+                        yield (message_id, segment_index, seg_name, i, r, "", seg_def.field(i).name, value)
+                    continue
+
+                for j, (start, end) in enumerate(components, 1):
+                    value = text[start:end]
+                    if value or include_empty:
+                        if not raw:
+                            value = unescape(value, delimiters)
+                        yield (message_id, segment_index, seg_name, i, r, j, seg_def.component_name(i, j), value)
+
+
+def iter_input_messages(paths):
+    if not paths or paths == ["-"]:
+        yield from iter_stream_messages(sys.stdin.buffer)
+        return
+
+    for path in paths:
+        batch = BatchFile(path)
+        try:
+            batch.set_index(batch.scan())
+            for i in range(len(batch)):
+                yield batch.message_text(i)
+        finally:
+            batch.close()
+
+
+def _rows_for_chunk(chunk, include_empty, raw):
+    rows = []
+    errors = []
+    for message_id, text in chunk:
+        try:
+            rows.extend(message_rows(text, message_id, include_empty, raw))
+        except ValueError as e:
+            errors.append((message_id, str(e)))
+    return len(chunk), rows, errors
+
+
+def format_rows(rows, output_format):
+    output = io.StringIO()
+    if output_format == "csv":
+        csv.writer(output).writerows(rows)
+    else:
+        for row in rows:
+            output.write(json.dumps(dict(zip(ROW_COLUMNS, row)), ensure_ascii=False))
+            output.write("\n")
+    return output.getvalue()
+
+
+# Formatieren passiert ebenfalls im Worker, der Hauptprozess schreibt nur noch
+def _format_chunk(chunk, include_empty, raw, output_format):
+    count, rows, errors = _rows_for_chunk(chunk, include_empty, raw)
+    return count, len(rows), format_rows(rows, output_format), errors
+
+
+def map_message_chunks(function, messages, *args, jobs=1):
+    numbered = enumerate(messages, 1)
+    chunks = iter(lambda: list(islice(numbered, CHUNK_SIZE)), [])
+
+    if jobs <= 1:
+        for chunk in chunks:
+            yield function(chunk, *args)
+        return
+
+    # Nur begrenzt viele Aufträge gleichzeitig, damit die Eingabe gestreamt bleibt
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(function, chunk, *args))
+            if len(pending) >= jobs * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_rows(messages, include_empty=False, raw=False, jobs=1):
+    for _, rows, errors in map_message_chunks(_rows_for_chunk, messages, include_empty, raw, jobs=jobs):
+        yield from rows
+
+
+def command_parse(args):
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    messages = rows = 0
+    try:
+        if args.format == "csv":
+            csv.writer(output).writerow(ROW_COLUMNS)
+        results = map_message_chunks(_format_chunk, iter_input_messages(args.files),
+                                     args.include_empty, args.raw, args.format, jobs=args.jobs)
+        for count, row_count, text, errors in results:
+            for message_id, error in errors:
+                print(f"message {message_id}: {error}", file=sys.stderr)
+            output.write(text)
+            messages += count
+            rows += row_count
+    finally:
+        if args.output:
+            output.close()
+    print(f"{messages} messages, {rows} rows", file=sys.stderr)
+    return 0
+
+
+def command_send(args):
+    messages = list(iter_input_messages(args.files)) * args.repeat
+    if not messages:
+        print("no messages to send", file=sys.stderr)
+        return 1
+
+    async def run():
+        pool = MLLPConnectionPool(max_connections=args.connections, timeout=args.timeout)
+        try:
+            return await send_bulk(pool, args.host, args.port, messages, args.connections, args.window)
+        finally:
+            await pool.close()
+
+    report = asyncio.run(run())
+    print(report.summary())
+    return 0 if not report.errors and not report.naks else 2
+
+
+def command_load(args):
+    from hl7_load import LoadTest, MessageTemplate
+
+    try:
+        templates = [MessageTemplate(text) for text in iter_input_messages(args.files)]
+    except ValueError as e:
+        print(f"invalid template: {e}", file=sys.stderr)
+        return 1
+    if not templates:
+        print("no message templates", file=sys.stderr)
+        return 1
+
+    def show(row):
+        latencies = "  ".join(f"{name} {value * 1000:.1f} ms" if value is not None else f"{name} -"
+                              for name, value in (("p50", row.p50), ("p95", row.p95), ("p99", row.p99)))
+        print(f"{row.elapsed:7.1f} s  {row.sent:>8} sent  {row.throughput:8.1f} msg/s  {latencies}  "
+              f"NAK {row.naks}  errors {row.errors}", file=sys.stderr)
+
+    # Ohne Dauer und Anzahl wird jede Vorlage einmal gesendet
+    count = args.count or (None if args.duration else len(templates))
+    test = LoadTest(templates, args.rate, args.connections, args.window, args.duration, count,
+                    args.patients, args.timeout, args.interval, None if args.quiet else show)
+
+    async def run():
+        import signal
+        try:
+            # Strg+C beendet den Lauf, offene ACKs werden noch abgewartet
+            asyncio.get_running_loop().add_signal_handler(signal.SIGINT, test.stop)
+        except (NotImplementedError, RuntimeError):
+            pass
+        return await test.run(args.host, args.port)
+
+    stats = asyncio.run(run())
+    print(stats.summary())
+    if args.report:
+        stats.write_report(args.report, test.config())
+    return 0 if not stats.errors and not stats.naks and not stats.connection_errors else 2
+
+
+# Einfacher Empfänger, der jede Nachricht mit AA bestätigt, z.B. als Gegenstelle für load
+def command_serve(args):
+    from hl7_mllp import MessageRingBuffer, MLLPServer
+
+    buffer = MessageRingBuffer(args.keep)
+
+    async def run():
+        server = MLLPServer(buffer)
+        host, port = await server.start(args.host, args.port)
+        print(f"listening on {host}:{port}", file=sys.stderr)
+        try:
+            last = 0
+            while True:
+                await asyncio.sleep(1)
+                if not args.quiet and buffer.total != last:
+                    print(f"{buffer.total} messages received ({buffer.total - last}/s)", file=sys.stderr)
+                    last = buffer.total
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    print(f"{buffer.total} messages received", file=sys.stderr)
+    return 0
+
+
+# MSH-12 der ersten Nachricht, damit die Worker diese Version vorab laden
+def _first_version(text):
+    try:
+        delimiters = read_delimiters(text)
+    except ValueError:
+        return None
+    end = min((i for i in (text.find("\r"), text.find("\n")) if i != -1), default=len(text))
+    return message_version(text, tokenize_hl7(text[:end], delimiters))
+
+
+def command_validate(args):
+    from hl7_validation import validate_messages
+
+    messages = iter_input_messages(args.files)
+    first = next(messages, None)
+    if first is None:
+        print("no messages to validate", file=sys.stderr)
+        return 1
+    version = _first_version(first)
+
+    def progress(count):
+        print(f"\r{count} messages validated", end="", file=sys.stderr)
+
+    report = validate_messages(chain([first], messages), args.jobs, [version] if version else [],
+                               progress=None if args.quiet else progress)
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(report.summary())
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report.to_dict(), f, indent=2, ensure_ascii=False)
+    return 0 if not report.invalid else 2
+
+
+def command_query(args):
+    from hl7_store import STORE_SUFFIX, MessageStore, QueryError, format_result
+
+    stores = [path for path in args.files if path.endswith(STORE_SUFFIX)]
+    files = [path for path in args.files if not path.endswith(STORE_SUFFIX)]
+    if len(stores) > 1:
+        print("only one store can be loaded at a time", file=sys.stderr)
+        return 1
+    try:
+        store = MessageStore.load(stores[0]) if stores else MessageStore()
+    except (OSError, ValueError) as e:
+        print(f"store couldn't be loaded: {e}", file=sys.stderr)
+        return 1
+
+    def progress(count):
+        print(f"\r{count} messages ingested", end="", file=sys.stderr)
+
+    if files or not stores:
+        if files and files != ["-"]:
+            for path in files:
+                store.ingest_file(path, args.jobs, None if args.quiet else progress)
+        else:
+            store.ingest(iter_stream_messages(sys.stdin.buffer), jobs=args.jobs,
+                         progress=None if args.quiet else progress)
+        if not args.quiet:
+            print(file=sys.stderr)
+    if args.save:
+        store.save(args.save)
+
+    for i, query in enumerate(args.query):
+        if i:
+            print()
+        try:
+            print(format_result(store.query(query)))
+        except QueryError as e:
+            print(f"{query}: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(prog="hl7lookup", description="HL7 Lookup without GUI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parse = commands.add_parser("parse", help="Write all fields of HL7 messages as JSON Lines or CSV")
+    parse.add_argument("files", nargs="*", help="HL7 / batch / MLLP files, '-' or nothing for stdin")
+    parse.add_argument("-f", "--format", choices=("jsonl", "csv"), default="jsonl")
+    parse.add_argument("-o", "--output", help="Output file (default: stdout)")
+    parse.add_argument("-j", "--jobs", type=int, default=1, help="Worker processes (default: 1)")
+    parse.add_argument("--include-empty", action="store_true", help="Also write empty fields")
+    parse.add_argument("--raw", action="store_true", help="Keep HL7 escape sequences")
+    parse.set_defaults(handler=command_parse)
+
+    send = commands.add_parser("send", help="Send HL7 messages over MLLP and report ACK latencies")
+    send.add_argument("host")
+    send.add_argument("port", type=int)
+    send.add_argument("files", nargs="*", help="HL7 / batch / MLLP files, '-' or nothing for stdin")
+    send.add_argument("-n", "--repeat", type=int, default=1, help="Send all messages N times (default: 1)")
+    send.add_argument("-c", "--connections", type=int, default=1, help="Parallel connections (default: 1)")
+    send.add_argument("-w", "--window", type=int, default=1,
+                      help="Unacknowledged messages per connection (default: 1)")
+    send.add_argument("--timeout", type=float, default=10.0, help="ACK timeout in seconds (default: 10)")
+    send.set_defaults(handler=command_send)
+
+    load = commands.add_parser("load", help="Load/soak test an MLLP endpoint with messages built from templates")
+    load.add_argument("host")
+    load.add_argument("port", type=int)
+    load.add_argument("files", nargs="*", help="Template messages (HL7 / batch / MLLP files), '-' or nothing for stdin")
+    load.add_argument("-r", "--rate", type=float, help="Target messages per second over all connections (default: as fast as possible)")
+    load.add_argument("-c", "--connections", type=int, default=1, help="Parallel connections (default: 1)")
+    load.add_argument("-w", "--window", type=int, default=1,
+                      help="Unacknowledged messages per connection (default: 1)")
+    load.add_argument("-d", "--duration", type=float, help="Run for this many seconds")
+    load.add_argument("-n", "--count", type=int, help="Stop after this many messages")
+    load.add_argument("--patients", type=int, help="Number of distinct patient IDs (default: one per message)")
+    load.add_argument("--timeout", type=float, default=10.0, help="ACK timeout in seconds (default: 10)")
+    load.add_argument("--interval", type=float, default=1.0, help="Seconds between live reports (default: 1)")
+    load.add_argument("--report", help="Write the report as JSON (or the timeline as CSV with a .csv name)")
+    load.add_argument("-q", "--quiet", action="store_true", help="No live output")
+    load.set_defaults(handler=command_load)
+
+    serve = commands.add_parser("serve", help="Run an MLLP receiver that acknowledges every message (test stub)")
+    serve.add_argument("port", type=int)
+    serve.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    serve.add_argument("--keep", type=int, default=100, help="Received messages kept in memory (default: 100)")
+    serve.add_argument("-q", "--quiet", action="store_true", help="No progress output")
+    serve.set_defaults(handler=command_serve)
+
+    validate = commands.add_parser("validate", help="Validate HL7 messages with hl7apy (STRICT) in parallel")
+    validate.add_argument("files", nargs="*", help="HL7 / batch / MLLP files, '-' or nothing for stdin")
+    validate.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                          help="Worker processes (default: number of CPUs)")
+    validate.add_argument("-r", "--report", help="Write the report per error type as JSON")
+    validate.add_argument("-q", "--quiet", action="store_true", help="No progress output")
+    validate.set_defaults(handler=command_validate)
+
+    query = commands.add_parser("query", help="Ingest HL7 messages into a column store and run queries on it")
+    query.add_argument("files", nargs="*",
+                       help="HL7 / batch / MLLP files or one saved .hl7store, '-' or nothing for stdin")
+    query.add_argument("-e", "--query", action="append", default=[],
+                       help="count|top|nulls PATH [N] [where ...] or messages [where ...]; can be repeated")
+    query.add_argument("-s", "--save", help="Save the store to this file (.hl7store)")
+    query.add_argument("-j", "--jobs", type=int, default=1, help="Tokenizer processes while ingesting (default: 1)")
+    query.add_argument("-q", "--quiet", action="store_true", help="No progress output")
+    query.set_defaults(handler=command_query)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_argument_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except BrokenPipeError:
+        # Ausgabe wurde vorzeitig geschlossen, z.B. durch "| head"
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,34 @@
+import os
 import sys
+import time
+
+# Zeitpunkt vor den Qt-Imports, für --startup-time
+STARTUP_BEGIN = time.perf_counter()
+
+from collections import OrderedDict, deque
+from functools import lru_cache
+import re
 import dark
-import socket
+import hl7_trace
 from pathlib import Path
 from PySide6.QtGui import QIcon, QFontDatabase, QFont
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QDialogButtonBox,
-    QSplitter, QTextEdit, QTextBrowser, QTreeWidget,
-    QTreeWidgetItem, QTabWidget, QToolBar, QLineEdit,
+    QSplitter, QTextEdit, QTextBrowser, QTreeView,
+    QTabWidget, QToolBar, QLineEdit,
     QInputDialog, QMessageBox, QLabel, QPushButton,
-    QHBoxLayout, QFrame, QTabBar, QPushButton, QDialog, QFormLayout
+    QHBoxLayout, QFrame, QTabBar, QPushButton, QDialog, QFormLayout,
+    QFileDialog, QListWidget, QListWidgetItem, QSpinBox, QDockWidget, QComboBox,
+    QTreeWidget, QTreeWidgetItem, QTableWidget, QTableWidgetItem
 )
-from PySide6.QtGui import QColor, QAction, QTextCursor, QTextCharFormat, QMouseEvent
-from PySide6.QtCore import Qt, QEvent, QFile, QTextStream
-from hl7apy.parser import parse_message
-from hl7apy.parser import parse_segment
-from hl7apy.exceptions import HL7apyException
-from hl7apy.consts import VALIDATION_LEVEL
+from PySide6.QtGui import QColor, QAction, QTextCursor, QTextCharFormat, QMouseEvent, QSyntaxHighlighter
+from PySide6.QtCore import Qt, QEvent, QFile, QTextStream, QTimer, QObject, QRunnable, QThreadPool, Signal
+from hl7_parser import DEFAULT_DELIMITERS, read_delimiters, tokenize_hl7, segment_name, message_version, unescape
+from hl7_definitions import get_segment_definition
+from hl7_legend import LegendModel, segment_node
+from hl7_batch import BatchFile, message_summary, read_batch_messages
+from hl7_search import SearchIndex, index_entries
+from hl7_session import SessionFile, SessionTab, write_session, default_session_path, SESSION_SUFFIX
 
 
 SEGMENT_COLORS = {
@@ -32,296 +45,9 @@ SEGMENT_COLORS = {
     "AL1": "#82da9b",
     "PR1": "#bca3ca",
 }
-
-FRIENDLY_FIELD_NAMES = {
-    # MSH – Message Header (aus HL7‑Soup & Smile CDR)
-    "MSH_1": "MSH‑1  –  Field Separator",
-    "MSH_2": "MSH‑2  –  Encoding Characters",
-    "MSH_2.1": "    MSH‑2.1  –  Component-Separator",
-    "MSH_2.2": "    MSH‑2.2  –  Repetition Separator",
-    "MSH_2.3": "    MSH‑2.3  –  Escape Character '\\'",
-    "MSH_2.4": "    MSH‑2.4  –  Subcomponent Separator '&'",
-    "MSH_3": "MSH‑3  –  Sending Application",
-    "MSH_3.2": "    MSH‑3.2  –  Sending Application (Universal ID)",
-    "MSH_3.3": "    MSH‑3.3  –  Sending Application (Universal ID Type)",
-    "MSH_4": "MSH‑4  –  Sending Facility",
-    "MSH_4.2": "    MSH‑4.2  –  Sending Facility (Universal ID)",
-    "MSH_4.3": "    MSH‑4.3  –  Sending Facility (Universal ID Type)",
-    "MSH_5": "MSH‑5  –  Receiving Application",
-    "MSH_5.2": "    MSH‑5.2  –  Receiving Application (Universal ID)",
-    "MSH_5.3": "    MSH‑5.3  –  Receiving Application (Universal ID Type)",
-    "MSH_6": "MSH‑6  –  Receiving Facility",
-    "MSH_6.2": "    MSH‑6.2  –  Receiving Facility (Universal ID)",
-    "MSH_6.3": "    MSH‑6.3  –  Receiving Facility (Universal ID Type)",
-    "MSH_7": "MSH‑7  –  Date/Time Of Message",
-    "MSH_8": "MSH‑8  –  Security",
-    "MSH_9": "MSH‑9  –  Message Type",
-    "MSH_9.1": "    MSH‑9.1  –  Message Type",
-    "MSH_9.2": "    MSH‑9.2  –  Trigger Event",
-    "MSH_9.3": "    MSH‑9.3  –  Message Structure",
-    "MSH_10": "MSH‑10  –  Message Control ID",
-    "MSH_11": "MSH‑11  –  Processing ID",
-    "MSH_12": "MSH‑12  –  Version ID",
-    "MSH_13": "MSH‑13  –  Sequence Number",
-    "MSH_14": "MSH‑14  –  Continuation Pointer",
-    "MSH_15": "MSH‑15  –  Accept Acknowledgment Type",
-    "MSH_16": "MSH‑16  –  Application Acknowledgment Type",
-    "MSH_17": "MSH‑17  –  Country Code",
-    "MSH_18": "MSH‑18  –  Character Set",
-    "MSH_19": "MSH‑19  –  Principal Language",
-
-    # PV1 – Patient Visit (aus Rhapsody: alle Felder bis 52)
-    "PV1_1": "PV1‑1 – Set ID – PV1",
-    "PV1_2": "PV1‑2 – Patient Class",
-    "PV1_3": "PV1‑3 – Assigned Patient Location",
-    "PV1_3.1": "    PV1‑3.1 – Point Of Care",
-    "PV1_3.2": "    PV1‑3.2 – Room",
-    "PV1_3.3": "    PV1‑3.3 – Bed",
-    "PV1_3.4": "    PV1‑3.4 – Facility",
-    "PV1_4": "PV1‑4 – Admission Type",
-    "PV1_5": "PV1‑5 – Preadmit Number",
-    "PV1_6": "PV1‑6 – Prior Patient Location",
-    "PV1_7": "PV1‑7 – Attending Doctor",
-    "PV1_7.1": "    PV1‑7.1 – Attending Physician Code",
-    "PV1_7.2": "    PV1‑7.2 – Attending Last Name",
-    "PV1_7.3": "    PV1‑7.3 – Attending First Name",
-    "PV1_7.4": "    PV1‑7.4 – Attending Doctor",
-    "PV1_7.5": "    PV1‑7.5 – Attending Suffix",
-    "PV1_7.6": "    PV1‑7.6 – Attending Doctor",
-    "PV1_7.7": "    PV1‑7.7 – Attending Credentials",
-    "PV1_8": "PV1‑8 – Referring Doctor",
-    "PV1_9": "PV1‑9 – Consulting Doctor",
-    "PV1_10": "PV1‑10 – Hospital Service",
-    "PV1_11": "PV1‑11 – Temporary Location",
-    "PV1_12": "PV1‑12 – Preadmit Test Indicator",
-    "PV1_13": "PV1‑13 – Re‑admission Indicator",
-    "PV1_14": "PV1‑14 – Admit Source",
-    "PV1_15": "PV1‑15 – Ambulatory Status",
-    "PV1_16": "PV1‑16 – VIP Indicator",
-    "PV1_17": "PV1‑17 – Admitting Doctor",
-    "PV1_18": "PV1‑18 – Patient Type",
-    "PV1_19": "PV1‑19 – Visit Number",
-    "PV1_20": "PV1‑20 – Financial Class",
-    "PV1_21": "PV1‑21 – Charge Price Indicator",
-    "PV1_22": "PV1‑22 – Courtesy Code",
-    "PV1_23": "PV1‑23 – Credit Rating",
-    "PV1_24": "PV1‑24 – Contract Code",
-    "PV1_25": "PV1‑25 – Contract Effective Date",
-    "PV1_26": "PV1‑26 – Contract Amount",
-    "PV1_27": "PV1‑27 – Contract Period",
-    "PV1_28": "PV1‑28 – Interest Code",
-    "PV1_29": "PV1‑29 – Transfer to Bad Debt Code",
-    "PV1_30": "PV1‑30 – Transfer to Bad Debt Date",
-    "PV1_31": "PV1‑31 – Bad Debt Agency Code",
-    "PV1_32": "PV1‑32 – Bad Debt Transfer Amount",
-    "PV1_33": "PV1‑33 – Bad Debt Recovery Amount",
-    "PV1_34": "PV1‑34 – Delete Account Indicator",
-    "PV1_35": "PV1‑35 – Delete Account Date",
-    "PV1_36": "PV1‑36 – Discharge Disposition",
-    "PV1_37": "PV1‑37 – Discharged to Location",
-    "PV1_38": "PV1‑38 – Diet Type",
-    "PV1_39": "PV1‑39 – Servicing Facility",
-    "PV1_40": "PV1‑40 – Bed Status",
-    "PV1_41": "PV1‑41 – Account Status",
-    "PV1_42": "PV1‑42 – Pending Location",
-    "PV1_43": "PV1‑43 – Prior Temporary Location",
-    "PV1_44": "PV1‑44 – Admit Date/Time",
-    "PV1_45": "PV1‑45 – Discharge Date/Time",
-    "PV1_46": "PV1‑46 – Current Patient Balance",
-    "PV1_47": "PV1‑47 – Total Charges",
-    "PV1_48": "PV1‑48 – Total Adjustments",
-    "PV1_49": "PV1‑49 – Total Payments",
-    "PV1_50": "PV1‑50 – Alternate Visit ID",
-    "PV1_51": "PV1‑51 – Visit Indicator",
-    "PV1_52": "PV1‑52 – Other Healthcare Provider",
-
-    # PV2 – Patient Visit - Additional Information
-    "PV2_1": "PV2‑1  –  Prior Pending Location",
-    "PV2_1.1": "    PV2‑1.1  –  Point of Care",
-    "PV2_1.2": "    PV2‑1.2  –  Room",
-    "PV2_1.3": "    PV2‑1.3  –  Bed",
-    "PV2_1.4": "    PV2‑1.4  –  Facility",
-    "PV2_1.5": "    PV2‑1.5  –  Location Status",
-    "PV2_1.6": "    PV2‑1.6  –  Person Location Type",
-    "PV2_1.7": "    PV2‑1.7  –  Building",
-    "PV2_1.8": "    PV2‑1.8  –  Floor",
-    "PV2_1.9": "    PV2‑1.9  –  Location Description",
-    "PV2_2": "PV2‑2  –  Accommodation Code",
-    "PV2_2.1": "    PV2‑2.1  –  Identifier",
-    "PV2_2.2": "    PV2‑2.2  –  Text",
-    "PV2_2.3": "    PV2‑2.3  –  Name of Coding System",
-    "PV2_2.4": "    PV2‑2.4  –  Alternate Identifier",
-    "PV2_2.5": "    PV2‑2.5  –  Alternate Text",
-    "PV2_2.6": "    PV2‑2.6  –  Name of Alternate Coding System",
-    "PV2_3": "PV2‑3  –  Admit Reason",
-    "PV2_4": "PV2‑4  –  Transfer Reason",
-    "PV2_5": "PV2‑5  –  Patient Valuables",
-    "PV2_6": "PV2‑6  –  Patient Valuables Location",
-    "PV2_7": "PV2‑7  –  Visit User Code",
-    "PV2_8": "PV2‑8  –  Expected Admit Date/Time",
-    "PV2_9": "PV2‑9  –  Expected Discharge Date/Time",
-    "PV2_10": "PV2‑10  –  Estimated Length of Inpatient Stay",
-    "PV2_11": "PV2‑11  –  Actual Length of Inpatient Stay",
-    "PV2_12": "PV2‑12  –  Visit Description",
-    "PV2_13": "PV2‑13  –  Referral Source Code",
-    "PV2_14": "PV2‑14  –  Previous Service Date",
-    "PV2_15": "PV2‑15  –  Employment Illness Related Indicator",
-    "PV2_16": "PV2‑16  –  Purge Status Code",
-    "PV2_17": "PV2‑17  –  Purge Status Date",
-    "PV2_18": "PV2‑18  –  Special Program Code",
-    "PV2_19": "PV2‑19  –  Retention Indicator",
-    "PV2_20": "PV2‑20  –  Expected Number of Insurance Plans",
-    "PV2_21": "PV2‑21  –  Visit Publicity Code",
-    "PV2_22": "PV2‑22  –  Visit Protection Indicator",
-    "PV2_23": "PV2‑23  –  Clinic Organization Name",
-    "PV2_24": "PV2‑24  –  Patient Status Code",
-    "PV2_25": "PV2‑25  –  Visit Priority Code",
-    "PV2_26": "PV2‑26  –  Previous Treatment Date",
-    "PV2_27": "PV2‑27  –  Expected Discharge Disposition",
-    "PV2_28": "PV2‑28  –  Signature on File Date",
-    "PV2_29": "PV2‑29  –  First Similar Illness Date",
-    "PV2_30": "PV2‑30  –  Patient Charge Adjustment Code",
-    "PV2_31": "PV2‑31  –  Recurring Service Code",
-    "PV2_32": "PV2‑32  –  Billing Patient Location",
-    "PV2_33": "PV2‑33  –  Visit Care Code",
-    "PV2_34": "PV2‑34  –  Visit Code",
-    "PV2_35": "PV2‑35  –  Visit Description - Long",
-    "PV2_36": "PV2‑36  –  Account Status",
-    "PV2_37": "PV2‑37  –  Pending Location",
-    "PV2_37.1": "    PV2‑37.1  –  Point of Care",
-    "PV2_37.2": "    PV2‑37.2  –  Room",
-    "PV2_37.3": "    PV2‑37.3  –  Bed",
-    "PV2_37.4": "    PV2‑37.4  –  Facility",
-    "PV2_37.5": "    PV2‑37.5  –  Location Status",
-    "PV2_37.6": "    PV2‑37.6  –  Person Location Type",
-    "PV2_37.7": "    PV2‑37.7  –  Building",
-    "PV2_37.8": "    PV2‑37.8  –  Floor",
-    "PV2_37.9": "    PV2‑37.9  –  Location Description",
-    "PV2_38": "PV2‑38  –  Prior Patient Location",
-    "PV2_38.1": "    PV2‑38.1  –  Point of Care",
-    "PV2_38.2": "    PV2‑38.2  –  Room",
-    "PV2_38.3": "    PV2‑38.3  –  Bed",
-    "PV2_38.4": "    PV2‑38.4  –  Facility",
-    "PV2_38.5": "    PV2‑38.5  –  Location Status",
-    "PV2_38.6": "    PV2‑38.6  –  Person Location Type",
-    "PV2_38.7": "    PV2‑38.7  –  Building",
-    "PV2_38.8": "    PV2‑38.8  –  Floor",
-    "PV2_38.9": "    PV2‑38.9  –  Location Description",
-    "PV2_39": "PV2‑39  –  Admit Source Code",
-    "PV2_40": "PV2‑40  –  Ambulatory Status",
-    "PV2_41": "PV2‑41  –  VIP Indicator",
-    "PV2_42": "PV2‑42  –  Admission Type Code",
-    "PV2_43": "PV2‑43  –  Visit Indicator",
-    "PV2_44": "PV2‑44  –  Other Healthcare Provider",
-
-
-
-    #PID - Patient Identification
-    "PID_1": "PID 1 - Set ID - PID",
-    "PID_2": "PID 2 - Patient ID (External ID)",
-    "PID_3": "PID 3 - Patient Identifier List",
-    "PID_3.1": "    PID‑3.1 – ID",
-    "PID_3.2": "    PID‑3.2 – Check Digit",
-    "PID_3.3": "    PID‑3.3 – Check Digit Scheme",
-    "PID_3.4": "    PID‑3.4 – Assigning Authority",
-    "PID_3.5": "    PID‑3.5 – Identifier Type Code",
-    "PID_3.6": "    PID‑3.6 – Assigning Facility",
-    "PID_3.7": "    PID‑3.7 – Effective Date",
-    "PID_3.8": "    PID‑3.8 – Expiration Date",
-    "PID_4": "PID 4 - Alternate Patient ID",
-    "PID_5": "PID 5 - Patient Name",
-    "PID_5.1": "    PID‑5.1 – Patient Last Name",
-    "PID_5.2": "    PID‑5.2 – Patient First Name",
-    "PID_5.3": "    PID‑5.3 – Patient Middle Name",
-    "PID_5.4": "    PID‑5.4 – Patient Suffix",
-    "PID_6": "PID 6 - Mother's Maiden Name",
-    "PID_7": "PID 7 - Date/Time of Birth",
-    "PID_8": "PID 8 - Administrative Sex",
-    "PID_9": "PID 9 - Patient Alias",
-    "PID_10": "PID 10 - Race",
-    "PID_11": "PID 11 - Patient Address",
-    "PID_11.1": "    PID 11.1 - Street 1",
-    "PID_11.2": "    PID 11.2 - Street 2",
-    "PID_11.3": "    PID 11.3 - City",
-    "PID_11.4": "    PID 11.4 - State",
-    "PID_11.5": "    PID 11.5 - Postal Code",
-    "PID_11.6": "    PID 11.6 - Country",
-    "PID_12": "PID 12 - County Code",
-    "PID_13": "PID 13 - Phone Number - Home",
-    "PID_14": "PID 14 - Phone Number - Business",
-    "PID_15": "PID 15 - Primary Language",
-    "PID_16": "PID 16 - Marital Status",
-    "PID_17": "PID 17 - Religion",
-    "PID_18": "PID 18 - Patient Account Number",
-    "PID_19": "PID 19 - SSN Number - Patient",
-    "PID_20": "PID 20 - Driver's License Number - Patient",
-    "PID_21": "PID 21 - Mother's Identifier",
-    "PID_22": "PID 22 - Ethnic Group",
-    "PID_23": "PID 23 - Birth Place",
-    "PID_24": "PID 24 - Multiple Birth Indicator",
-    "PID_25": "PID 25 - Birth Order",
-    "PID_26": "PID 26 - Citizenship",
-    "PID_27": "PID 27 - Veterans Military Status",
-    "PID_28": "PID 28 - Nationality",
-    "PID_29": "PID 29 - Patient Death Date and Time",
-    "PID_30": "PID 30 - Patient Death Indicator",
-
-    # EVN – Event Type (Standardfelder)
-    "EVN_1": "EVN‑1 – Event Type Code",
-    "EVN_2": "EVN‑2 – Recorded Date/Time",
-    "EVN_3": "EVN‑3 – Date/Time Planned Event",
-    "EVN_4": "EVN‑4 – Event Reason Code",
-    "EVN_5": "EVN‑5 – Operator ID",
-    "EVN_6": "EVN‑6 – Event Occurred (Date/Time)?",
-    "EVN_7": "EVN‑7 – Event Facility",
-
-    # NK1 – Next of Kin / Associated Party (typische Felder)
-    "NK1_1": "NK1‑1 – Set ID – NK1",
-    "NK1_2": "NK1‑2 – Name",
-    "NK1_3": "NK1‑3 – Relationship",
-    "NK1_4": "NK1‑4 – Address",
-    "NK1_5": "NK1‑5 – Phone Number",
-    "NK1_6": "NK1‑6 – Business Phone Number",
-    "NK1_7": "NK1‑7 – Contact Role",
-    "NK1_8": "NK1‑8 – Start Date",
-    "NK1_9": "NK1‑9 – End Date",
-    "NK1_10": "NK1‑10 – Next of Kin / Associated Parties Job Title",
-
-    # AL1 – Allergy Information
-    "AL1_1": "AL1‑1 – Set ID – AL1",
-    "AL1_2": "AL1‑2 – Allergen Type Code",
-    "AL1_3": "AL1‑3 – Allergen Code/Mnemonic/Description",
-    "AL1_4": "AL1‑4 – Allergy Severity Code",
-    "AL1_5": "AL1‑5 – Allergy Reaction",
-    "AL1_6": "AL1‑6 – Identification Date",
-
-    # DG1 – Diagnosis
-    "DG1_1": "DG1‑1 – Set ID – DG1",
-    "DG1_2": "DG1‑2 – Diagnosis Coding Method",
-    "DG1_3": "DG1‑3 – Diagnosis Code",
-    "DG1_4": "DG1‑4 – Diagnosis Description",
-    "DG1_5": "DG1‑5 – Diagnosis Date/Time",
-    "DG1_6": "DG1‑6 – Diagnosis Type",
-    "DG1_7": "DG1‑7 – Major Diagnostic Category",
-    "DG1_8": "DG1‑8 – Diagnostic Related Group",
-
-    # IN1 – Insurance
-    "IN1_1": "IN1‑1 – Set ID – IN1",
-    "IN1_2": "IN1‑2 – Insurance Plan ID",
-    "IN1_3": "IN1‑3 – Insurance Company ID",
-    "IN1_4": "IN1‑4 – Insurance Company Name",
-    "IN1_5": "IN1‑5 – Insurance Company Address",
-    "IN1_6": "IN1‑6 – Insurance Co Contact Person",
-    "IN1_7": "IN1‑7 – Insurance Co Phone Number",
-    "IN1_8": "IN1‑8 – Group Number",
-    "IN1_9": "IN1‑9 – Group Name",
-    "IN1_10": "IN1‑10 – Insured's Group Emp ID",
-    "IN1_11": "IN1‑11 – Insured's Group Emp Name",
-    "IN1_12": "IN1‑12 – Plan Effective Date",
-    "IN1_13": "IN1‑13 – Plan Expiration Date",
-    "IN1_14": "IN1‑14 – Authorization Information",
-    "IN1_15": "IN1‑15 – Plan Type",
-}
+DEFAULT_SEGMENT_COLOR = "#f8f8f2"
+# Trennzeichen im Eingabefeld
+DELIMITER_COLOR = "#6272a4"
 
 EXAMPLE_HL7 = """MSH|^~\\&|SendingApp|SendingFac|ReceivingApp|ReceivingFac|202208101200||ADT^A01|MSG00001|P|2.3
 EVN|A01|202208101200
@@ -329,6 +55,37 @@ PID|1||123456^^^Hospital^MR||Müller^Hans^A||19800101|M|||Musterstraße 1^^Muste
 PV1|1|I|Ward^123^Bed^1||||1234^Arzt^Max^^Dr.|||MED|||||||1234567|||||||||||||||||||||||||202208101200
 """
 
+# Nachrichten pro Seite in der Batch-Ansicht
+BATCH_PAGE_SIZE = 500
+# Empfangene Nachrichten werden gesammelt und höchstens so oft in die Liste übernommen
+LISTENER_REFRESH_MS = 250
+LISTENER_BUFFER_SIZE = 5000
+SEARCH_DELAY_MS = 150
+# Speicherbudget für aufgebaute Tabs, darüber werden die am längsten nicht
+# angezeigten Tabs wieder zu reinem Text (gemessen: ~3 MB + ~260 Byte pro Zeichen)
+TAB_MEMORY_BUDGET_MB = int(os.environ.get("HL7_LOOKUP_TAB_MEMORY_MB", "512"))
+TAB_BASE_BYTES = 3 * 1024 * 1024
+TAB_BYTES_PER_CHAR = 260
+# Arbeitsbereich beim Beenden speichern und beim Start wiederherstellen. Nur mit
+# HL7_LOOKUP_SESSION=1: die Datei enthält die Nachrichten (Patientendaten) im Klartext.
+SESSION_AUTOSAVE = os.environ.get("HL7_LOOKUP_SESSION", "0") == "1"
+SEARCH_HIGHLIGHT_COLOR = "#6d5a1e"
+# Tabs, die pro Durchlauf der Event-Loop nachträglich indexiert werden
+SEARCH_INDEX_BATCH = 4
+# Farben im Vergleich; markiert werden höchstens DIFF_HIGHLIGHT_LIMIT Unterschiede
+DIFF_COLORS = {"changed": "#6d5a1e", "added": "#2f5a32", "removed": "#6b2d2d"}
+DIFF_HIGHLIGHT_LIMIT = 2000
+
+# Wartezeit nach dem letzten Tastendruck, bevor neu geparst wird
+UPDATE_DELAY_MS = 150
+# Formatierte Ausgabe unter dem Eingabefeld (HL7_LOOKUP_OUTPUT_PANEL=0 blendet sie aus).
+# Das Eingabefeld ist selbst eingefärbt, bei großen Nachrichten spart das Ausblenden
+# den Aufbau des zweiten Dokuments.
+OUTPUT_PANEL = os.environ.get("HL7_LOOKUP_OUTPUT_PANEL", "1") != "0"
+
+# Bis zu dieser Zeilenzahl wird die Legende komplett aufgeklappt, sonst nur die Segmente
+LEGEND_EXPAND_ALL_ROWS = 2000
+
 # Stylesheet laden
 def load_stylesheet(filename):
     base_path = getattr(sys, '_MEIPASS', Path(__file__).parent)
@@ -361,6 +118,29 @@ class HL7SendDialog(QDialog):
         self.port_input.setPlaceholderText("7777")
         form_layout.addRow("Port:", self.port_input)
 
+        # Mehrfach senden / Datei abspielen
+        self.repeat_input = QSpinBox(self)
+        self.repeat_input.setRange(1, 1000000)
+        form_layout.addRow("Send N times:", self.repeat_input)
+
+        self.connections_input = QSpinBox(self)
+        self.connections_input.setRange(1, 64)
+        form_layout.addRow("Connections:", self.connections_input)
+
+        self.window_input = QSpinBox(self)
+        self.window_input.setRange(1, 1024)
+        self.window_input.setToolTip("Messages sent per connection before waiting for their ACKs")
+        form_layout.addRow("Window:", self.window_input)
+
+        replay_layout = QHBoxLayout()
+        self.replay_input = QLineEdit(self)
+        self.replay_input.setPlaceholderText("Replay all messages of a file instead")
+        replay_button = QPushButton("...", self)
+        replay_button.clicked.connect(self.choose_replay_file)
+        replay_layout.addWidget(self.replay_input)
+        replay_layout.addWidget(replay_button)
+        form_layout.addRow("Replay file:", replay_layout)
+
         self.layout.addLayout(form_layout)
 
         # OK / Abbrechen-Buttons
@@ -379,35 +159,309 @@ class HL7SendDialog(QDialog):
             QMessageBox.critical(self, "Error", f"Unkown Syntax: {e}")
             return None, None, None
 
+    def get_send_options(self):
+        return (self.repeat_input.value(), self.connections_input.value(), self.window_input.value(),
+                self.replay_input.text().strip())
+
+    def choose_replay_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Replay file", "", "HL7 files (*.hl7 *.txt *.dat *.mllp);;All files (*)")
+        if path:
+            self.replay_input.setText(path)
+
+
+class SendSignals(QObject):
+    finished = Signal(object)
+
+
+# Parst Segmentzeilen und liefert reine Python-Daten, damit der Aufruf außerhalb
+# des GUI-Threads laufen kann. Bereits gecachte Zeilen werden übersprungen.
+def parse_segments(raw, cached_context, cached_keys, is_cancelled=lambda: False, scope=None):
+    with hl7_trace.span("parse.tokenize", scope):
+        delimiters = read_delimiters(raw)
+        segments = tokenize_hl7(raw, delimiters)
+        # Trennzeichen und Version (MSH-12) bestimmen Darstellung und Feldnamen
+        version = message_version(raw, segments)
+    context = (delimiters, version)
+    if context != cached_context:
+        cached_keys = frozenset()
+
+    keys = []
+    rendered = {}
+    occurrences = {}
+
+    with hl7_trace.span("parse.render", scope):
+        for segment in segments:
+            if is_cancelled():
+                return None
+
+            line = raw[segment.start:segment.end]
+            occurrence = occurrences.get(line, 0)
+            occurrences[line] = occurrence + 1
+            key = (line, occurrence)
+            keys.append(key)
+
+            if key not in cached_keys:
+                rendered[key] = render_segment(raw, segment, delimiters, version)
+
+    hl7_trace.counter("parse.segments_rendered", len(rendered))
+
+    # Suchindex-Einträge (Feldpfad, Wert, Position) für die Suche über alle Tabs
+    with hl7_trace.span("parse.index", scope):
+        entries = index_entries(raw, segments, delimiters)
+
+    return {"context": context, "keys": keys, "segments": rendered, "index": entries}
+
+
+MSH2_LABELS = ("Component Separator", "Repetition Separator", "Escape Character",
+               "Subcomponent Separator", "Truncation Character")
+
+
+# Escape-Sequenzen werden nur dekodiert, wenn der Wert überhaupt ein Escape-Zeichen enthält
+def display_value(value, delimiters):
+    return unescape(value, delimiters) if delimiters.escape in value else value
+
+
+# Legenden-Zeilen der Komponenten einer Wiederholung, mit Subkomponenten als Kindern
+def component_rows(raw, seg_name, seg_def, index, repetition, delimiters):
+    rows = []
+    subs = repetition.subcomponents or {}
+    for j, (start, end) in enumerate(repetition.components, 1):
+        label = seg_def.component_label(index, j)
+        if j - 1 in subs:
+            children = [(f"      {seg_name}‑{index}.{j}.{k}", display_value(raw[sub_start:sub_end], delimiters))
+                        for k, (sub_start, sub_end) in enumerate(subs[j - 1], 1)]
+            rows.append((label, "", children))
+        else:
+            rows.append((label, display_value(raw[start:end], delimiters)))
+    return rows
+
+
+# Text-Abschnitte (Text, Tooltip) und Legenden-Zeilen (Beschreibung, Wert, Kinder) für ein Segment.
+# Abschnitte ohne Tooltip (Segmentname, Trenner) werden zusammengefasst. Die Legende
+# folgt der Struktur Feld > Wiederholung > Komponente > Subkomponente, Ebenen mit nur
+# einem Element werden übersprungen.
+def render_segment(raw, segment, delimiters, version=None):
+    seg_name = segment_name(raw, segment)
+    seg_def = get_segment_definition(seg_name, version)
+    runs = []
+    plain = [seg_name]
+    rows = []
+
+    for i, field in enumerate(segment.fields, 1):
+        raw_val = raw[field.start:field.end]
+        desc = seg_def.field(i).label
+        # MSH-1 ist selbst der Feldtrenner, MSH-2 folgt ohne Trenner
+        if not (seg_name == "MSH" and i <= 2):
+            plain.append(delimiters.field)
+        if raw_val:
+            runs.append(("".join(plain), ""))
+            plain = []
+            runs.append((raw_val, desc))
+
+        if seg_name == "MSH" and i <= 2:
+            # Die Trennzeichen selbst, aus MSH-2 gelesen statt fest angenommen
+            if i == 2 and 4 <= len(raw_val) <= len(MSH2_LABELS):
+                children = [(f"MSH‑2.{j} – {MSH2_LABELS[j - 1]}", char) for j, char in enumerate(raw_val, 1)]
+                rows.append((desc, "", children))
+            else:
+                rows.append((desc, raw_val, None))
+            continue
+
+        repetitions = field.repetitions
+        if len(repetitions) > 1:
+            children = []
+            for r, repetition in enumerate(repetitions, 1):
+                label = f"  {seg_name}‑{i}[{r}]"
+                if len(repetition.components) > 1 or repetition.subcomponents:
+                    children.append((label, "", component_rows(raw, seg_name, seg_def, i, repetition, delimiters)))
+                else:
+                    children.append((label, display_value(raw[repetition.start:repetition.end], delimiters)))
+            rows.append((desc, "", children))
+        elif len(repetitions[0].components) > 1 or repetitions[0].subcomponents:
+            rows.append((desc, "", component_rows(raw, seg_name, seg_def, i, repetitions[0], delimiters)))
+        else:
+            rows.append((desc, display_value(raw_val, delimiters), None))
+
+    if plain:
+        runs.append(("".join(plain), ""))
+    return tuple(run for run in runs if run[0]), seg_name, rows
+
+
+# Schreibt Segmente per QTextCursor direkt in ein QTextDocument, ohne HTML.
+# Formate werden pro (Farbe, Tooltip) nur einmal erzeugt und wiederverwendet.
+class SegmentDocumentWriter:
+    def __init__(self):
+        self._formats = {}
+
+    def char_format(self, color, tooltip):
+        key = (color, tooltip)
+        char_format = self._formats.get(key)
+        if char_format is None:
+            char_format = QTextCharFormat()
+            char_format.setForeground(QColor(color))
+            if tooltip:
+                char_format.setToolTip(tooltip)
+            self._formats[key] = char_format
+        return char_format
+
+    def write(self, document, segments):
+        document.clear()
+        cursor = QTextCursor(document)
+        cursor.beginEditBlock()
+        char_format = self.char_format
+        for line, (seg_name, runs) in enumerate(segments):
+            if line:
+                cursor.insertBlock()
+            color = SEGMENT_COLORS.get(seg_name, DEFAULT_SEGMENT_COLOR)
+            for text, tooltip in runs:
+                cursor.insertText(text, char_format(color, tooltip))
+        cursor.endEditBlock()
+
+
+@lru_cache(maxsize=16)
+def _delimiter_run_pattern(delimiters):
+    return re.compile("[%s]+" % re.escape("".join(sorted(set(delimiters)))))
+
+
+# Färbt das Eingabefeld: Segmentname und Felder in der Segmentfarbe, Trennzeichen
+# gedämpft. Ein Block ist eine Zeile; Qt ruft highlightBlock nur für geänderte Blöcke
+# auf, ein Tastendruck kostet also eine Zeile und nicht die ganze Nachricht.
+# Der Blockzustand ist der Index der Trennzeichen aus dem letzten MSH davor, so
+# werden die folgenden Zeilen nur neu gefärbt, wenn sich die Trennzeichen ändern.
+class HL7Highlighter(QSyntaxHighlighter):
+    def __init__(self, document):
+        super().__init__(document)
+        self._delimiters = [DEFAULT_DELIMITERS]
+        self._delimiter_index = {DEFAULT_DELIMITERS: 0}
+        self._formats = {}
+        self._delimiter_format = QTextCharFormat()
+        self._delimiter_format.setForeground(QColor(DELIMITER_COLOR))
+
+    def _segment_formats(self, seg_name):
+        formats = self._formats.get(seg_name)
+        if formats is None:
+            field_format = QTextCharFormat()
+            field_format.setForeground(QColor(SEGMENT_COLORS.get(seg_name, DEFAULT_SEGMENT_COLOR)))
+            name_format = QTextCharFormat(field_format)
+            name_format.setFontWeight(QFont.Bold)
+            formats = self._formats[seg_name] = (field_format, name_format)
+        return formats
+
+    def highlightBlock(self, text):
+        state = max(self.previousBlockState(), 0)
+        stripped = text.lstrip()
+        if stripped.startswith("MSH"):
+            try:
+                delimiters = read_delimiters(stripped)
+            except ValueError:
+                delimiters = DEFAULT_DELIMITERS
+            state = self._delimiter_index.get(delimiters)
+            if state is None:
+                state = self._delimiter_index[delimiters] = len(self._delimiters)
+                self._delimiters.append(delimiters)
+        self.setCurrentBlockState(state)
+        if not stripped:
+            return
+
+        delimiters = self._delimiters[state]
+        start = len(text) - len(stripped)
+        name_end = text.find(delimiters.field, start)
+        if name_end < 0:
+            name_end = len(text)
+        field_format, name_format = self._segment_formats(text[start:name_end].strip())
+        self.setFormat(start, name_end - start, name_format)
+        self.setFormat(name_end, len(text) - name_end, field_format)
+        delimiter_format = self._delimiter_format
+        set_format = self.setFormat
+        for match in _delimiter_run_pattern(delimiters).finditer(text, name_end):
+            set_format(match.start(), match.end() - match.start(), delimiter_format)
+
+
+class ParseSignals(QObject):
+    finished = Signal(int, object)
+
+
+# Hintergrund-Auftrag für HL7Tab.update_view
+class ParseWorker(QRunnable):
+    def __init__(self, generation, raw, cached_context, cached_keys, scope=None):
+        super().__init__()
+        self.generation = generation
+        self.scope = scope
+        self.raw = raw
+        self.cached_context = cached_context
+        self.cached_keys = cached_keys
+        self.signals = ParseSignals()
+        self._cancelled = False
+        # Lebensdauer verwaltet HL7Tab, nicht der Thread-Pool
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            with hl7_trace.span("parse.total", self.scope):
+                result = parse_segments(self.raw, self.cached_context, self.cached_keys,
+                                        lambda: self._cancelled, self.scope)
+        except ValueError as e:
+            result = {"error": f"Parsing-Fehler:\n{e}"}
+        except Exception as e:
+            result = {"error": f"Unerwarteter Fehler: {repr(e)}"}
+
+        if self._cancelled:
+            result = None
+        try:
+            self.signals.finished.emit(self.generation, result)
+        except RuntimeError:
+            # Tab wurde inzwischen geschlossen
+            pass
+
 
 # 2 Panele links, eine Legende Rechts
 class HL7Tab(QWidget):
-    def __init__(self):
+    # Nach jedem Parsen, search_entries ist dann aktuell
+    parsed = Signal()
+    # Gilt für neue Tabs, umgeschaltet über HL7Viewer.toggle_output_panel
+    output_visible = OUTPUT_PANEL
+
+    def __init__(self, text=EXAMPLE_HL7):
         super().__init__()
         self.layout = QVBoxLayout(self)
         self.splitter = QSplitter(Qt.Horizontal)
 
-        # Input Feld für HL7 Nachrichten
+        # Input Feld für HL7 Nachrichten. Der Highlighter muss vor dem Text da sein:
+        # nachträglich färbt er das schon ausgelegte Dokument Zeile für Zeile neu,
+        # und QTextEdit legt dabei jedes Mal alles neu aus (quadratisch).
         self.text_edit = QTextEdit()
+        self.highlighter = HL7Highlighter(self.text_edit.document())
         self.text_edit.setPlaceholderText("Input Message here")
-        self.text_edit.setPlainText(EXAMPLE_HL7)
+        self.text_edit.setPlainText(text)
         self.text_edit.setLineWrapMode(QTextEdit.NoWrap)
-        self.text_edit.textChanged.connect(self.update_view)
         self.text_edit.setObjectName("hl7Input")
 
+        # Debounce: erst nach einer kurzen Tipp-Pause neu parsen
+        self._update_timer = QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(UPDATE_DELAY_MS)
+        self._update_timer.timeout.connect(self.update_view)
+        self.text_edit.textChanged.connect(self._update_timer.start)
+
         # Browser für formattierte Anzeige
         self.hl7_view = QTextBrowser()
         self.hl7_view.setReadOnly(True)
         self.hl7_view.setLineWrapMode(QTextEdit.NoWrap)
         self.hl7_view.setObjectName("hl7Output")
+        self.hl7_view.setVisible(self.output_visible)
 
         self.left_panel = QSplitter(Qt.Vertical)
         self.left_panel.addWidget(self.text_edit)
         self.left_panel.addWidget(self.hl7_view)
 
         # Legende für Segmente
-        self.legend = QTreeWidget()
-        self.legend.setHeaderLabels(["Seg.", "Feld", "Wert"])
+        self.legend = QTreeView()
+        self.legend_model = LegendModel(self)
+        self.legend.setModel(self.legend_model)
+        self.legend.setUniformRowHeights(True)
         self.legend.setColumnWidth(0, 75)
         self.legend.setColumnWidth(1, 300)
         self.legend.setColumnWidth(2, 120)
@@ -420,115 +474,1168 @@ class HL7Tab(QWidget):
 
         # Nachricht senden
         self.layout.addWidget(self.splitter)
+        self._send_signals = SendSignals(self)
+        self._send_signals.finished.connect(self._on_send_finished)
+        self._validation_signals = ValidationSignals(self)
+        self._validation_signals.finished.connect(self._on_validation_finished)
+        self._send_target = None
+
+        button_layout = QHBoxLayout()
+        self.validate_button = QPushButton("Validate Message")
+        self.validate_button.clicked.connect(self.validate_message)
+        button_layout.addWidget(self.validate_button)
         self.send_button = QPushButton("Send Test Message")
         self.send_button.clicked.connect(self.send_test_message)
-        self.layout.addWidget(self.send_button)
+        button_layout.addWidget(self.send_button)
+        self.layout.addLayout(button_layout)
+
+        # Cache pro Segmentzeile: (Zeile, Vorkommen) -> ((Segmentname, Text-Abschnitte), Legenden-Item)
+        self._segment_cache = {}
+        self._cache_context = None
+        self._document_writer = SegmentDocumentWriter()
+        # Zeilen des letzten Ergebnisses, falls die Ausgabe erst später eingeblendet wird
+        self._view_lines = []
+        self.search_entries = []
+
+        # Parsen läuft in einem eigenen Thread, nur das neueste Ergebnis wird angezeigt
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._worker = None
+        self._running_workers = {}
+        self._generation = 0
 
         self.update_view()
 
+    # hl7apy läuft nur im Validierungs-Prozess (hl7_validation.submit_validation),
+    # die GUI wartet nicht darauf und lädt es selbst nie
+    def validate_message(self):
+        raw = self.text_edit.toPlainText().strip()
+        if not raw:
+            return
+
+        import importlib.util
+        if importlib.util.find_spec("hl7apy") is None:
+            QMessageBox.warning(self, "Validation", "hl7apy is not installed, validation is not available.")
+            return
+        from hl7_validation import submit_validation
+        self.validate_button.setEnabled(False)
+        self.validate_button.setText("Validating...")
+        # spawn statt fork: der GUI-Prozess hat bereits Qt-Threads
+        future = submit_validation(raw, start_method="spawn")
+        future.add_done_callback(self._emit_validation_finished)
+
+    def _emit_validation_finished(self, future):
+        try:
+            self._validation_signals.finished.emit(future)
+        except RuntimeError:
+            # Tab wurde inzwischen geschlossen
+            pass
+
+    def _on_validation_finished(self, future):
+        self.validate_button.setEnabled(True)
+        self.validate_button.setText("Validate Message")
+        try:
+            problems = future.result()
+        except ImportError:
+            QMessageBox.warning(self, "Validation", "hl7apy is not installed, validation is not available.")
+            return
+        except Exception as e:
+            QMessageBox.critical(self, "Validation", f"Validation failed:\n{e!r}")
+            return
+
+        # Alle Fehler und Warnungen, nicht nur der erste
+        errors = [problem.text for problem in problems if problem.severity == "error"]
+        warnings = [problem.text for problem in problems if problem.severity == "warning"]
+        if errors:
+            details = "\n".join(errors + [f"Warning: {text}" for text in warnings])
+            QMessageBox.critical(self, "Validation", f"Message is not valid:\n{details}")
+        elif warnings:
+            QMessageBox.warning(self, "Validation", "Message is valid with warnings:\n" + "\n".join(warnings))
+        else:
+            QMessageBox.information(self, "Validation", "Message is valid.")
+
     def send_test_message(self):
         dialog = HL7SendDialog(self)
         if dialog.exec_() == QDialog.Rejected:
             return
 
         hl7_message, host, port = dialog.get_values()
-        if not hl7_message or not host or not port:
+        repeat, connections, window, replay_path = dialog.get_send_options()
+        if not (hl7_message or replay_path) or not host or not port:
             QMessageBox.warning(self, "Error", "Wrong Syntax.")
             return
 
+        # Gesendet wird im Hintergrund-Loop über gepoolte Verbindungen, die GUI blockiert nicht.
+        # hl7_mllp (und damit asyncio) wird erst beim ersten Senden geladen.
+        from hl7_mllp import background_loop, background_pool, send_bulk, replay_file
+        pool = background_pool()
+        if replay_path:
+            coroutine = replay_file(pool, host, port, replay_path, connections, window, repeat)
+        elif repeat > 1:
+            coroutine = send_bulk(pool, host, port, [hl7_message] * repeat, connections, window)
+        else:
+            coroutine = pool.send(host, port, hl7_message)
+
+        self.send_button.setEnabled(False)
+        self.send_button.setText(f"Sending to {host}:{port}...")
+        self._send_target = (host, port)
+        future = background_loop().submit(coroutine)
+        future.add_done_callback(self._emit_send_finished)
+
+    def _emit_send_finished(self, future):
         try:
-            ack = self.send_hl7_message_tcp(hl7_message, host, port)
-            QMessageBox.information(self, "Sucess", f"Message was sent to {host}:{port} .\n\nAnswer:\n{ack}")
-        except Exception as e:
-            QMessageBox.critical(self, "Send-Error", f"Message couldn't be sent:\n{e}")
+            self._send_signals.finished.emit(future)
+        except RuntimeError:
+            # Tab wurde inzwischen geschlossen
+            pass
 
-    def send_hl7_message_tcp(self, hl7_message: str, host: str, port: int) -> str:
-        hl7_message = hl7_message.replace("\n", "\r")
-        mllp_message = f"\x0b{hl7_message}\x1c\x0d".encode("utf-8")
+    def _on_send_finished(self, future):
+        self.send_button.setEnabled(True)
+        self.send_button.setText("Send Test Message")
+        host, port = self._send_target
 
-        with socket.create_connection((host, port), timeout=10) as sock:
-            sock.sendall(mllp_message)
-            ack = sock.recv(4096).decode("utf-8", errors="ignore")
-            print("Message from Server:")
-            print(ack)
-            return ack
+        try:
+            result = future.result()
+        except Exception as e:
+            QMessageBox.critical(self, "Send-Error", f"Message couldn't be sent:\n{e!r}")
+            return
+
+        from hl7_mllp import SendReport
+        if isinstance(result, SendReport):
+            QMessageBox.information(self, "Sucess", f"Messages were sent to {host}:{port} .\n\n{result.summary()}")
+        else:
+            QMessageBox.information(self, "Sucess", f"Message was sent to {host}:{port} .\n\nAnswer:\n{result}")
 
     def update_view(self):
         raw = self.text_edit.toPlainText()
-        self.hl7_view.clear()
-        self.legend.clear()
+        self._generation += 1
+
+        # Noch laufende oder wartende Aufträge sind veraltet
+        if self._worker is not None:
+            self._worker.cancel()
 
         if not raw.strip():
+            self._worker = None
+            self._segment_cache = {}
+            self._view_lines = []
+            self.hl7_view.clear()
+            self.legend_model.set_segments([])
+            self.search_entries = []
+            self.parsed.emit()
+            return
+
+        worker = ParseWorker(self._generation, raw, self._cache_context, frozenset(self._segment_cache), id(self))
+        worker.signals.finished.connect(self._on_worker_finished)
+        self._worker = worker
+        self._running_workers[self._generation] = worker
+        self._pool.start(worker)
+
+    def _on_worker_finished(self, generation, result):
+        self._running_workers.pop(generation, None)
+        if result is None or generation != self._generation:
             return
+        self._worker = None
+        with hl7_trace.span("view.apply", id(self)):
+            self._apply_parse_result(result)
+        self.search_entries = result.get("index", [])
+        self.parsed.emit()
+
+    def _apply_parse_result(self, result):
+        self.hl7_view.clear()
+        self._view_lines = []
+
+        if "error" in result:
+            self.legend_model.set_segments([])
+            self.hl7_view.setPlainText(result["error"])
+            return
+
+        if result["context"] != self._cache_context:
+            # Geänderte Trennzeichen oder Version betreffen alle Segmente
+            self._segment_cache = {}
+            self._cache_context = result["context"]
+
+        scope = id(self)
+        lines = []
+        seg_nodes = []
+        new_cache = {}
+        rendered = result["segments"]
+
+        with hl7_trace.span("view.cache", scope):
+            for key in result["keys"]:
+                cached = self._segment_cache.get(key)
+                if cached is None:
+                    runs, seg_name, rows = rendered[key]
+                    cached = ((seg_name, runs), segment_node(seg_name, rows))
+                new_cache[key] = cached
+                lines.append(cached[0])
+                seg_nodes.append(cached[1])
+
+        self._segment_cache = new_cache
+        self._view_lines = lines
+        with hl7_trace.span("view.legend", scope):
+            self.legend_model.set_segments(seg_nodes)
+        if self.hl7_view.isVisibleTo(self):
+            with hl7_trace.span("view.document", scope):
+                self._document_writer.write(self.hl7_view.document(), lines)
+        with hl7_trace.span("view.expand", scope):
+            self._expand_legend()
+
+    # Die ausgeblendete Ausgabe wird nicht aktualisiert, beim Einblenden aber nachgezogen
+    def set_output_visible(self, visible):
+        if visible == self.hl7_view.isVisibleTo(self):
+            return
+        self.hl7_view.setVisible(visible)
+        if not visible:
+            if self._view_lines:
+                self.hl7_view.clear()
+        elif self._view_lines:
+            with hl7_trace.span("view.document", id(self)):
+                self._document_writer.write(self.hl7_view.document(), self._view_lines)
+
+    # Markiert einen Suchtreffer im Eingabefeld
+    def highlight_range(self, start, end):
+        cursor = self.text_edit.textCursor()
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
+        self.text_edit.setTextCursor(cursor)
+        self.text_edit.ensureCursorVisible()
+
+        selection = QTextEdit.ExtraSelection()
+        selection.cursor = cursor
+        selection.format.setBackground(QColor(SEARCH_HIGHLIGHT_COLOR))
+        self.text_edit.setExtraSelections([selection])
+        self.text_edit.setFocus()
+
+    # Aufklappen erzeugt alle Knoten, bei großen Nachrichten daher nur die Segmentebene
+    def _expand_legend(self):
+        if self.legend_model.row_estimate() <= LEGEND_EXPAND_ALL_ROWS:
+            self.legend.expandAll()
+        else:
+            self.legend.expandToDepth(0)
+
 
-        raw = raw.replace('\n', '\r')
+class BatchScanSignals(QObject):
+    progress = Signal(int)
+    finished = Signal(object)
 
+
+# Sucht im Hintergrund die Nachrichtengrenzen einer Batch-Datei
+class BatchScanWorker(QRunnable):
+    def __init__(self, batch):
+        super().__init__()
+        self.batch = batch
+        self.signals = BatchScanSignals()
+        self._cancelled = False
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            index = self.batch.scan(self.signals.progress.emit, lambda: self._cancelled)
+            self.signals.finished.emit(index)
+        except RuntimeError:
+            # Ansicht wurde inzwischen geschlossen
+            pass
+
+
+class ValidationSignals(QObject):
+    progress = Signal(int)
+    finished = Signal(object)
+
+
+# Validiert alle Nachrichten einer Batch-Datei mit hl7apy über einen Prozess-Pool.
+# Läuft im globalen Thread-Pool, damit das Schließen der Ansicht nicht darauf warten muss.
+class ValidationWorker(QRunnable):
+    def __init__(self, batch):
+        super().__init__()
+        self.batch = batch
+        self.signals = ValidationSignals()
+        self._cancelled = False
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        from hl7_validation import validate_messages
+        messages = (self.batch.message_text(i) for i in range(len(self.batch)))
         try:
-            message = parse_message(raw, validation_level=VALIDATION_LEVEL.QUIET)
-        except HL7apyException as e:
-            import traceback
-            self.hl7_view.setPlainText(f"Parsing-Fehler:\n{repr(e)}\n\n{traceback.format_exc()}")
+            first = self.batch.message_text(0) if len(self.batch) else ""
+            segments = tokenize_hl7(first, read_delimiters(first)) if first else []
+            version = message_version(first, segments)
+        except ValueError:
+            version = None
+        try:
+            # spawn statt fork: der GUI-Prozess hat bereits Qt-Threads
+            report = validate_messages(messages, versions=[version] if version else [],
+                                       progress=self.signals.progress.emit,
+                                       is_cancelled=lambda: self._cancelled, start_method="spawn")
+        except RuntimeError:
+            # Ansicht wurde inzwischen geschlossen
             return
         except Exception as e:
-            self.hl7_view.setPlainText(f"Unerwarteter Fehler: {repr(e)}")
+            if self._cancelled:
+                # Batch-Datei wurde beim Schließen der Ansicht schon freigegeben
+                return
+            report = e
+        try:
+            self.signals.finished.emit(None if self._cancelled else report)
+        except RuntimeError:
+            pass
+
+
+# Batch-/MLLP-Datei: Nachrichtenliste seitenweise links, ausgewählte Nachricht rechts
+class HL7BatchView(QWidget):
+    def __init__(self, path):
+        super().__init__()
+        self.batch = BatchFile(path)
+        self.page = 0
+
+        self.layout = QVBoxLayout(self)
+        self.status_label = QLabel(f"{Path(path).name}: scanning...")
+        self.layout.addWidget(self.status_label)
+
+        self.splitter = QSplitter(Qt.Horizontal)
+
+        list_panel = QWidget()
+        list_layout = QVBoxLayout(list_panel)
+        list_layout.setContentsMargins(0, 0, 0, 0)
+        self.message_list = QListWidget()
+        self.message_list.currentItemChanged.connect(self.show_message)
+
+        # Ergebnis der Validierung, nach Fehlerart gruppiert
+        self.report_tree = QTreeWidget()
+        self.report_tree.setHeaderLabels(["Count", "Problem"])
+        self.report_tree.setColumnWidth(0, 70)
+        self.report_tree.itemActivated.connect(self.show_report_item)
+        self.report_tree.itemClicked.connect(self.show_report_item)
+        self.report_tree.hide()
+        list_splitter = QSplitter(Qt.Vertical)
+        list_splitter.addWidget(self.message_list)
+        list_splitter.addWidget(self.report_tree)
+        list_layout.addWidget(list_splitter)
+
+        page_layout = QHBoxLayout()
+        self.prev_button = QPushButton("<")
+        self.prev_button.clicked.connect(lambda: self.show_page(self.page - 1))
+        self.next_button = QPushButton(">")
+        self.next_button.clicked.connect(lambda: self.show_page(self.page + 1))
+        self.page_label = QLabel()
+        page_layout.addWidget(self.prev_button)
+        page_layout.addWidget(self.page_label, 1, Qt.AlignCenter)
+        page_layout.addWidget(self.next_button)
+        list_layout.addLayout(page_layout)
+
+        self.validate_button = QPushButton("Validate all")
+        self.validate_button.setEnabled(False)
+        self.validate_button.clicked.connect(self.toggle_validation)
+        list_layout.addWidget(self.validate_button)
+        self._validation = None
+
+        self.viewer = HL7Tab("")
+
+        self.splitter.addWidget(list_panel)
+        self.splitter.addWidget(self.viewer)
+        self.splitter.setStretchFactor(0, 1)
+        self.splitter.setStretchFactor(1, 4)
+        self.splitter.setSizes([300, 1200])
+        self.layout.addWidget(self.splitter)
+
+        self._update_page_controls()
+
+        self._pool = QThreadPool(self)
+        self._worker = BatchScanWorker(self.batch)
+        self._worker.signals.progress.connect(self._on_scan_progress)
+        self._worker.signals.finished.connect(self._on_scan_finished)
+        self._pool.start(self._worker)
+
+    def page_count(self):
+        return max(1, (len(self.batch) + BATCH_PAGE_SIZE - 1) // BATCH_PAGE_SIZE)
+
+    def _on_scan_progress(self, count):
+        self.status_label.setText(f"{Path(self.batch.path).name}: scanning... {count} messages")
+
+    def _on_scan_finished(self, index):
+        if index is None:
+            return
+        self.batch.set_index(index)
+        self.status_label.setText(f"{Path(self.batch.path).name}: {len(self.batch)} messages, "
+                                  f"{self.batch.size() / 1024 / 1024:.1f} MB")
+        self.validate_button.setEnabled(len(self.batch) > 0)
+        self.show_page(0)
+
+    def toggle_validation(self):
+        if self._validation is not None:
+            self._validation.cancel()
+            self.validate_button.setEnabled(False)
+            self.validate_button.setText("Stopping...")
+            return
+        self._validation = ValidationWorker(self.batch)
+        self._validation.signals.progress.connect(self._on_validation_progress)
+        self._validation.signals.finished.connect(self._on_validation_finished)
+        self.validate_button.setText("Stop validation")
+        self._on_validation_progress(0)
+        QThreadPool.globalInstance().start(self._validation)
+
+    def _on_validation_progress(self, count):
+        self.status_label.setText(f"{Path(self.batch.path).name}: validating... {count} / {len(self.batch)} messages")
+
+    def _on_validation_finished(self, report):
+        self._validation = None
+        self.validate_button.setEnabled(True)
+        self.validate_button.setText("Validate all")
+        name = Path(self.batch.path).name
+        if report is None:
+            self.status_label.setText(f"{name}: validation stopped")
+            return
+        if isinstance(report, Exception):
+            self.status_label.setText(f"{name}: validation failed")
+            QMessageBox.critical(self, "Validation", f"Validation failed:\n{report!r}")
             return
 
-        html_lines = []
+        self.status_label.setText(f"{name}: {report.messages} messages validated, "
+                                  f"{report.messages - report.invalid} valid, {report.invalid} invalid")
+        self.report_tree.clear()
+        for severity, kind, count, examples in report.rows():
+            item = QTreeWidgetItem([str(count), f"{severity}: {kind}"])
+            item.setToolTip(1, kind)
+            for message_id in examples:
+                child = QTreeWidgetItem(["", f"Message {message_id}"])
+                child.setData(0, Qt.UserRole, message_id)
+                item.addChild(child)
+            self.report_tree.addTopLevelItem(item)
+        self.report_tree.show()
+
+    # Springt zur Beispiel-Nachricht einer Fehlerart
+    def show_report_item(self, item, column=0):
+        message_id = item.data(0, Qt.UserRole)
+        if message_id is None:
+            return
+        index = message_id - 1
+        if index // BATCH_PAGE_SIZE != self.page:
+            self.show_page(index // BATCH_PAGE_SIZE)
+        self.message_list.setCurrentRow(index % BATCH_PAGE_SIZE)
+
+    def show_page(self, page):
+        page = max(0, min(page, self.page_count() - 1))
+        self.page = page
+        self.message_list.clear()
+
+        first = page * BATCH_PAGE_SIZE
+        last = min(first + BATCH_PAGE_SIZE, len(self.batch))
+        for i in range(first, last):
+            item = QListWidgetItem(f"{i + 1:>7}  {self.batch.summary(i)}")
+            item.setData(Qt.UserRole, i)
+            self.message_list.addItem(item)
+
+        self._update_page_controls()
+        if last > first:
+            self.message_list.setCurrentRow(0)
+
+    def _update_page_controls(self):
+        self.page_label.setText(f"Page {self.page + 1} / {self.page_count()}")
+        self.prev_button.setEnabled(self.page > 0)
+        self.next_button.setEnabled(self.page < self.page_count() - 1)
+
+    # Nur die ausgewählte Nachricht wird gelesen und geparst
+    def show_message(self, item, previous=None):
+        if item is None:
+            return
+        message = self.batch.message_text(item.data(Qt.UserRole))
+        self.viewer.text_edit.setPlainText(message.replace("\r\n", "\n").replace("\r", "\n"))
+
+    def release(self):
+        self._worker.cancel()
+        if self._validation is not None:
+            self._validation.cancel()
+        self._pool.waitForDone()
+        self.batch.close()
+
+
+# Auswahl der beiden Tabs für den Vergleich
+class CompareDialog(QDialog):
+    def __init__(self, names, left=0, right=1, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Compare tabs")
+        layout = QFormLayout(self)
+        self.left_input = QComboBox()
+        self.left_input.addItems(names)
+        self.left_input.setCurrentIndex(left)
+        self.right_input = QComboBox()
+        self.right_input.addItems(names)
+        self.right_input.setCurrentIndex(right)
+        layout.addRow("Left:", self.left_input)
+        layout.addRow("Right:", self.right_input)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+
+    def get_values(self):
+        return self.left_input.currentIndex(), self.right_input.currentIndex()
 
-        for segment in message.children:
-            seg_name = segment.name
-            raw_segment = segment.to_er7()
-            color = SEGMENT_COLORS.get(seg_name, "#f8f8f2")
-            fields_html = []
 
-            seg_item = QTreeWidgetItem([seg_name])
-            self.legend.addTopLevelItem(seg_item)
+# Zwei Nachrichten nebeneinander, Unterschiede farbig markiert und als Liste darunter
+class HL7DiffView(QWidget):
+    def __init__(self, left_name, left_text, right_name, right_text):
+        super().__init__()
+        from hl7_diff import diff_messages, summarize
+        # Gleich lange Ersetzung, die Positionen des Vergleichs bleiben gültig
+        left_text = left_text.replace("\r", "\n")
+        right_text = right_text.replace("\r", "\n")
+        with hl7_trace.span("diff.compute"):
+            self.differences = diff_messages(left_text, right_text)
 
-            if seg_name == "MSH":
-                field_separator = raw_segment[3]
-                encoding_chars_end = raw_segment.find(field_separator, 4)
-                encoding_chars = raw_segment[4:encoding_chars_end]
-                remaining_fields = raw_segment[encoding_chars_end + 1:].split(field_separator)
-                raw_fields = [field_separator, encoding_chars] + remaining_fields
+        self.layout = QVBoxLayout(self)
+        counts = summarize(self.differences)
+        summary = ", ".join(f"{counts[kind]} {kind}" for kind in ("changed", "added", "removed") if kind in counts)
+        self.status_label = QLabel(f"{left_name}  ↔  {right_name}:  {summary or 'no differences'}")
+        self.layout.addWidget(self.status_label)
+
+        self.left_edit = self._text_view(left_text)
+        self.right_edit = self._text_view(right_text)
+        text_splitter = QSplitter(Qt.Horizontal)
+        text_splitter.addWidget(self.left_edit)
+        text_splitter.addWidget(self.right_edit)
+
+        self.difference_list = QListWidget()
+        self.difference_list.currentRowChanged.connect(self.show_difference)
+        for difference in self.differences:
+            old = self._value(left_text, difference.left)
+            new = self._value(right_text, difference.right)
+            self.difference_list.addItem(f"{difference.kind:<8} {difference.path:<16} {old}  →  {new}")
+
+        self.splitter = QSplitter(Qt.Vertical)
+        self.splitter.addWidget(text_splitter)
+        self.splitter.addWidget(self.difference_list)
+        self.splitter.setStretchFactor(0, 3)
+        self.splitter.setStretchFactor(1, 1)
+        self.layout.addWidget(self.splitter)
+
+        self._left_selections = self._selections(self.left_edit, "left")
+        self._right_selections = self._selections(self.right_edit, "right")
+        self.left_edit.setExtraSelections(self._left_selections)
+        self.right_edit.setExtraSelections(self._right_selections)
+
+    @staticmethod
+    def _text_view(text):
+        view = QTextEdit()
+        view.setObjectName("hl7Input")
+        view.setReadOnly(True)
+        view.setLineWrapMode(QTextEdit.NoWrap)
+        view.setPlainText(text)
+        return view
+
+    @staticmethod
+    def _value(text, span):
+        if span is None:
+            return "-"
+        value = text[span[0]:span[1]]
+        return value if len(value) <= 60 else value[:57] + "..."
+
+    def _selections(self, view, side):
+        selections = []
+        for difference in self.differences[:DIFF_HIGHLIGHT_LIMIT]:
+            span = getattr(difference, side)
+            if span is None:
+                continue
+            selection = QTextEdit.ExtraSelection()
+            selection.cursor = QTextCursor(view.document())
+            selection.cursor.setPosition(span[0])
+            selection.cursor.setPosition(span[1], QTextCursor.KeepAnchor)
+            selection.format.setBackground(QColor(DIFF_COLORS[difference.kind]))
+            selections.append(selection)
+        return selections
+
+    # Wählt den Unterschied auf beiden Seiten aus und scrollt dorthin
+    def show_difference(self, row):
+        if row < 0:
+            return
+        difference = self.differences[row]
+        for view, span in ((self.left_edit, difference.left), (self.right_edit, difference.right)):
+            cursor = view.textCursor()
+            if span is None:
+                cursor.clearSelection()
             else:
-                raw_fields = raw_segment.split('|')[1:]
-
-            for i, raw_val in enumerate(raw_fields, 1):
-                field_key = f"{seg_name}_{i}"
-                desc = FRIENDLY_FIELD_NAMES.get(field_key, field_key)
-                val_html = raw_val.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-                fields_html.append(f'<a href="#" style="color:{color};" title="{desc}">{val_html}</a>')
-
-                if seg_name == "MSH" and i == 2 and len(raw_val) == 4:
-                    parent_item = QTreeWidgetItem(["", desc, ""])
-                    seg_item.addChild(parent_item)
-                    encoding_labels = ["Component Separator '^'", "Repetition Separator '~'", "Escape Character '\\'", "Subcomponent Separator '&'"]
-                    for j, char in enumerate(raw_val, 1):
-                        sub_desc = f"MSH‑2.{j} – {encoding_labels[j - 1]}"
-                        child_item = QTreeWidgetItem(["", sub_desc, char])
-                        child_item.setForeground(2, QColor("#888888"))
-                        parent_item.addChild(child_item)
-                else:
-                    subfields = raw_val.split('^')
-                    if len(subfields) > 1:
-                        parent_item = QTreeWidgetItem(["", desc, ""])
-                        seg_item.addChild(parent_item)
-                        for j, subval in enumerate(subfields, 1):
-                            sub_key = f"{field_key}.{j}"
-                            sub_desc = FRIENDLY_FIELD_NAMES.get(sub_key, sub_key)
-                            child_item = QTreeWidgetItem(["", sub_desc, subval])
-                            child_item.setForeground(2, QColor("#888888"))
-                            parent_item.addChild(child_item)
-                    else:
-                        item = QTreeWidgetItem(["", desc, raw_val])
-                        item.setForeground(2, QColor("#888888"))
-                        seg_item.addChild(item)
-
-            full_line_html = f'<span style="color:{color};">{seg_name}|{"|".join(fields_html)}</span>'
-            html_lines.append(full_line_html)
-
-        self.hl7_view.setHtml("<br>".join(html_lines))
-        self.legend.expandAll()
+                cursor.setPosition(span[0])
+                cursor.setPosition(span[1], QTextCursor.KeepAnchor)
+            view.setTextCursor(cursor)
+            view.ensureCursorVisible()
+
+
+class StoreIngestSignals(QObject):
+    progress = Signal(int)
+    finished = Signal(object)
+
+
+# Liest Dateien im Hintergrund in den Spaltenspeicher ein
+class StoreIngestWorker(QRunnable):
+    def __init__(self, store, paths):
+        super().__init__()
+        self.store = store
+        self.paths = paths
+        self.signals = StoreIngestSignals()
+        self._cancelled = False
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        error = None
+        try:
+            for path in self.paths:
+                if self._cancelled:
+                    break
+                self.store.ingest_file(path, progress=self.signals.progress.emit,
+                                       is_cancelled=lambda: self._cancelled)
+        except RuntimeError:
+            # Panel wurde inzwischen geschlossen
+            return
+        except (OSError, ValueError) as e:
+            error = e
+        try:
+            self.signals.finished.emit(error)
+        except RuntimeError:
+            pass
+
+
+# Abfragen über viele Nachrichten (Spaltenspeicher aus hl7_store), z.B. "top MSH.9 10"
+class HL7QueryPanel(QWidget):
+    def __init__(self, tab_texts, parent=None):
+        super().__init__(parent)
+        # Liefert die Texte der offenen Nachrichten-Tabs
+        self.tab_texts = tab_texts
+        self.store = None
+        self._worker = None
+        self._pool = QThreadPool(self)
+
+        self.layout = QVBoxLayout(self)
+        button_layout = QHBoxLayout()
+        self.add_files_button = QPushButton("Add files")
+        self.add_files_button.clicked.connect(self.add_files)
+        self.add_tabs_button = QPushButton("Add tabs")
+        self.add_tabs_button.clicked.connect(self.add_tabs)
+        self.open_button = QPushButton("Open store")
+        self.open_button.clicked.connect(self.open_store)
+        self.save_button = QPushButton("Save store")
+        self.save_button.clicked.connect(self.save_store)
+        self.clear_button = QPushButton("Clear")
+        self.clear_button.clicked.connect(self.clear_store)
+        for button in (self.add_files_button, self.add_tabs_button, self.open_button,
+                       self.save_button, self.clear_button):
+            button_layout.addWidget(button)
+        self.status_label = QLabel()
+        button_layout.addWidget(self.status_label, 1)
+        self.layout.addLayout(button_layout)
+
+        self.query_input = QLineEdit()
+        self.query_input.setPlaceholderText("top MSH.9.1 10 where PV1.2=I, count PID.3, nulls PID.8, messages where OBX.5~gluc")
+        self.query_input.setClearButtonEnabled(True)
+        self.query_input.returnPressed.connect(self.run_query)
+        self.layout.addWidget(self.query_input)
+
+        self.result_table = QTableWidget()
+        self.result_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.result_table.verticalHeader().hide()
+        self.layout.addWidget(self.result_table)
+        self._update_status()
+
+    def _ensure_store(self):
+        if self.store is None:
+            from hl7_store import MessageStore
+            self.store = MessageStore()
+        return self.store
+
+    def _update_status(self, text=None):
+        # Während des Einlesens wird "Add files" zum Abbrechen-Knopf
+        busy = self._worker is not None
+        for button in (self.add_tabs_button, self.open_button, self.save_button, self.clear_button):
+            button.setEnabled(not busy)
+        self.add_files_button.setText("Stop" if busy else "Add files")
+        self.query_input.setEnabled(not busy)
+        if text is None:
+            count = len(self.store) if self.store is not None else 0
+            text = f"{count} messages"
+        self.status_label.setText(text)
+
+    def add_files(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self.add_files_button.setEnabled(False)
+            return
+        paths, _ = QFileDialog.getOpenFileNames(self, "Add files", "", "HL7 files (*.hl7 *.txt *.dat *.mllp);;All files (*)")
+        if not paths:
+            return
+        self._worker = StoreIngestWorker(self._ensure_store(), paths)
+        self._worker.signals.progress.connect(lambda count: self._update_status(f"ingesting... {count} messages"))
+        self._worker.signals.finished.connect(self._on_ingest_finished)
+        self._update_status("ingesting...")
+        self._pool.start(self._worker)
+
+    def _on_ingest_finished(self, error):
+        self._worker = None
+        self.add_files_button.setEnabled(True)
+        self._update_status()
+        if error is not None:
+            QMessageBox.critical(self, "Query", f"File couldn't be read:\n{error}")
+
+    def add_tabs(self):
+        texts = [text for text in self.tab_texts() if text and text.strip()]
+        self._ensure_store().ingest(texts, source="tabs")
+        self._update_status()
+
+    def open_store(self):
+        from hl7_store import STORE_SUFFIX, MessageStore
+        path, _ = QFileDialog.getOpenFileName(self, "Open store", "", f"HL7 Lookup stores (*{STORE_SUFFIX});;All files (*)")
+        if not path:
+            return
+        try:
+            self.store = MessageStore.load(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Error", f"Store couldn't be opened:\n{e}")
+            return
+        self._update_status()
+
+    def save_store(self):
+        from hl7_store import STORE_SUFFIX
+        path, _ = QFileDialog.getSaveFileName(self, "Save store", f"messages{STORE_SUFFIX}",
+                                              f"HL7 Lookup stores (*{STORE_SUFFIX})")
+        if not path:
+            return
+        try:
+            self._ensure_store().save(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Store couldn't be saved:\n{e}")
+
+    def clear_store(self):
+        self.store = None
+        self.result_table.clear()
+        self.result_table.setRowCount(0)
+        self.result_table.setColumnCount(0)
+        self._update_status()
+
+    def run_query(self):
+        from hl7_store import QueryError
+        query = self.query_input.text().strip()
+        if not query:
+            return
+        try:
+            with hl7_trace.span("store.query"):
+                result = self._ensure_store().query(query)
+        except QueryError as e:
+            self._update_status(str(e))
+            return
+        self.result_table.clear()
+        self.result_table.setColumnCount(len(result.columns))
+        self.result_table.setHorizontalHeaderLabels(list(result.columns))
+        self.result_table.setRowCount(len(result.rows))
+        for r, row in enumerate(result.rows):
+            for c, value in enumerate(row):
+                self.result_table.setItem(r, c, QTableWidgetItem(str(value)))
+        self.result_table.resizeColumnsToContents()
+        self._update_status()
+
+    def release(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        self._pool.waitForDone()
+
+
+# Tab-Inhalt im Tab-Widget: hält nur Text und Suchindex-Einträge. Das eigentliche
+# HL7Tab wird erst beim Anzeigen gebaut (realize) und kann wieder freigegeben werden.
+class LazyHL7Tab(QWidget):
+    parsed = Signal()
+
+    # `text` kann auch eine Funktion sein, die den Text erst beim ersten Bedarf liefert
+    # (z.B. aus einer Sitzungsdatei); `search_entries` spart dann auch das Indexieren.
+    def __init__(self, text=EXAMPLE_HL7, search_entries=None):
+        super().__init__()
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.viewer = None
+        self._text = text
+        if search_entries is None:
+            search_entries = self._index_text(self.text())
+        self.search_entries = search_entries
+
+    @staticmethod
+    def _index_text(text):
+        try:
+            delimiters = read_delimiters(text)
+        except ValueError:
+            return []
+        return index_entries(text, tokenize_hl7(text, delimiters), delimiters)
+
+    def is_realized(self):
+        return self.viewer is not None
+
+    def text(self):
+        if self.viewer is not None:
+            return self.viewer.text_edit.toPlainText()
+        if callable(self._text):
+            self._text = self._text()
+        return self._text
+
+    def realize(self):
+        if self.viewer is not None:
+            return self.viewer
+        self.viewer = HL7Tab(self.text())
+        self.viewer.parsed.connect(self._on_viewer_parsed)
+        self.layout.addWidget(self.viewer)
+        return self.viewer
+
+    def _on_viewer_parsed(self):
+        self.search_entries = self.viewer.search_entries
+        self.parsed.emit()
+
+    # Solange gesendet oder validiert wird, bleibt der Tab bestehen, sonst ginge das Ergebnis verloren
+    def can_release(self):
+        return (self.viewer is not None and self.viewer.send_button.isEnabled()
+                and self.viewer.validate_button.isEnabled())
+
+    def release(self):
+        if self.viewer is None:
+            return
+        self._text = self.viewer.text_edit.toPlainText()
+        # deleteLater wirkt erst später, bis dahin darf ein laufendes Parsen nicht mehr melden
+        self.viewer.parsed.disconnect(self._on_viewer_parsed)
+        self.viewer._update_timer.stop()
+        if self.viewer._worker is not None:
+            self.viewer._worker.cancel()
+        self.layout.removeWidget(self.viewer)
+        self.viewer.deleteLater()
+        self.viewer = None
+
+    def memory_estimate(self):
+        if self.viewer is None:
+            return 0
+        return TAB_BASE_BYTES + self.viewer.text_edit.document().characterCount() * TAB_BYTES_PER_CHAR
+
+
+# MLLP-Empfänger: nimmt Nachrichten im Hintergrund an, beantwortet sie mit ACK
+# und zeigt die letzten LISTENER_BUFFER_SIZE Nachrichten an.
+class HL7ListenerView(QWidget):
+    def __init__(self):
+        super().__init__()
+        from hl7_mllp import background_loop, MessageRingBuffer, MLLPServer
+        self._loop = background_loop()
+        self.buffer = MessageRingBuffer(LISTENER_BUFFER_SIZE)
+        self.server = MLLPServer(self.buffer)
+        self._last_seq = 0
+
+        self.layout = QVBoxLayout(self)
+
+        control_layout = QHBoxLayout()
+        self.host_input = QLineEdit("0.0.0.0")
+        self.port_input = QSpinBox()
+        self.port_input.setRange(1, 65535)
+        self.port_input.setValue(2575)
+        self.start_button = QPushButton("Start")
+        self.start_button.clicked.connect(self.toggle_server)
+        self.clear_button = QPushButton("Clear")
+        self.clear_button.clicked.connect(self.clear_messages)
+        self.status_label = QLabel("Stopped")
+        control_layout.addWidget(QLabel("Host:"))
+        control_layout.addWidget(self.host_input)
+        control_layout.addWidget(QLabel("Port:"))
+        control_layout.addWidget(self.port_input)
+        control_layout.addWidget(self.start_button)
+        control_layout.addWidget(self.clear_button)
+        control_layout.addWidget(self.status_label, 1)
+        self.layout.addLayout(control_layout)
+
+        self.splitter = QSplitter(Qt.Horizontal)
+        self.message_list = QListWidget()
+        self.message_list.setUniformItemSizes(True)
+        self.message_list.currentItemChanged.connect(self.show_message)
+
+        self.viewer = HL7Tab("")
+
+        self.splitter.addWidget(self.message_list)
+        self.splitter.addWidget(self.viewer)
+        self.splitter.setStretchFactor(0, 1)
+        self.splitter.setStretchFactor(1, 4)
+        self.splitter.setSizes([300, 1200])
+        self.layout.addWidget(self.splitter)
+
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setInterval(LISTENER_REFRESH_MS)
+        self._refresh_timer.timeout.connect(self.refresh)
+
+    def toggle_server(self):
+        if self.server.is_running():
+            self.stop_server()
+            return
+
+        host = self.host_input.text().strip() or "0.0.0.0"
+        port = self.port_input.value()
+        try:
+            self._loop.submit(self.server.start(host, port)).result(5)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Listener couldn't be started on {host}:{port}:\n{e}")
+            return
+
+        self.host_input.setEnabled(False)
+        self.port_input.setEnabled(False)
+        self.start_button.setText("Stop")
+        self._address = f"{host}:{port}"
+        self._refresh_timer.start()
+        self.refresh()
+
+    def stop_server(self):
+        self._refresh_timer.stop()
+        try:
+            self._loop.submit(self.server.stop()).result(5)
+        except Exception:
+            pass
+        self.refresh()
+        self.host_input.setEnabled(True)
+        self.port_input.setEnabled(True)
+        self.start_button.setText("Start")
+        self.status_label.setText(f"Stopped, {self.buffer.total} messages received")
+
+    # Übernimmt alle seit dem letzten Aufruf empfangenen Nachrichten in einem Schritt
+    def refresh(self):
+        entries = self.buffer.since(self._last_seq)
+        if entries:
+            self._last_seq = entries[-1].seq
+            self.message_list.setUpdatesEnabled(False)
+            for entry in entries:
+                received = time.strftime("%H:%M:%S", time.localtime(entry.received_at))
+                item = QListWidgetItem(f"{entry.seq:>7}  {received}  {entry.ack_code}  {message_summary(entry.text)}")
+                item.setData(Qt.UserRole, entry.text)
+                item.setToolTip(entry.peer)
+                self.message_list.addItem(item)
+            # Liste hält nur so viele Einträge wie der Ringpuffer
+            overflow = self.message_list.count() - self.buffer.size
+            for _ in range(max(0, overflow)):
+                self.message_list.takeItem(0)
+            self.message_list.setUpdatesEnabled(True)
+            if self.message_list.currentRow() < 0:
+                self.message_list.setCurrentRow(0)
+
+        if self.server.is_running():
+            self.status_label.setText(f"Listening on {self._address}: {self.buffer.total} messages, "
+                                      f"{self.server.connections} connections")
+
+    def clear_messages(self):
+        self.buffer.clear()
+        self._last_seq = self.buffer.total
+        self.message_list.clear()
+        self.viewer.text_edit.clear()
+
+    def show_message(self, item, previous=None):
+        if item is None:
+            return
+        message = item.data(Qt.UserRole)
+        self.viewer.text_edit.setPlainText(message.replace("\r\n", "\n").replace("\r", "\n"))
+
+    def release(self):
+        if self.server.is_running():
+            self.stop_server()
+
+
+class LoadTestSignals(QObject):
+    finished = Signal(object)
+
+
+# Lasttest gegen einen MLLP-Empfänger (hl7_load): Vorlagen aus einem Tab oder einer
+# Datei, Werte live je Intervall. Der Lauf selbst liegt im Hintergrund-Loop.
+class HL7LoadTestView(QWidget):
+    def __init__(self, template_text=""):
+        super().__init__()
+        self.template_text = template_text
+        self.test = None
+        self._finished_test = None
+        self._shown_rows = 0
+        self._signals = LoadTestSignals()
+        self._signals.finished.connect(self._on_finished)
+
+        self.layout = QVBoxLayout(self)
+        form_layout = QFormLayout()
+        source_layout = QHBoxLayout()
+        self.source_input = QLineEdit()
+        self.source_input.setPlaceholderText("Message of the current tab" if template_text.strip()
+                                             else "HL7 / batch / MLLP file with template messages")
+        source_button = QPushButton("...")
+        source_button.clicked.connect(self.choose_file)
+        source_layout.addWidget(self.source_input)
+        source_layout.addWidget(source_button)
+        form_layout.addRow("Templates:", source_layout)
+
+        self.host_input = QLineEdit("127.0.0.1")
+        form_layout.addRow("Host/IP:", self.host_input)
+        self.port_input = QSpinBox()
+        self.port_input.setRange(1, 65535)
+        self.port_input.setValue(2575)
+        form_layout.addRow("Port:", self.port_input)
+        self.rate_input = QSpinBox()
+        self.rate_input.setRange(0, 1000000)
+        self.rate_input.setSpecialValueText("as fast as possible")
+        self.rate_input.setSuffix(" msg/s")
+        form_layout.addRow("Rate:", self.rate_input)
+        self.connections_input = QSpinBox()
+        self.connections_input.setRange(1, 256)
+        form_layout.addRow("Connections:", self.connections_input)
+        self.window_input = QSpinBox()
+        self.window_input.setRange(1, 1024)
+        self.window_input.setToolTip("Messages sent per connection before waiting for their ACKs")
+        form_layout.addRow("Window:", self.window_input)
+        self.duration_input = QSpinBox()
+        self.duration_input.setRange(0, 7 * 24 * 3600)
+        self.duration_input.setValue(60)
+        self.duration_input.setSpecialValueText("until stopped")
+        self.duration_input.setSuffix(" s")
+        form_layout.addRow("Duration:", self.duration_input)
+        self.layout.addLayout(form_layout)
+
+        control_layout = QHBoxLayout()
+        self.start_button = QPushButton("Start")
+        self.start_button.clicked.connect(self.toggle_test)
+        self.export_button = QPushButton("Export report")
+        self.export_button.setEnabled(False)
+        self.export_button.clicked.connect(self.export_report)
+        self.status_label = QLabel("Stopped")
+        control_layout.addWidget(self.start_button)
+        control_layout.addWidget(self.export_button)
+        control_layout.addWidget(self.status_label, 1)
+        self.layout.addLayout(control_layout)
+
+        # Ein Eintrag je Intervall, neueste unten
+        self.timeline = QTableWidget(0, 8)
+        self.timeline.setHorizontalHeaderLabels(["Time", "Sent", "ACKs", "msg/s", "p50", "p95", "p99", "NAK / errors"])
+        self.timeline.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.timeline.verticalHeader().hide()
+        self.layout.addWidget(self.timeline)
+
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setInterval(LISTENER_REFRESH_MS)
+        self._refresh_timer.timeout.connect(self.refresh)
+
+    def choose_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Templates", "", "HL7 files (*.hl7 *.txt *.dat *.mllp);;All files (*)")
+        if path:
+            self.source_input.setText(path)
+
+    def _templates(self):
+        from hl7_load import MessageTemplate
+        path = self.source_input.text().strip()
+        texts = read_batch_messages(path) if path else [self.template_text]
+        return [MessageTemplate(text) for text in texts if text.strip()]
+
+    def toggle_test(self):
+        if self.test is not None:
+            self.test.stop()
+            self.start_button.setEnabled(False)
+            self.start_button.setText("Stopping...")
+            return
+
+        from hl7_load import LoadTest
+        from hl7_mllp import background_loop
+        try:
+            templates = self._templates()
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Load test", f"Templates couldn't be read:\n{e}")
+            return
+        if not templates:
+            QMessageBox.warning(self, "Load test", "No template messages.")
+            return
+
+        self.test = LoadTest(templates, self.rate_input.value(), self.connections_input.value(),
+                             self.window_input.value(), self.duration_input.value())
+        host = self.host_input.text().strip() or "127.0.0.1"
+        self._target = f"{host}:{self.port_input.value()}"
+        self._shown_rows = 0
+        self.timeline.setRowCount(0)
+        self.export_button.setEnabled(False)
+        self.start_button.setText("Stop")
+        future = background_loop().submit(self.test.run(host, self.port_input.value()))
+        future.add_done_callback(self._emit_finished)
+        self._refresh_timer.start()
+
+    def _emit_finished(self, future):
+        try:
+            self._signals.finished.emit(future)
+        except RuntimeError:
+            # Tab wurde inzwischen geschlossen
+            pass
+
+    def _on_finished(self, future):
+        self._refresh_timer.stop()
+        self.refresh()
+        self.start_button.setEnabled(True)
+        self.start_button.setText("Start")
+        self.export_button.setEnabled(True)
+        try:
+            future.result()
+        except Exception as e:
+            QMessageBox.critical(self, "Load test", f"Load test failed:\n{e!r}")
+        stats = self.test.stats
+        self.status_label.setText(stats.summary().replace("\n", "   "))
+        self._finished_test = self.test
+        self.test = None
+
+    @staticmethod
+    def _ms(value):
+        return f"{value * 1000:.1f} ms" if value is not None else "-"
+
+    # Neue Intervalle in die Tabelle, Gesamtwerte in die Statuszeile
+    def refresh(self):
+        if self.test is None:
+            return
+        stats = self.test.stats
+        rows = stats.timeline[self._shown_rows:]
+        for row in rows:
+            r = self.timeline.rowCount()
+            self.timeline.insertRow(r)
+            values = (f"{row.elapsed:.0f} s", row.sent, row.acknowledged, f"{row.throughput:.1f}",
+                      self._ms(row.p50), self._ms(row.p95), self._ms(row.p99), f"{row.naks} / {row.errors}")
+            for c, value in enumerate(values):
+                self.timeline.setItem(r, c, QTableWidgetItem(str(value)))
+        if rows:
+            self._shown_rows += len(rows)
+            self.timeline.scrollToBottom()
+        total = stats.snapshot()
+        self.status_label.setText(
+            f"{self._target}: {total.sent} sent, {total.acknowledged} ACKs, {total.throughput:.1f} msg/s, "
+            f"p50 {self._ms(total.p50)}, p95 {self._ms(total.p95)}, p99 {self._ms(total.p99)}, "
+            f"{total.naks} NAK, {total.errors} errors, {stats.connection_errors} failed connects")
+
+    def export_report(self):
+        test = self._finished_test
+        if test is None:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export report", "load-test.json",
+                                              "JSON report (*.json);;CSV timeline (*.csv)")
+        if not path:
+            return
+        try:
+            test.stats.write_report(path, test.config())
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Report couldn't be saved:\n{e}")
+
+    def release(self):
+        self._refresh_timer.stop()
+        if self.test is not None:
+            self.test.stop()
+
+
+# Zuletzt gemessene Dauer pro Stufe in der Statusleiste, Reihenfolge wie im Ablauf
+TIMING_STAGES = (
+    ("parse.tokenize", "tokenize"),
+    ("parse.render", "render"),
+    ("view.cache", "cache"),
+    ("view.legend", "legend"),
+    ("view.document", "document"),
+    ("view.expand", "expand"),
+    ("view.apply", "apply"),
+)
+MLLP_STAGES = (("mllp.connect", "connect"), ("mllp.send", "send"), ("mllp.send_many", "send batch"))
+TIMING_REFRESH_MS = 500
 
 
 # Hauptfenster mit Tab-Verwaltung
@@ -549,24 +1656,414 @@ class HL7Viewer(QMainWindow):
         self.tabs.currentChanged.connect(self.on_tab_changed)
         self.tabs.tabBarDoubleClicked.connect(self.rename_tab)
 
+        self.toolbar = QToolBar("Main")
+        self.addToolBar(self.toolbar)
+        open_batch_action = QAction("Open batch file", self)
+        open_batch_action.triggered.connect(self.open_batch_file)
+        self.toolbar.addAction(open_batch_action)
+        listener_action = QAction("MLLP listener", self)
+        listener_action.triggered.connect(self.open_listener)
+        self.toolbar.addAction(listener_action)
+        load_test_action = QAction("Load test", self)
+        load_test_action.triggered.connect(self.open_load_test)
+        self.toolbar.addAction(load_test_action)
+        compare_action = QAction("Compare tabs", self)
+        compare_action.triggered.connect(self.compare_tabs)
+        self.toolbar.addAction(compare_action)
+        # Abfragen über viele Nachrichten
+        self.query_panel = HL7QueryPanel(self.tab_texts)
+        self.query_dock = QDockWidget("Query", self)
+        self.query_dock.setWidget(self.query_panel)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.query_dock)
+        self.query_dock.hide()
+        query_action = self.query_dock.toggleViewAction()
+        query_action.setText("Query")
+        self.toolbar.addAction(query_action)
+        output_action = QAction("Output panel", self)
+        output_action.setCheckable(True)
+        output_action.setChecked(HL7Tab.output_visible)
+        output_action.toggled.connect(self.toggle_output_panel)
+        self.toolbar.addAction(output_action)
+        self.toolbar.addSeparator()
+        self.timing_action = QAction("Timings", self)
+        self.timing_action.setCheckable(True)
+        self.timing_action.setChecked(hl7_trace.is_enabled())
+        self.timing_action.toggled.connect(self.toggle_timings)
+        self.toolbar.addAction(self.timing_action)
+        export_trace_action = QAction("Export trace", self)
+        export_trace_action.triggered.connect(self.export_trace)
+        self.toolbar.addAction(export_trace_action)
+        self.toolbar.addSeparator()
+        save_session_action = QAction("Save session", self)
+        save_session_action.triggered.connect(self.save_session_as)
+        self.toolbar.addAction(save_session_action)
+        open_session_action = QAction("Open session", self)
+        open_session_action.triggered.connect(self.open_session)
+        self.toolbar.addAction(open_session_action)
+
+        # Suche über alle Tabs
+        self.toolbar.addSeparator()
+        self.search_index = SearchIndex()
+        self._search_tabs = {}
+        self._pending_index = deque()
+        self._index_timer = QTimer(self)
+        self._index_timer.setSingleShot(True)
+        self._index_timer.setInterval(0)
+        self._index_timer.timeout.connect(self._index_pending)
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search all tabs: PID.3=123456, OBX.5~gluc or text")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_input.setMaximumWidth(400)
+        self.search_input.textChanged.connect(lambda: self._search_timer.start())
+        self.search_input.returnPressed.connect(self.next_search_result)
+        self.toolbar.addWidget(self.search_input)
+
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(SEARCH_DELAY_MS)
+        self._search_timer.timeout.connect(self.run_search)
+
+        self.search_results = QListWidget()
+        self.search_results.itemActivated.connect(self.show_search_result)
+        self.search_results.itemClicked.connect(self.show_search_result)
+        self.search_dock = QDockWidget("Search results", self)
+        self.search_dock.setWidget(self.search_results)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.search_dock)
+        self.search_dock.hide()
+
+        # Zeitmessung der Stufen für den aktuellen Tab
+        self.timing_label = QLabel()
+        self.statusBar().addPermanentWidget(self.timing_label)
+        self._timing_timer = QTimer(self)
+        self._timing_timer.setInterval(TIMING_REFRESH_MS)
+        self._timing_timer.timeout.connect(self.refresh_timings)
+        self.toggle_timings(hl7_trace.is_enabled())
+
+        # Aufgebaute Tabs, zuletzt angezeigter am Ende
+        self._realized_tabs = OrderedDict()
+        self.memory_budget = TAB_MEMORY_BUDGET_MB * 1024 * 1024
+
         self.setCentralWidget(self.tabs)
         self.add_tab("New Message")
 
-    def add_tab(self, name="New Message"):
-        new_tab = HL7Tab()
+    def add_tab(self, name="New Message", text=EXAMPLE_HL7, activate=True, search_entries=None):
+        new_tab = LazyHL7Tab(text, search_entries)
+        self.register_search_tab(new_tab)
         index = self.tabs.count() - 1
         self.tabs.insertTab(index, new_tab, name)
+        if activate:
+            self.tabs.setCurrentIndex(index)
+        return new_tab
+
+    # Baut den angezeigten Tab auf und gibt über dem Budget die am längsten
+    # nicht angezeigten wieder frei
+    def _realize_tab(self, tab):
+        tab.realize()
+        self._realized_tabs.pop(tab, None)
+        self._realized_tabs[tab] = None
+
+        total = sum(realized.memory_estimate() for realized in self._realized_tabs)
+        for realized in list(self._realized_tabs):
+            if total <= self.memory_budget:
+                break
+            if realized is tab or not realized.can_release():
+                continue
+            total -= realized.memory_estimate()
+            realized.release()
+            del self._realized_tabs[realized]
+
+    def open_batch_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Open batch file", "", "HL7 files (*.hl7 *.txt *.dat *.mllp);;All files (*)")
+        if not path:
+            return
+        try:
+            view = HL7BatchView(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"File couldn't be opened:\n{e}")
+            return
+        self.register_search_tab(view.viewer)
+        index = self.tabs.count() - 1
+        self.tabs.insertTab(index, view, Path(path).name)
         self.tabs.setCurrentIndex(index)
 
-    def close_tab(self, index):
-        if self.tabs.count() <= 2:
+    # Tabs für die Sitzungsdatei; Listener-Tabs haben keinen dauerhaften Inhalt
+    def session_tabs(self):
+        tabs = []
+        current = 0
+        for index in range(self.tabs.count() - 1):
+            widget = self.tabs.widget(index)
+            name = self.tabs.tabText(index)
+            if index == self.tabs.currentIndex():
+                current = len(tabs)
+            if isinstance(widget, LazyHL7Tab):
+                tabs.append(SessionTab("message", name, widget.text(), widget.search_entries))
+            elif isinstance(widget, HL7BatchView):
+                tabs.append(SessionTab("batch", name, path=widget.batch.path))
+        return tabs, current
+
+    def save_session(self, path):
+        tabs, current = self.session_tabs()
+        write_session(path, tabs, current)
+
+    def save_session_as(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Save session", f"session{SESSION_SUFFIX}",
+                                              f"HL7 Lookup sessions (*{SESSION_SUFFIX})")
+        if not path:
+            return
+        try:
+            self.save_session(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Session couldn't be saved:\n{e}")
+
+    def open_session(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Open session", "", f"HL7 Lookup sessions (*{SESSION_SUFFIX});;All files (*)")
+        if not path:
+            return
+        try:
+            self.restore_session(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Error", f"Session couldn't be opened:\n{e}")
+
+    # Liest die Datensätze komprimiert ein; entpackt werden Nachrichtentexte erst, wenn
+    # der Tab angezeigt wird. Mit replace=True ersetzen die Tabs der Sitzung die vorhandenen.
+    def restore_session(self, path, replace=False):
+        session = SessionFile(path)
+        if not len(session):
+            return
+        session.load()
+
+        # Ein beschädigter Datensatz kostet nur diesen Tab, nicht die ganze Sitzung
+        def read_text(index):
+            try:
+                return session.text(index)
+            except ValueError as e:
+                print("Message of session couldn't be read:", e)
+                return ""
+        previous = [self.tabs.widget(index) for index in range(self.tabs.count() - 1)] if replace else []
+        first = self.tabs.count() - 1
+
+        for index in range(len(session)):
+            name = session.name(index)
+            if session.kind(index) == "batch":
+                try:
+                    view = HL7BatchView(session.batch_path(index))
+                except OSError as e:
+                    print("Batch file of session not found:", e)
+                    continue
+                self.register_search_tab(view.viewer)
+                self.tabs.insertTab(self.tabs.count() - 1, view, name)
+            else:
+                try:
+                    entries = session.entries(index)
+                except ValueError as e:
+                    # Ohne Einträge wird der Text beim Öffnen neu indexiert
+                    print("Search entries of session couldn't be read:", e)
+                    entries = None
+                self.add_tab(name, lambda index=index: read_text(index), False, entries)
+
+        for widget in previous:
+            self.close_tab(self.tabs.indexOf(widget), force=True)
+        self.tabs.setCurrentIndex(min(first - len(previous) + session.current, self.tabs.count() - 2))
+
+    def closeEvent(self, event):
+        self.query_panel.release()
+        if SESSION_AUTOSAVE:
+            try:
+                self.save_session(default_session_path())
+            except OSError as e:
+                print("Session couldn't be saved:", e)
+        super().closeEvent(event)
+
+    # Nachrichtentext eines Tabs; bei Batch- und Listener-Tabs die angezeigte Nachricht
+    def _message_text(self, widget):
+        if isinstance(widget, LazyHL7Tab):
+            return widget.text()
+        viewer = getattr(widget, "viewer", None)
+        return viewer.text_edit.toPlainText() if viewer is not None else None
+
+    def tab_texts(self):
+        return [text for text in (self._message_text(self.tabs.widget(index)) for index in range(self.tabs.count() - 1))
+                if text is not None]
+
+    def compare_tabs(self):
+        candidates = [index for index in range(self.tabs.count() - 1)
+                      if self._message_text(self.tabs.widget(index)) is not None]
+        if len(candidates) < 2:
+            QMessageBox.warning(self, "Compare tabs", "At least two message tabs are needed for a comparison.")
+            return
+        current = candidates.index(self.tabs.currentIndex()) if self.tabs.currentIndex() in candidates else 0
+        dialog = CompareDialog([self.tabs.tabText(index) for index in candidates],
+                               current, (current + 1) % len(candidates), self)
+        if dialog.exec_() == QDialog.Rejected:
+            return
+        left, right = (candidates[choice] for choice in dialog.get_values())
+
+        view = HL7DiffView(self.tabs.tabText(left), self._message_text(self.tabs.widget(left)),
+                           self.tabs.tabText(right), self._message_text(self.tabs.widget(right)))
+        index = self.tabs.count() - 1
+        self.tabs.insertTab(index, view, f"{self.tabs.tabText(left)} ↔ {self.tabs.tabText(right)}")
+        self.tabs.setCurrentIndex(index)
+
+    def open_listener(self):
+        view = HL7ListenerView()
+        self.register_search_tab(view.viewer)
+        index = self.tabs.count() - 1
+        self.tabs.insertTab(index, view, "MLLP listener")
+        self.tabs.setCurrentIndex(index)
+
+    # Die Nachricht des aktuellen Tabs ist die Vorlage, solange keine Datei gewählt ist
+    def open_load_test(self):
+        text = self._message_text(self.tabs.currentWidget()) or ""
+        view = HL7LoadTestView(text)
+        index = self.tabs.count() - 1
+        self.tabs.insertTab(index, view, "Load test")
+        self.tabs.setCurrentIndex(index)
+
+    def toggle_output_panel(self, visible):
+        HL7Tab.output_visible = visible
+        for tab in self.findChildren(HL7Tab):
+            tab.set_output_visible(visible)
+
+    def toggle_timings(self, enabled):
+        hl7_trace.enable(enabled)
+        self.timing_label.setVisible(enabled)
+        if enabled:
+            self._timing_timer.start()
+            self.refresh_timings()
+        else:
+            self._timing_timer.stop()
+
+    def refresh_timings(self):
+        widget = self.tabs.currentWidget()
+        tab = widget if isinstance(widget, HL7Tab) else getattr(widget, "viewer", None)
+        parts = []
+        if tab is not None:
+            durations = hl7_trace.last_durations(id(tab))
+            parts += [f"{label} {durations[name]:.1f} ms" for name, label in TIMING_STAGES if name in durations]
+        durations = hl7_trace.last_durations()
+        parts += [f"{label} {durations[name]:.1f} ms" for name, label in MLLP_STAGES if name in durations]
+        self.timing_label.setText("  |  ".join(parts) or "No timings yet")
+
+    def export_trace(self):
+        path, selected = QFileDialog.getSaveFileName(self, "Export trace", "hl7-lookup-trace.json",
+                                                     "Chrome trace (*.json);;Summary JSON (*.json)")
+        if not path:
+            return
+        try:
+            if selected.startswith("Summary"):
+                hl7_trace.export_json(path)
+            else:
+                hl7_trace.export_chrome_trace(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Trace couldn't be written:\n{e}")
+
+    def close_tab(self, index, force=False):
+        if self.tabs.count() <= 2 and not force:
             QMessageBox.warning(self, "Attention!", "At least One Tab must be kept open!")
             return
+        widget = self.tabs.widget(index)
         self.tabs.removeTab(index)
+        if isinstance(widget, (HL7BatchView, HL7ListenerView, HL7LoadTestView)):
+            widget.release()
+        if isinstance(widget, LazyHL7Tab):
+            widget.release()
+            self._realized_tabs.pop(widget, None)
+            tab = widget
+        else:
+            tab = widget if isinstance(widget, HL7Tab) else getattr(widget, "viewer", None)
+        if tab is not None:
+            self._search_tabs.pop(id(tab), None)
+            self.search_index.remove(id(tab))
+            self._search_timer.start()
+        widget.deleteLater()
+
+    # Der Index eines Tabs wird nach jedem Parsen ersetzt, die übrigen bleiben unverändert
+    def register_search_tab(self, tab):
+        self._search_tabs[id(tab)] = tab
+        tab.parsed.connect(lambda: self._update_search_index(tab))
+        # Nicht aufgebaute Tabs bringen ihre Einträge schon mit; sie werden nach und
+        # nach aus der Event-Loop indexiert, damit z.B. eine Sitzung sofort erscheint
+        if tab.search_entries:
+            self._pending_index.append(tab)
+            self._index_timer.start()
+
+    def _index_pending(self, limit=SEARCH_INDEX_BATCH):
+        while self._pending_index and limit:
+            tab = self._pending_index.popleft()
+            limit -= 1
+            if id(tab) in self._search_tabs and id(tab) not in self.search_index:
+                self.search_index.update(id(tab), tab.search_entries)
+        if self._pending_index:
+            self._index_timer.start()
+
+    def _update_search_index(self, tab):
+        if id(tab) not in self._search_tabs:
+            return
+        self.search_index.update(id(tab), tab.search_entries)
+        if self.search_input.text().strip():
+            self._search_timer.start()
+
+    def _container_index(self, tab):
+        for index in range(self.tabs.count() - 1):
+            widget = self.tabs.widget(index)
+            if widget is tab or getattr(widget, "viewer", None) is tab:
+                return index
+        return -1
+
+    def run_search(self):
+        query = self.search_input.text()
+        self.search_results.clear()
+        if not query.strip():
+            self.search_dock.hide()
+            return
+
+        with hl7_trace.span("search.query"):
+            self._index_pending(len(self._pending_index))
+            matches = self.search_index.search(query)
+        for match in matches:
+            tab = self._search_tabs.get(match.doc_id)
+            index = self._container_index(tab)
+            if index < 0:
+                continue
+            value = match.value if len(match.value) <= 80 else match.value[:77] + "..."
+            item = QListWidgetItem(f"{self.tabs.tabText(index)}  {match.path}  {value}")
+            item.setData(Qt.UserRole, match)
+            self.search_results.addItem(item)
+
+        self.search_dock.setWindowTitle(f"Search results ({self.search_results.count()})")
+        self.search_dock.show()
+
+    def next_search_result(self):
+        self._search_timer.stop()
+        if not self.search_results.count():
+            self.run_search()
+        count = self.search_results.count()
+        if not count:
+            return
+        row = (self.search_results.currentRow() + 1) % count
+        self.search_results.setCurrentRow(row)
+        self.show_search_result(self.search_results.item(row))
+
+    def show_search_result(self, item):
+        match = item.data(Qt.UserRole)
+        tab = self._search_tabs.get(match.doc_id)
+        index = self._container_index(tab)
+        if index < 0:
+            return
+        self.tabs.setCurrentIndex(index)
+        if isinstance(tab, LazyHL7Tab):
+            tab = tab.viewer
+        # Position stimmt nur, solange der Tab nicht weiter bearbeitet wurde
+        if match.end <= len(tab.text_edit.toPlainText()):
+            tab.highlight_range(match.start, match.end)
 
     def on_tab_changed(self, index):
         if index == self.tabs.count() - 1:
             self.add_tab()
+            return
+        widget = self.tabs.widget(index)
+        if isinstance(widget, LazyHL7Tab):
+            self._realize_tab(widget)
 
     def rename_tab(self, index):
         if index == self.tabs.count() - 1:
@@ -582,10 +2079,37 @@ def resource_path(relative_path: str) -> str:
         return str(Path(sys._MEIPASS) / relative_path)
     return str(Path(__file__).parent / relative_path)
 
-def main():
-    app = QApplication(sys.argv)
-
-    # ===== FONT LADEN =====
+# Misst die Zeit bis zum ersten Zeichnen des Hauptfensters und ruft danach
+# `on_first_paint` auf (Schrift und Stylesheet), damit das Fenster sofort erscheint
+class StartupProbe(QObject):
+    def __init__(self, window, on_first_paint):
+        super().__init__(window)
+        self.phases = []
+        self._on_first_paint = on_first_paint
+        self._painted = False
+        window.installEventFilter(self)
+
+    def mark(self, phase):
+        self.phases.append((phase, time.perf_counter()))
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and not self._painted:
+            self._painted = True
+            self.mark("first paint")
+            obj.removeEventFilter(self)
+            QTimer.singleShot(0, self._on_first_paint)
+        return False
+
+    def report(self):
+        lines = []
+        previous = STARTUP_BEGIN
+        for phase, stamp in self.phases:
+            lines.append(f"{phase:<14} +{(stamp - previous) * 1000:7.1f} ms  {(stamp - STARTUP_BEGIN) * 1000:7.1f} ms")
+            previous = stamp
+        return "\n".join(lines)
+
+
+def load_application_font(app):
     font_path = resource_path("SourceCodePro-Light.ttf")
     font_id = QFontDatabase.addApplicationFont(font_path)
     families = QFontDatabase.applicationFontFamilies(font_id)
@@ -601,7 +2125,8 @@ def main():
         print("Fehler: Font konnte nicht geladen werden")
         app.setFont(QFont("JetBrains Mono", 10))  # Fallback
 
-    # ===== STYLESHEET LADEN =====
+
+def apply_stylesheet(app):
     stylesheet_path = resource_path("stylesheet.qss")
     stylesheet_file = QFile(stylesheet_path)
 
@@ -617,21 +2142,56 @@ def main():
         else:
             print("Stylesheet couldn't be opened.")
 
-
     # Breeze-Style aktivieren
     app.setStyle("breeze")
 
-    
+
+def main():
+    # --startup-time: Phasen bis zum ersten Zeichnen ausgeben und beenden
+    measure_startup = "--startup-time" in sys.argv
+    if measure_startup:
+        sys.argv.remove("--startup-time")
+
+    imported = time.perf_counter()
+    app = QApplication(sys.argv)
+
     # Icon setzen (kompatibel mit PyInstaller)
     base_path = getattr(sys, '_MEIPASS', Path(__file__).parent)
     icon_path = Path(base_path) / "hl7.ico"  # "icon.ico" für Windows
     app.setWindowIcon(QIcon(str(icon_path)))
 
+    created = time.perf_counter()
     viewer = HL7Viewer()
     viewer.setWindowIcon(QIcon(str(icon_path)))
+    session_path = default_session_path()
+    if SESSION_AUTOSAVE and session_path.exists():
+        try:
+            viewer.restore_session(session_path, replace=True)
+        except (OSError, ValueError) as e:
+            print("Session couldn't be restored:", e)
+
+    # ===== FONT UND STYLESHEET ERST NACH DEM ERSTEN ZEICHNEN =====
+    def finish_startup():
+        load_application_font(app)
+        apply_stylesheet(app)
+        probe.mark("styled")
+        if measure_startup:
+            QTimer.singleShot(0, report_startup)
+
+    def report_startup():
+        probe.mark("styled paint")
+        print(probe.report())
+        app.quit()
+
+    probe = StartupProbe(viewer, finish_startup)
+    probe.phases += [("imports", imported), ("QApplication", created), ("window", time.perf_counter())]
     viewer.show()
 
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        # Prozess-Pool der Validierung in der gebauten Anwendung
+        import multiprocessing
+        multiprocessing.freeze_support()
     main()
@@ -5,7 +5,8 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[('C:\\Users\\leon.haase\\AppData\\Roaming\\Python\\Python313\\site-packages\\hl7apy', 'hl7apy'), ('C:\\Users\\leon.haase\\Desktop\\Archive\\stylesheet.qss', '.'), ('C:\\Users\\leon.haase\\Desktop\\Archive\\SourceCodePro-Light.ttf', '.'), ('hl7.ico', '.')],
+    # definitions/ vorher mit `python hl7_definitions.py` erzeugen
+    datas=[('C:\\Users\\leon.haase\\AppData\\Roaming\\Python\\Python313\\site-packages\\hl7apy', 'hl7apy'), ('C:\\Users\\leon.haase\\Desktop\\Archive\\stylesheet.qss', '.'), ('C:\\Users\\leon.haase\\Desktop\\Archive\\SourceCodePro-Light.ttf', '.'), ('hl7.ico', '.'), ('definitions', 'definitions')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
@@ -0,0 +1,40 @@
+import pickle
+
+import pytest
+
+from hl7_definitions import DataDictionary, write_dictionary_file
+
+
+SEGMENTS = {
+    "ZZZ": ((1, "SET_ID", "SI", ()),
+            (2, "PATIENT_NAME", "XPN", (("FAMILY_NAME", "FN"), ("GIVEN_NAME", "ST"))),
+            (3, "DELAYED_ACKNOWLEDGMENT_TYPE", None, ())),
+}
+
+
+def test_dictionary_round_trip(tmp_path):
+    path = tmp_path / "definitions.bin"
+    write_dictionary_file(path, SEGMENTS)
+    dictionary = DataDictionary("2.5", path)
+    assert "ZZZ" in dictionary and "PID" not in dictionary
+    fields = dictionary.segment("ZZZ").fields
+    assert fields[2].name == "Patient Name"
+    assert fields[2].components[2] == "    ZZZ‑2.2 – Given Name"
+    assert fields[3].datatype is None
+
+
+# Die Cache-Datei kommt aus einem beschreibbaren Ordner: pickle-Daten werden nie geladen
+def test_pickle_file_is_rejected(tmp_path):
+    path = tmp_path / "definitions.bin"
+    index = pickle.dumps({"ZZZ": (0, 1)})
+    path.write_bytes(len(index).to_bytes(8, "little") + index + b"x")
+    with pytest.raises(ValueError):
+        DataDictionary("2.5", path)
+
+
+def test_invalid_segment_falls_back_to_curated_labels(tmp_path):
+    path = tmp_path / "definitions.bin"
+    write_dictionary_file(path, {"ZZZ": ((1, "SET_ID", "SI", ()),)})
+    data = path.read_bytes().replace(b'"SET_ID"', b'{"a":1}!')
+    path.write_bytes(data)
+    assert DataDictionary("2.5", path).segment("ZZZ").fields == ()
@@ -0,0 +1,26 @@
+from hl7_diff import diff_messages
+
+
+def _message(separator, pid_name):
+    segments = ["MSH|^~\\&|A|B|C|D|20240501||ORU^R01|1|P|2.5", f"PID|1||123456||{pid_name}",
+                "OBX|1|ST|CODE||5", "OBX|2|ST|CODE||6"]
+    return "\r".join(segments).replace("|", separator) + "\r"
+
+
+# Mit einem anderen Feldtrenner in MSH-1 müssen die Segmentnamen trotzdem stimmen
+def test_non_default_field_separator():
+    left = _message("#", "DOE^JOHN")
+    right = _message("#", "DOE^JANE").replace("OBX#2#ST#CODE##6\r", "NTE#1##note\rOBX#2#ST#CODE##7\r")
+    differences = diff_messages(left, right)
+    assert [(d.kind, d.path) for d in differences] == [
+        ("changed", "PID.5.2"), ("added", "NTE"), ("changed", "OBX.5")]
+    changed = differences[0]
+    assert left[changed.left[0]:changed.left[1]] == "JOHN"
+    assert right[changed.right[0]:changed.right[1]] == "JANE"
+
+
+def test_same_result_as_default_separator():
+    left, right = _message("|", "DOE^JOHN"), _message("|", "DOE^JANE")
+    expected = [(d.kind, d.path) for d in diff_messages(left, right)]
+    left, right = _message("#", "DOE^JOHN"), _message("#", "DOE^JANE")
+    assert [(d.kind, d.path) for d in diff_messages(left, right)] == expected == [("changed", "PID.5.2")]
@@ -0,0 +1,29 @@
+from hl7_parser import read_delimiters, tokenize_hl7, unescape
+
+
+def _field_values(text, segment):
+    return [text[field.start:field.end] for field in segment.fields]
+
+
+# Ein einzelnes Escape-Zeichen (z.B. Windows-Pfad) darf keine Trennzeichen verschlucken
+def test_unterminated_escape_character_keeps_following_fields():
+    text = "MSH|^~\\&|A\rOBX|1|TX|||C:\\temp|F|x\r"
+    segments = tokenize_hl7(text)
+    assert _field_values(text, segments[1]) == ["1", "TX", "", "", "C:\\temp", "F", "x"]
+
+
+def test_unterminated_escape_character_in_bytes():
+    text = b"MSH|^~\\&|A\rOBX|1|TX|||C:\\temp^a|F\r"
+    segments = tokenize_hl7(text, read_delimiters(text))
+    obx5 = segments[1].fields[4].repetitions[0]
+    assert [text[start:end] for start, end in obx5.components] == [b"C:\\temp", b"a"]
+    assert len(segments[1].fields) == 6
+
+
+def test_escape_sequences_are_decoded_by_unescape_only():
+    text = "MSH|^~\\&|A\rNTE|1||a\\F\\b^c|z\r"
+    delimiters = read_delimiters(text)
+    nte3 = tokenize_hl7(text, delimiters)[1].fields[2].repetitions[0]
+    values = [text[start:end] for start, end in nte3.components]
+    assert values == ["a\\F\\b", "c"]
+    assert unescape(values[0], delimiters) == "a|b"
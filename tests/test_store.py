@@ -0,0 +1,29 @@
+from hl7_store import MessageStore
+
+
+MESSAGES = [
+    "MSH|^~\\&|A|B|C|D|20240501||ADT^A01|1|P|2.5\rPID|1||123456\r",
+    "MSH|^~\\&|A|B|C|D|20240501||ADT^A01|2|P|2.5\rPID|1||654321^^^HOSP^MR\r",
+    "MSH|^~\\&|A|B|C|D|20240501||ORU^R01|3|P|2.5\rPID|1||777&X^^^HOSP\r",
+]
+
+
+def _store():
+    store = MessageStore()
+    store.ingest(MESSAGES)
+    return store
+
+
+# Ein Feld ohne ^ ist seine eigene erste Komponente
+def test_single_component_field_counts_as_component_1():
+    store = _store()
+    assert {row[0]: row[1] for row in store.query("top PID.3.1").rows} == {"123456": 1, "654321": 1, "777&X": 1}
+    assert store.query("nulls PID.3.1").rows == [("PID.3.1", 3, 0, "0.0%")]
+    assert store.query("messages where PID.3.1=123456").rows == [(1, 3)]
+    assert store.query("messages where MSH.9.1=ADT").rows == [(2, 3)]
+
+
+def test_subcomponents_only_where_present():
+    store = _store()
+    assert store.query("top PID.3.1.1").rows[0][:2] == ("777", 1)
+    assert store.query("count PID.3.1.2").rows == [("PID.3.1.2", 1, 1, 1)]